@@ -0,0 +1,498 @@
+from __future__ import print_function
+from kipet.library.CasadiSimulator import *
+import casadi as ca
+import numpy as np
+import pandas as pd
+import multiprocessing
+import warnings
+import time
+
+
+class CasadiParameterEstimator(CasadiSimulator):
+    """Reduced-space parameter estimator for concentration data.
+
+    Single shooting on a casadi model created with TemplateBuilder.create_casadi_model:
+    only the parameters are optimization variables. For every parameter value the
+    states are integrated with a casadi integrator, the derivatives of the states
+    with respect to the parameters are obtained with the forward sensitivities of
+    the integrator, and the parameters are updated with Levenberg-Marquardt steps.
+
+    Parameters given a value in the builder are kept fixed. The remaining parameters
+    are estimated starting from their initial guess (init) or from their bounds.
+
+    For long horizons the multiple shooting method splits the horizon in segments
+    that are integrated in parallel and coupled through continuity constraints.
+
+    Attributes:
+        model (CasadiModel): casadi model with concentration data
+
+        _parameter_names (list): names of the estimated parameters
+    """
+
+    def __init__(self, model):
+        super(CasadiParameterEstimator, self).__init__(model)
+        self._concentration_given = hasattr(self.model, 'C_data')
+        self._parameter_names = [name for name in self.model.parameter_names
+                                 if isinstance(self.model.P[name], ca.SX)]
+
+    def run_opt(self, solver, **kwds):
+        """Estimates the parameters from the concentration data.
+
+        Args:
+            solver (str): name of the integrator (cvodes or idas)
+
+            **kwds: Arbitrary keyword arguments
+            variances (dict): map from component name to the variance of its measurements
+
+            subset_components (list): components used in the objective. Default all
+
+            covariance (bool): flag to compute the Gauss-Newton covariance of the parameters
+            (needs the variances of all the components). Default False
+
+            tee (bool): flag to print the iterations. Default False
+
+            max_iter (int): maximum number of iterations. Default 100
+
+            tol (float): relative change of the objective and of the parameters below which
+            the method stops. Default 1e-8
+
+            solver_opts (dict): options passed to the integrator
+
+            compile_rhs (bool): flag to integrate with a compiled right-hand side. See CasadiSimulator.run_sim
+
+            codegen_dir (str): folder where compiled libraries are cached
+
+            method (str): 'single_shooting' (Levenberg-Marquardt on the parameters) or
+            'multiple_shooting' (the horizon is split in segments integrated in parallel and
+            coupled by continuity constraints in a small NLP solved with ipopt).
+            Default 'single_shooting'
+
+            segment_times (list): times where the horizon is split (multiple shooting).
+            Default n_segments segments with boundaries at measurement times
+
+            n_segments (int): number of segments if segment_times is not given (multiple shooting).
+            Default n_workers
+
+            n_workers (int): number of threads integrating the segments (multiple shooting).
+            Default number of cores
+
+            jump_states (dict): discrete jumps of the states, e.g. {'Z': {'A': 0.01}} (multiple shooting)
+
+            jump_times (dict): times of the jumps, e.g. {'Z': {'A': 3.6}}. They become segment
+            boundaries (multiple shooting)
+
+            feed_times (list): additional segment boundaries (multiple shooting)
+
+            nlp_opts (dict): options passed to casadi nlpsol (multiple shooting)
+
+        Returns:
+            Results object with loaded results. P holds the estimates and, if covariance
+            is True, covariance the covariance matrix of the estimated parameters
+
+        """
+        variances = kwds.pop('variances', dict())
+        species_list = kwds.pop('subset_components', None)
+        covariance = kwds.pop('covariance', False)
+        tee = kwds.pop('tee', False)
+        max_iter = kwds.pop('max_iter', 100)
+        tol = kwds.pop('tol', 1e-8)
+        solver_opts = kwds.pop('solver_opts', dict())
+        compile_rhs = kwds.pop('compile_rhs', False)
+        codegen_dir = kwds.pop('codegen_dir', None)
+        method = kwds.pop('method', 'single_shooting')
+        segment_times = kwds.pop('segment_times', None)
+        n_segments = kwds.pop('n_segments', None)
+        n_workers = kwds.pop('n_workers', None)
+        jump_states = kwds.pop('jump_states', None)
+        jump_times = kwds.pop('jump_times', None)
+        feed_times = kwds.pop('feed_times', None)
+        nlp_opts = kwds.pop('nlp_opts', dict())
+
+        if not self._concentration_given:
+            raise RuntimeError('Parameter estimation with CasadiParameterEstimator requires concentration data')
+        if not self._parameter_names:
+            raise RuntimeError('All parameters are fixed. Nothing to estimate')
+        if method not in ['single_shooting', 'multiple_shooting']:
+            raise RuntimeError('method must be single_shooting or multiple_shooting')
+        if method == 'single_shooting' and jump_states:
+            raise RuntimeError('Discrete jumps require method=multiple_shooting')
+
+        if species_list is None:
+            list_components = [k for k in self._mixture_components]
+        else:
+            list_components = list()
+            for k in species_list:
+                if k in self._mixture_components:
+                    list_components.append(k)
+                else:
+                    warnings.warn("Ignored {} since is not a mixture component of the model".format(k))
+
+        all_sigma_specified = all(k in variances for k in list_components)
+        if covariance and not all_sigma_specified:
+            raise RuntimeError('All variances must be specified to determine covariance matrix.\n '
+                               'Please pass variance dictionary to run_opt')
+        default_variance = max(variances.values()) if variances else 1.0
+        sigmas = np.array([variances.get(k, default_variance) for k in list_components]) ** 0.5
+
+        names = self._parameter_names
+        bounds = self._parameter_bounds()
+        theta = np.clip(self._initial_parameters(), *bounds)
+
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        boundary_times = list()
+        if method == 'multiple_shooting':
+            boundary_times = self._segment_boundaries(segment_times, n_segments or n_workers,
+                                                      jump_times, feed_times)
+
+        system = self._system_expressions(dict(), parameters=names)
+        state_names = system['state_names']
+        times = sorted(set(self._times).union(self._meas_times, [self.model.start_time], boundary_times))
+
+        opts = {'verbose': False}
+        opts.update(solver_opts)
+        codegen = dict(directory=codegen_dir) if compile_rhs else None
+
+        # measured entries of the state grid: time index, state index, value and weight
+        measured = dict()
+        measured['times'] = np.repeat([times.index(t) for t in self._meas_times], len(list_components))
+        measured['states'] = np.tile([state_names.index(k) for k in list_components], self._n_meas_times)
+        measured['data'] = np.array([[self.model.C_data[t, k] for k in list_components]
+                                     for t in self._meas_times]).ravel()
+        measured['scaling'] = np.tile(1.0 / sigmas, self._n_meas_times)
+
+        start = time.time()
+        if method == 'multiple_shooting':
+            jumps = self._jump_vectors(jump_states, jump_times, boundary_times, state_names)
+            solution = self._solve_multiple_shooting(solver, opts, codegen, system, times, theta, bounds,
+                                                     measured, boundary_times, jumps, n_workers,
+                                                     nlp_opts, tee, max_iter, tol)
+        else:
+            solution = self._solve_single_shooting(solver, opts, codegen, system, times, theta, bounds,
+                                                   measured, tee, max_iter, tol)
+        theta, objective, jac, n_iter, results = solution
+
+        for i, name in enumerate(names):
+            self.model.P[name] = float(theta[i])
+
+        results.C = pd.DataFrame(data=measured['data'].reshape((self._n_meas_times, len(list_components))),
+                                 columns=list_components,
+                                 index=self._meas_times)
+        param_vals = dict()
+        for name in self.model.parameter_names:
+            param_vals[name] = float(self.model.P[name])
+        results.P = param_vals
+        results.solver_statistics['objective'] = float(objective)
+        results.solver_statistics['iterations'] = n_iter
+        results.solver_statistics['time'] = time.time() - start
+
+        if covariance:
+            results.covariance = self._compute_covariance_GN(jac, theta)
+        return results
+
+    def _solve_single_shooting(self, solver, opts, codegen, system, times, theta, bounds,
+                               measured, tee, max_iter, tol):
+        """Levenberg-Marquardt iterations on the parameters (single shooting).
+
+           This method is not intended to be used by users directly
+
+        Returns:
+            tuple (estimates, objective, weighted residual jacobian, iterations, ResultsObject)
+
+        """
+        n_times = len(times)
+        n_states = system['states'].numel()
+        lower, upper = bounds
+        all_steps, p_grid, fixed_values = self._grid_integrator(solver, opts, system, times, 'constant',
+                                                                codegen=codegen)
+        positions = measured['times'] * n_states + measured['states']
+        data = measured['data']
+        scaling = measured['scaling']
+
+        # states and their sensitivities (forward mode through the integrator)
+        theta_sym = ca.MX.sym('theta', theta.size)
+        x_grid = all_steps(system['x_0'], system['y_0'], p_grid, theta_sym)[0]
+        x_vec = ca.reshape(x_grid, n_states * n_times, 1)
+        simulate = ca.Function('simulate', [theta_sym], [x_vec])
+        sensitivities = ca.Function('sensitivities', [theta_sym], [x_vec, ca.jacobian(x_vec, theta_sym)])
+
+        def residuals(values, with_jacobian=False):
+            if with_jacobian:
+                x, dxdp = sensitivities(values)
+                x = np.array(x).ravel()
+                jac = -np.array(dxdp)[positions, :] * scaling[:, None]
+            else:
+                x = np.array(simulate(values)).ravel()
+                jac = None
+            res = (data - x[positions]) * scaling
+            if np.isnan(res).any():
+                raise RuntimeError('The integrator returned nan')
+            return res, jac
+
+        res, jac = residuals(theta, with_jacobian=True)
+        objective = res.dot(res)
+        mu = 1e-3
+        n_iter = 0
+        if tee:
+            print('{: >5} {: >16} {: >12} {: >12}'.format('iter', 'objective', 'step', 'lambda'))
+            print('{: >5} {: >16.8e} {: >12} {: >12.2e}'.format(0, objective, '-', mu))
+        for n_iter in range(1, max_iter + 1):
+            jtj = jac.T.dot(jac)
+            grad = jac.T.dot(res)
+            accepted = False
+            while mu < 1e12:
+                # Marquardt scaling of the damping term
+                damping = mu * np.diag(np.maximum(np.diag(jtj), 1e-12))
+                step = np.linalg.solve(jtj + damping, -grad)
+                trial = np.clip(theta + step, lower, upper)
+                try:
+                    trial_res, _ = residuals(trial)
+                    trial_objective = trial_res.dot(trial_res)
+                except RuntimeError:
+                    trial_objective = np.inf
+                if trial_objective < objective:
+                    accepted = True
+                    mu = max(mu / 3.0, 1e-12)
+                    break
+                mu *= 4.0
+            if not accepted:
+                break
+            step_norm = np.linalg.norm(trial - theta) / max(np.linalg.norm(theta), 1e-12)
+            decrease = (objective - trial_objective) / max(objective, 1e-300)
+            theta = trial
+            objective = trial_objective
+            res, jac = residuals(theta, with_jacobian=True)
+            if tee:
+                print('{: >5} {: >16.8e} {: >12.4e} {: >12.2e}'.format(n_iter, objective, step_norm, mu))
+            if decrease < tol or step_norm < tol:
+                break
+
+        if tee:
+            print('Finished after {} iterations. objective {}'.format(n_iter, objective))
+        if n_iter == max_iter:
+            warnings.warn('CasadiParameterEstimator reached the maximum number of iterations')
+
+        results = self._trajectory_results(system, all_steps, p_grid, fixed_values, times, theta)
+        return theta, objective, jac, n_iter, results
+
+    def _solve_multiple_shooting(self, solver, opts, codegen, system, times, theta, bounds, measured,
+                                 boundary_times, jumps, n_workers, nlp_opts, tee, max_iter, tol):
+        """Multiple shooting estimation.
+
+           The grid is split at the boundary times. Every segment starts from its own
+           state (a variable of the NLP, except the initial conditions of the first one)
+           and all segments are integrated together by a thread-parallel casadi map.
+           Continuity constraints (plus the jumps) couple the end of each segment with the
+           start of the next. The NLP is solved with ipopt and a Gauss-Newton hessian.
+           This method is not intended to be used by users directly
+
+        Returns:
+            tuple (estimates, objective, weighted residual jacobian, iterations, ResultsObject)
+
+        """
+        n_states = system['states'].numel()
+        n_unfixed = system['algebraics'].numel()
+        n_theta = theta.size
+        lower, upper = bounds
+
+        # grid columns integrated by each segment. The first one also takes the step that
+        # finds consistent algebraics at the start time
+        limits = [0] + [times.index(t) for t in boundary_times] + [len(times) - 1]
+        segment_columns = [np.arange(0, limits[1] + 1)]
+        for k in range(1, len(limits) - 1):
+            segment_columns.append(np.arange(limits[k] + 1, limits[k + 1] + 1))
+        n_seg = len(segment_columns)
+        n_max = max(len(c) for c in segment_columns)
+
+        added_times = [t for t in boundary_times if t not in self._times]
+        all_steps, p_grid, fixed_values = self._grid_integrator(solver, opts, system, times, 'constant',
+                                                                codegen=codegen, n_steps=n_max,
+                                                                interpolated_times=added_times)
+
+        # steps of all segments side by side, padded with zero length steps
+        n_p = p_grid.shape[0]
+        p_segments = np.zeros((n_p, n_seg * n_max))
+        grid_columns = np.zeros(len(times), dtype=int)
+        for k, columns in enumerate(segment_columns):
+            block = p_grid[:, columns]
+            padding = np.tile(block[:, -1:], (1, n_max - len(columns)))
+            padding[0, :] = 0.0
+            padding[1, :] = block[1, -1] + block[0, -1]
+            p_segments[:, k * n_max:(k + 1) * n_max] = np.hstack((block, padding))
+            grid_columns[columns] = k * n_max + np.arange(len(columns))
+
+        x0_sym = ca.MX.sym('x0', n_states)
+        p_sym = ca.MX.sym('p', n_p, n_max)
+        theta_sym = ca.MX.sym('theta', n_theta)
+        x_seg, z_seg = all_steps(x0_sym, system['y_0'], p_sym, theta_sym)
+        segment = ca.Function('segment', [x0_sym, p_sym, theta_sym], [x_seg, z_seg])
+        segments = segment.map(n_seg, 'thread', max(1, n_workers))
+
+        # starting states of the segments from a simulation with the initial parameters
+        nodes_0 = np.tile(system['x_0'].reshape((n_states, 1)), (1, n_seg - 1))
+        try:
+            x_k = system['x_0']
+            for k in range(n_seg - 1):
+                x_end = np.array(segment(x_k, p_segments[:, k * n_max:(k + 1) * n_max], theta)[0])[:, -1]
+                if np.isnan(x_end).any():
+                    break
+                x_k = x_end + jumps[:, k]
+                nodes_0[:, k] = x_k
+        except RuntimeError:
+            warnings.warn('Simulation with the initial parameters failed. Segments start at the initial conditions')
+
+        w_theta = ca.MX.sym('w_theta', n_theta)
+        w_nodes = ca.MX.sym('w_nodes', n_states, n_seg - 1)
+        w = ca.vertcat(w_theta, ca.reshape(w_nodes, -1, 1))
+        x_starts = ca.horzcat(system['x_0'], w_nodes)
+        x_all, z_all = segments(x_starts, p_segments, w_theta)
+        positions = grid_columns[measured['times']] * n_states + measured['states']
+        r = (measured['data'] - ca.reshape(x_all, -1, 1)[list(positions)]) * measured['scaling']
+        if n_seg > 1:
+            ends = ca.horzcat(*[x_all[:, k * n_max + n_max - 1] for k in range(n_seg - 1)])
+        else:
+            # a single segment has no continuity constraints
+            ends = ca.MX(n_states, 0)
+        g = ca.reshape(ends + jumps - w_nodes, -1, 1)
+
+        jac_r = ca.jacobian(r, w)
+        lam_f = ca.MX.sym('lam_f')
+        lam_g = ca.MX.sym('lam_g', g.numel())
+        gauss_newton = ca.Function('nlp_hess_l', [w, ca.MX.sym('p', 0), lam_f, lam_g],
+                                   [ca.triu(2 * lam_f * ca.mtimes(jac_r.T, jac_r))])
+        options = {'hess_lag': gauss_newton,
+                   'print_time': bool(tee),
+                   'ipopt.print_level': 5 if tee else 0,
+                   'ipopt.max_iter': max_iter,
+                   'ipopt.tol': tol}
+        options.update(nlp_opts)
+        nlp = ca.nlpsol('multiple_shooting', 'ipopt', {'x': w, 'f': ca.dot(r, r), 'g': g}, options)
+
+        n_nodes = n_states * (n_seg - 1)
+        lbx = np.concatenate((lower, -np.inf * np.ones(n_nodes)))
+        ubx = np.concatenate((upper, np.inf * np.ones(n_nodes)))
+        w_0 = np.concatenate((theta, nodes_0.ravel(order='F')))
+        solution = nlp(x0=w_0, lbx=lbx, ubx=ubx, lbg=0.0, ubg=0.0)
+        stats = nlp.stats()
+        if not stats.get('success', True):
+            warnings.warn('Multiple shooting NLP: {}'.format(stats.get('return_status')))
+        w_opt = np.array(solution['x']).ravel()
+        theta = w_opt[:n_theta]
+        objective = float(solution['f'])
+
+        # parameter sensitivities of the residuals with the nodes eliminated through the
+        # linearized continuity constraints
+        jacobians = ca.Function('jacobians', [w], [jac_r, ca.jacobian(g, w)])
+        jac_r_opt, jac_g_opt = [np.array(ca.DM(v)) for v in jacobians(w_opt)]
+        if n_nodes:
+            dnodes = -np.linalg.solve(jac_g_opt[:, n_theta:], jac_g_opt[:, :n_theta])
+            jac = jac_r_opt[:, :n_theta] + jac_r_opt[:, n_theta:].dot(dnodes)
+        else:
+            jac = jac_r_opt
+
+        x_starts_opt = np.hstack((system['x_0'].reshape((n_states, 1)),
+                                  w_opt[n_theta:].reshape((n_states, n_seg - 1), order='F')))
+        x_opt, z_opt = segments(x_starts_opt, p_segments, theta)
+        x_grid = np.array(x_opt).reshape((n_states, n_seg * n_max))[:, grid_columns]
+        y_grid = np.array(z_opt).reshape((n_unfixed, n_seg * n_max))[:, grid_columns]
+        results = self._load_trajectories(system, x_grid, y_grid, fixed_values, times, theta)
+        results.solver_statistics['segments'] = n_seg
+        results.solver_statistics['continuity_violation'] = float(np.abs(np.array(solution['g'])).max()) \
+            if n_nodes else 0.0
+        return theta, objective, jac, stats.get('iter_count'), results
+
+    def _segment_boundaries(self, segment_times, n_segments, jump_times, feed_times):
+        """Returns the times where the horizon is split for multiple shooting.
+
+           This method is not intended to be used by users directly
+
+        """
+        first = self.model.start_time
+        last = self._meas_times[-1]
+        if segment_times is None:
+            n_segments = max(1, min(n_segments, self._n_meas_times))
+            segment_times = [self._meas_times[int(round(i * self._n_meas_times / float(n_segments)))]
+                             for i in range(1, n_segments)]
+        boundaries = set(segment_times)
+        if jump_times:
+            for times in jump_times.values():
+                boundaries.update(times.values())
+        if feed_times:
+            boundaries.update(feed_times)
+        return sorted(t for t in boundaries if first < t < last)
+
+    def _jump_vectors(self, jump_states, jump_times, boundary_times, state_names):
+        """Returns the jumps of the states at each segment boundary (states x boundaries).
+
+           This method is not intended to be used by users directly
+
+        """
+        jumps = np.zeros((len(state_names), len(boundary_times)))
+        if not jump_states:
+            return jumps
+        if not jump_times:
+            raise RuntimeError('jump_states requires jump_times')
+        for v, steps in jump_states.items():
+            for k, delta in steps.items():
+                try:
+                    t = jump_times[v][k]
+                except KeyError:
+                    raise RuntimeError('No jump time given for {}[{}]'.format(v, k))
+                if t not in boundary_times:
+                    raise RuntimeError('Jump time {} must be between the first and last measurement'.format(t))
+                jumps[state_names.index(k), boundary_times.index(t)] += delta
+        return jumps
+
+    def _initial_parameters(self):
+        """Returns the starting point of the estimated parameters.
+
+           This method is not intended to be used by users directly
+
+        """
+        init = getattr(self.model, 'parameter_init', dict())
+        bounds = getattr(self.model, 'parameter_bounds', dict())
+        values = list()
+        for name in self._parameter_names:
+            if name in init:
+                values.append(init[name])
+            elif name in bounds:
+                lb, ub = bounds[name]
+                values.append((lb + ub) / 2.0)
+            else:
+                raise RuntimeError('Parameter {} needs an initial guess or bounds'.format(name))
+        return np.array(values, dtype=float)
+
+    def _parameter_bounds(self):
+        """Returns the lower and upper bounds of the estimated parameters.
+
+           This method is not intended to be used by users directly
+
+        """
+        bounds = getattr(self.model, 'parameter_bounds', dict())
+        lower = np.array([bounds.get(name, (None, None))[0] for name in self._parameter_names], dtype=float)
+        upper = np.array([bounds.get(name, (None, None))[1] for name in self._parameter_names], dtype=float)
+        lower[np.isnan(lower)] = -np.inf
+        upper[np.isnan(upper)] = np.inf
+        return lower, upper
+
+    def _compute_covariance_GN(self, jac, theta):
+        """Gauss-Newton covariance of the parameters from the weighted residual jacobian.
+
+           This method is not intended to be used by users directly
+
+        Args:
+            jac (ndarray): jacobian of the residuals divided by their standard deviation
+
+            theta (ndarray): estimates
+
+        Returns:
+            DataFrame with the covariance matrix
+        """
+        names = self._parameter_names
+        V_theta = np.linalg.pinv(jac.T.dot(jac))
+        variances_p = np.diag(V_theta)
+        print("Parameter variances: ", variances_p)
+        print('\nConfidence intervals:')
+        for i, name in enumerate(names):
+            print('{} ({},{})'.format(name, theta[i] - variances_p[i] ** 0.5, theta[i] + variances_p[i] ** 0.5))
+        return pd.DataFrame(V_theta, index=names, columns=names)
@@ -3,6 +3,12 @@ from casadi.tools import *
 from kipet.library.ResultsObject import *
 from kipet.library.Simulator import *
 import copy
+import multiprocessing
+import subprocess
+import tempfile
+import hashlib
+import sys
+import os
 from distutils.version import LooseVersion
 
 
@@ -64,16 +70,14 @@ class CasadiSimulator(Simulator):
     def initialize_from_trajectory(self,variable_name,trajectories):
         raise NotImplementedError("CasadiSimulator does not support initialization")
 
-    def fix_from_trajectory(self,variable_name,variable_index,trajectories):
+    def fix_from_trajectory(self,variable_name,variable_index,trajectories,interpolation='linear'):
 
         if variable_name in ['X','dXdt','Z','dZdt']:
             raise NotImplementedError("Fixing state variables is not allowd. Only algebraics can be fixed")
         
         single_traj = trajectories[variable_index]
         sim_times = sorted(self._times)
-        data = np.zeros(self._n_times)
-        for i,t in enumerate(sim_times):
-            data[i] = interpolate_from_trayectory(t,single_traj)
+        data = interpolate_trajectories(sim_times,single_traj,interpolation)
             
         var = getattr(self.model,variable_name)
         symbolic = var[variable_index]
@@ -98,7 +102,11 @@ class CasadiSimulator(Simulator):
             print("WARNING: Variable {}[t,{}] not fixed".format(variable_name,variable_index))
             
     def run_sim(self,solver,**kwds):
-        """ Runs simulation by solving nonlinear system with ipopt
+        """ Runs simulation by integrating the system over the whole discretization grid
+
+        The integrator is built once in scaled time over a unit interval. The length
+        and start of each step and the values of the fixed variables are passed
+        as parameters, so one mapaccum call produces all the output points.
 
         Args:
             solver (str): name of the integrator to used (CVODES or IDAS)
@@ -111,6 +119,16 @@ class CasadiSimulator(Simulator):
             
             tee (bool): flag to tell the simulator whether to stream output
             to the terminal or not
+
+            fixed_interpolation (str): how fixed variables change within a step.
+            'constant' uses the value at the end of the step, 'linear' interpolates
+            between the values at both ends of the step. Default 'constant'
+
+            compile_rhs (bool): flag to generate C code for the DAE right-hand side and its
+            derivatives, compile it with the system compiler and integrate with the compiled
+            library. Default False
+
+            codegen_dir (str): folder where compiled libraries are cached. See compile_function
                     
         Returns:
             None
@@ -122,59 +140,221 @@ class CasadiSimulator(Simulator):
         tee = kwds.pop('tee',False)
         seed = kwds.pop('seed',None)
         init_guess_y = kwds.pop('y0',dict())
-        
+        fixed_interpolation = kwds.pop('fixed_interpolation','constant')
+        compile_rhs = kwds.pop('compile_rhs',False)
+        codegen_dir = kwds.pop('codegen_dir',None)
+
         # adjusts the seed to reproduce results with noise
         np.random.seed(seed)
         
-        Z_var = self.model.Z
-        X_var = self.model.X
-        Y_var = self.model.Y
+        if self._discretized is False:
+            raise RuntimeError('apply discretization first before runing simulation')
+
+        system = self._system_expressions(init_guess_y)
+        times = sorted(self._times)
+
+        opts = {'print_stats':tee,'verbose':False}
+        opts.update(solver_opts)
+        codegen = dict(directory=codegen_dir) if compile_rhs else None
+        all_steps, p_grid, fixed_values = self._grid_integrator(solver,opts,system,times,fixed_interpolation,
+                                                                codegen=codegen)
+
+        results = self._trajectory_results(system,all_steps,p_grid,fixed_values,times,np.zeros(0))
+
+        w = np.zeros((self._n_components,self._n_meas_times))
+        # for the noise term
+        if sigmas:
+            for i,k in enumerate(self._mixture_components):
+                if k in sigmas:
+                    sigma = sigmas[k]**0.5
+                    dw_k = np.random.normal(0.0,sigma,self._n_meas_times)
+                    w[i,:] = np.cumsum(dw_k)
+
+        c_noise_array = results.Z.loc[list(self._meas_times)].values+w.T
+        results.C = pd.DataFrame(data=c_noise_array,
+                                 columns=self._mixture_components,
+                                 index=self._meas_times)
         
+        if self._spectra_given:
+            # solves over determined system
+            D_data = self.model.D
+            s_array = self._solve_S_from_DC(results.C,tee=tee)
+            d_array = np.array([[D_data[t,l] for l in self._meas_lambdas] for t in self._meas_times])
+            d_array = d_array.reshape((self._n_meas_times,self._n_meas_lambdas))
+        else:
+            s_array = np.array([[self.model.S[l,k] for k in self._mixture_components]
+                                for l in self._meas_lambdas])
+            s_array = s_array.reshape((self._n_meas_lambdas,self._n_components))
+
+            if sigmas:
+                sigma_d = sigmas.get('device')**0.5 if 'device' in sigmas else 0
+            else:
+                sigma_d = 0
+            d_array = np.zeros((self._n_meas_times,self._n_meas_lambdas))
+            if s_array.size and c_noise_array.size:
+                d_array = c_noise_array.dot(s_array.T)
+                if sigma_d:
+                    d_array += np.random.normal(0.0,sigma_d,d_array.shape)
+            
+        # stores everything in restuls object
+        results.S = pd.DataFrame(data=s_array,
+                                 columns=self._mixture_components,
+                                 index=self._meas_lambdas)
+        results.D = pd.DataFrame(data=d_array,
+                                 columns=self._meas_lambdas,
+                                 index=self._meas_times)
+        
+        param_vals = dict()
+        for name in self.model.parameter_names:
+            param_vals[name] = self.model.P[name]
+
+        results.P = param_vals
+        
+        return results
+
+    def run_ensemble(self,solver,parameters,**kwds):
+        """ Simulates the model for many sets of parameter values in one batched call
+
+        The trajectory of one parameter set is computed with the same grid
+        integrator as run_sim, and CasADi map evaluates all the sets with
+        parallel threads. Only the states are returned.
+
+        Args:
+            solver (str): name of the integrator to used (CVODES or IDAS)
+
+            parameters (DataFrame or dict): values of the parameters in each member of the
+            ensemble. Columns (or keys) are parameter names and rows the members. Parameters
+            not included keep the value given in the model
+
+            **kwargs: Arbitrary keyword arguments
+            init_conditions (DataFrame or dict): initial conditions of each member with the same
+            layout as parameters. States not included keep the value given in the model
+
+            solver_opts (dict): Options passed to the integrator
+
+            n_threads (int): number of threads used to evaluate the ensemble. Default number of cores
+
+            quantiles (list): quantiles of the trajectories to compute, e.g. [0.05,0.5,0.95].
+            Default None
+
+            fixed_interpolation (str): how fixed variables change within a step. See run_sim
+
+            compile_rhs (bool): flag to integrate with a compiled right-hand side. See run_sim
+
+            codegen_dir (str): folder where compiled libraries are cached. See compile_function
+
+            y0 (dict): initial guess of the algebraic variables
+
+        Returns:
+            dictionary with the keys 'times', 'states' (order of the last axis), 'trajectories'
+            (array with shape n_ensemble x n_times x n_states) and 'quantiles' (map from quantile
+            to an array with shape n_times x n_states) if quantiles were requested
+
+        """
+        init_conditions = kwds.pop('init_conditions',None)
+        solver_opts = kwds.pop('solver_opts', dict())
+        n_threads = kwds.pop('n_threads',None)
+        quantiles = kwds.pop('quantiles',None)
+        fixed_interpolation = kwds.pop('fixed_interpolation','constant')
+        init_guess_y = kwds.pop('y0',dict())
+        compile_rhs = kwds.pop('compile_rhs',False)
+        codegen_dir = kwds.pop('codegen_dir',None)
+
         if self._discretized is False:
             raise RuntimeError('apply discretization first before runing simulation')
+        if not hasattr(self.model,'parametric_odes'):
+            raise RuntimeError('The casadi model does not keep symbolic parameters. '
+                               'Create it again with TemplateBuilder.create_casadi_model')
+
+        parameters = pd.DataFrame(parameters)
+        names = list(parameters.columns)
+        for name in names:
+            if name not in self.model.parameter_symbols:
+                raise RuntimeError('Parameter {} is not in the model'.format(name))
+        n_ensemble = parameters.shape[0]
+        if n_threads is None:
+            n_threads = multiprocessing.cpu_count()
+
+        system = self._system_expressions(init_guess_y,parameters=names)
+        state_names = system['state_names']
+        n_states = len(state_names)
+        times = sorted(self._times)
+        n_times = len(times)
+
+        x_0 = np.tile(system['x_0'].reshape((n_states,1)),(1,n_ensemble))
+        if init_conditions is not None:
+            init_conditions = pd.DataFrame(init_conditions)
+            if init_conditions.shape[0] != n_ensemble:
+                raise RuntimeError('init_conditions and parameters must have the same number of rows')
+            for name in init_conditions.columns:
+                if name not in state_names:
+                    raise RuntimeError('{} is not a state of the model'.format(name))
+                x_0[state_names.index(name),:] = init_conditions[name].values
+
+        opts = {'verbose':False}
+        opts.update(solver_opts)
+        codegen = dict(directory=codegen_dir) if compile_rhs else None
+        all_steps, p_grid, fixed_values = self._grid_integrator(solver,opts,system,times,fixed_interpolation,
+                                                                codegen=codegen)
+
+        x_sym = ca.MX.sym('x0',n_states)
+        theta_sym = ca.MX.sym('theta',len(names))
+        x_grid = all_steps(x_sym,system['y_0'],p_grid,theta_sym)[0]
+        trajectory = ca.Function('trajectory',[x_sym,theta_sym],[x_grid])
+        ensemble = trajectory.map(n_ensemble,'thread',max(1,n_threads))
+
+        x_all = np.array(ensemble(x_0,parameters.values.T.astype(float)))
+        trajectories = x_all.reshape((n_states,n_ensemble,n_times)).transpose((1,2,0))
+
+        results = dict()
+        results['times'] = times
+        results['states'] = state_names
+        results['trajectories'] = trajectories
+        if quantiles is not None:
+            values = np.percentile(trajectories,100*np.asarray(quantiles),axis=0)
+            results['quantiles'] = dict((q,values[i]) for i,q in enumerate(quantiles))
+        return results
+
+    def _system_expressions(self,init_guess_y,parameters=None):
+        """Collects the states, algebraics and equations of the model in casadi vectors.
+
+           This method is not intended to be used by users directly
+
+        Args:
+            init_guess_y (dict): initial guess of the algebraic variables
+
+            parameters (list, optional): names of the parameters kept symbolic (theta).
+            The remaining parameters are replaced by their values in the model
+
+        Returns:
+            dictionary with the symbolic vectors and the initial values
+
+        """
+        Z_var = self.model.Z
+        X_var = self.model.X
+        Y_var = self.model.Y
+
+        if parameters is None:
+            odes = self.model.odes
+            alg_exprs = self.model.alg_exprs
+        else:
+            odes = self.model.parametric_odes
+            alg_exprs = self.model.parametric_alg_exprs
+
         states_l = []
         algebraics_l = []
-        algebraic_eq_l = []
         ode_l = []
         init_conditions_l = []
         y_guess_l = []
         
         for i,k in enumerate(self._mixture_components):
             states_l.append(Z_var[k])
-
-            expr = self.model.odes[k]
-            
-            if isinstance(expr,ca.SX):
-                try:
-                    representation = expr.getRepresentation()
-                except AttributeError:
-                    representation = expr.repr()
-            else:
-                representation = str(expr)
-            if 'nan' not in representation:
-                ode_l.append(expr)
-            else:
-                raise RuntimeError('Mass balance expression for {} is nan.\n'.format(k)+
-                'This usually happens when not using casadi.operator\n'+ 
-                'e.g casadi.exp(expression)\n')
+            ode_l.append(self._checked_ode(odes,k,'Mass balance expression'))
             init_conditions_l.append(self.model.init_conditions[k])
 
         for i,k in enumerate(self._complementary_states):
             states_l.append(X_var[k])
-            expr = self.model.odes[k]
-            if isinstance(expr,ca.SX):
-                try:
-                    representation = expr.getRepresentation()
-                except AttributeError:
-                    representation = expr.repr()
-            else:
-                representation = str(expr)
-            if 'nan' not in representation:
-                ode_l.append(expr)
-            else:
-                raise RuntimeError('Complementary ode expression for {} is nan.\n'.format(k)+
-                'This usually happens when not using casadi.operator\n'+ 
-                'e.g casadi.exp(expression)')
+            ode_l.append(self._checked_ode(odes,k,'Complementary ode expression'))
             init_conditions_l.append(self.model.init_conditions[k])
 
         unfixed_names = list()
@@ -193,184 +373,296 @@ class CasadiSimulator(Simulator):
             else:
                 fixed_names.append(k)
 
-        for eq in self.model.alg_exprs:
-            algebraic_eq_l.append(eq)
-
-        states = ca.vertcat(*states_l)
-        algebraics = ca.vertcat(*algebraics_l)
         ode = ca.vertcat(*ode_l)
-        alg_eq = ca.vertcat(*algebraic_eq_l)
-        x_0 = ca.vertcat(*init_conditions_l)
-        y_0 = ca.vertcat(*y_guess_l)
+        alg_eq = ca.vertcat(*alg_exprs)
+        theta = ca.SX(0,1)
+        if parameters is not None:
+            symbols = [self.model.parameter_symbols[name] for name in parameters]
+            theta = ca.vertcat(*symbols)
+            # parameters not in the ensemble take their values from the model
+            others = [name for name in self.model.parameter_names if name not in parameters]
+            for name in others:
+                if isinstance(self.model.P[name],ca.SX):
+                    raise RuntimeError('Parameter {} has no value. Include it in the ensemble'.format(name))
+            if others:
+                other_symbols = ca.vertcat(*[self.model.parameter_symbols[name] for name in others])
+                other_values = ca.vertcat(*[float(self.model.P[name]) for name in others])
+                ode, alg_eq = ca.substitute([ca.SX(ode),ca.SX(alg_eq)],[other_symbols],[other_values])
+
+        system = dict()
+        system['states'] = ca.vertcat(*states_l)
+        system['state_names'] = list(self._mixture_components)+list(self._complementary_states)
+        system['algebraics'] = ca.vertcat(*algebraics_l)
+        system['ode'] = ode
+        system['alg_eq'] = alg_eq
+        system['fixed'] = ca.vertcat(*self._fixed_variables)
+        system['theta'] = theta
+        system['unfixed_names'] = unfixed_names
+        system['fixed_names'] = fixed_names
+        system['x_0'] = np.array(init_conditions_l,dtype=float)
+        if len(y_guess_l):
+            system['y_0'] = np.array(y_guess_l,dtype=float)
+        else:
+            system['y_0'] = np.zeros(len(algebraics_l))
+        return system
+
+    def _grid_integrator(self,solver,opts,system,times,fixed_interpolation,codegen=None,n_steps=None,
+                         interpolated_times=()):
+        """Creates the function that integrates the system over all the output times.
+
+           The integrator is built once over a unit interval in scaled time. The
+           length and start of each step and the values of the fixed variables
+           are parameters, and mapaccum chains the steps over the grid. If codegen
+           is a dictionary, the DAE is compiled with compile_function(**codegen).
+           n_steps sets the number of chained steps (default one per time).
+           The fixed variables are linearly interpolated only at interpolated_times
+           (times added to the grid, e.g. segment boundaries); every other time must
+           be in their trajectories.
+           This method is not intended to be used by users directly
 
-        n_unfixed = len(algebraics_l)
-        
-        step = (self.model.end_time - self.model.start_time)/self.nfe
+        Returns:
+            tuple with the function all_steps(x0,z0,p_grid,theta)->(x_grid,z_grid),
+            the p_grid values and the values of the fixed variables at the times
 
-        results = ResultsObject()
+        """
+        if fixed_interpolation not in ['constant','linear']:
+            raise RuntimeError('fixed_interpolation must be constant or linear')
+
+        n_times = len(times)
+        n_fixed = len(self._fixed_variables)
+        n_states = system['states'].numel()
+        n_unfixed = system['algebraics'].numel()
+        n_theta = system['theta'].numel()
+
+        # the first step only finds consistent algebraics at the initial time
+        steps = np.diff(np.concatenate(([times[0]-1.0e-12], times)))
+
+        # values of the fixed variables at each output time
+        fixed_values = np.zeros((n_fixed, n_times))
+        on_grid = [i for i,t in enumerate(times) if t not in interpolated_times]
+        for s,trajectory in enumerate(self._fixed_trajectories):
+            fixed_values[s,:] = np.interp(times,trajectory.index.values,trajectory.values)
+            fixed_values[s,on_grid] = trajectory.loc[[times[i] for i in on_grid]].values
+        fixed_start = np.hstack((fixed_values[:,:1], fixed_values[:,:-1]))
+
+        # scaled time tau in [0,1] over a step of length h starting at t_start
+        tau = ca.SX.sym('tau')
+        h = ca.SX.sym('h')
+        t_start = ca.SX.sym('t_start')
+        fixed_end_sym = ca.SX.sym('fixed_end',n_fixed)
+        fixed_start_sym = ca.SX.sym('fixed_start',n_fixed)
+        if fixed_interpolation == 'linear':
+            fixed_tau = fixed_start_sym+tau*(fixed_end_sym-fixed_start_sym)
+        else:
+            fixed_tau = fixed_end_sym
+        step_params = ca.vertcat(h,t_start,fixed_start_sym,fixed_end_sym)
+
+        old_symbols = ca.vertcat(self.model.t,system['fixed'])
+        new_symbols = ca.vertcat(t_start+h*tau,fixed_tau)
+        scaled_ode, scaled_alg = ca.substitute([ca.SX(system['ode']),ca.SX(system['alg_eq'])],
+                                               [old_symbols],[new_symbols])
+        dae = {'t':tau, 'x':system['states'], 'z':system['algebraics'],
+               'p':ca.vertcat(step_params,system['theta']),
+               'ode':h*scaled_ode, 'alg':scaled_alg}
+        if codegen is not None:
+            dae = compile_function(_dae_function(dae),**codegen)
+        I = _unit_interval_integrator(solver, dae, opts)
+
+        x_sym = ca.MX.sym('x',n_states)
+        z_sym = ca.MX.sym('z',n_unfixed)
+        p_sym = ca.MX.sym('p',step_params.numel())
+        theta_sym = ca.MX.sym('theta',n_theta)
+        res = I(x0=x_sym,z0=z_sym,p=ca.vertcat(p_sym,theta_sym))
+        one_step = ca.Function('one_step',[x_sym,z_sym,p_sym,theta_sym],[res['xf'],res['zf']])
+        all_steps = one_step.mapaccum('all_steps',n_times if n_steps is None else n_steps,2)
+
+        p_grid = np.vstack((steps,np.array(times)-steps,fixed_start,fixed_values))
+        return all_steps, p_grid, fixed_values
+
+    def _trajectory_results(self,system,all_steps,p_grid,fixed_values,times,theta):
+        """Integrates the model over the grid and loads Z, dZdt, X, dXdt and Y in a ResultsObject.
+
+           This method is not intended to be used by users directly
 
-        c_results =  []
-        dc_results = []
+        Args:
+            theta (array_like): values of the symbolic parameters of the system (empty if none)
 
-        x_results =  []
-        dx_results = []
+        Returns:
+            ResultsObject
 
-        y_results = []
-        
-        xk = x_0
+        """
+        n_times = len(times)
+        n_states = system['states'].numel()
+        n_unfixed = system['algebraics'].numel()
+        x_grid, y_grid = all_steps(system['x_0'],system['y_0'],p_grid,theta)
+        x_grid = np.array(x_grid).reshape((n_states,n_times))
+        y_grid = np.array(y_grid).reshape((n_unfixed,n_times))
+        return self._load_trajectories(system,x_grid,y_grid,fixed_values,times,theta)
 
-        if len(y_guess_l):
-            yk = y_0
-        
-        times = sorted(self._times)
+    def _load_trajectories(self,system,x_grid,y_grid,fixed_values,times,theta):
+        """Loads state and algebraic grids (variables x times) in a ResultsObject.
 
-        dummy_y = np.ones(self._n_algebraics)
-        for i,t in enumerate(times):
-            sub_odes = ode
-            sub_algs = alg_eq
-            for s,var in enumerate(self._fixed_variables):
-                value = self._fixed_trajectories[s][t]
-                sub_odes = ca.substitute(sub_odes,var,float(value))
-                sub_algs = ca.substitute(sub_algs,var,float(value))
-            fun_ode = ca.Function("odeFunc",
-                                  [self.model.t,states,algebraics],
-                                  [sub_odes,sub_algs])
-            if i==0:
-                step = 1.0e-12
-                if len(y_guess_l):
-                    arg = {"x0":xk, "z0":yk}
-                else:
-                    arg = {"x0":xk}
-            else:
-                step = t - times[i-1]
-                arg = {"x0":xk, "z0":yk}
-                
-            opts = {'tf':step,'print_stats':tee,'verbose':False}
-            system = {'t':self.model.t ,'x':states, 'z':algebraics, 'ode':sub_odes, 'alg':sub_algs}
-            I = integrator("I",solver, system, opts)
-            
-            res = I(**arg)
-            xk = res['xf']
-            yk = res['zf']
-                
-            # check for nan
-            for j in range(xk.numel()):
-                if np.isnan(float(xk[j])):
-                    raise RuntimeError('The iterator returned nan. exiting the program')
-                    
-            res_f = fun_ode(t,xk,yk)
-            odek = res_f[0]
-            for j,k in enumerate(self._mixture_components):
-                c_results.append(xk[j])
-                dc_results.append(odek[j])
-
-            for w,k in enumerate(self._complementary_states):
-                j = w+self._n_components
-                x_results.append(xk[j])
-                dx_results.append(odek[j])
-
-            for j,k in enumerate(unfixed_names):
-                y_results.append(yk[j])
-
-            for j,k in enumerate(fixed_names):
-                y_results.append(0.0)
-                
-        c_array = np.array(c_results).reshape((self._n_times,self._n_components))
-        results.Z = pd.DataFrame(data=c_array,columns=self._mixture_components,index=times)
-                    
-        dc_array = np.array(dc_results).reshape((self._n_times,self._n_components))
-        results.dZdt = pd.DataFrame(data=dc_array,columns=self._mixture_components,index=times)
+           This method is not intended to be used by users directly
+
+        """
+        n_times = len(times)
+        n_states = system['states'].numel()
+        n_unfixed = system['algebraics'].numel()
+
+        if np.isnan(x_grid).any():
+            raise RuntimeError('The iterator returned nan. exiting the program')
 
-        x_array = np.array(x_results).reshape((self._n_times,self._n_complementary_states))
-        results.X = pd.DataFrame(data=x_array,columns=self._complementary_states,index=times)
+        # right hand side of the odes at every output time in one evaluation
+        fun_ode = ca.Function("odeFunc",[self.model.t,system['states'],system['algebraics'],
+                                         system['fixed'],system['theta']],[system['ode']])
+        ode_grid = fun_ode.map(n_times)(np.array(times).reshape((1,n_times)),x_grid,y_grid,fixed_values,theta)
+        ode_grid = np.array(ode_grid).reshape((n_states,n_times))
 
-        dx_array = np.array(dx_results).reshape((self._n_times,self._n_complementary_states))
-        results.dXdt = pd.DataFrame(data=dx_array,columns=self._complementary_states,index=times)
+        results = ResultsObject()
+        n_c = self._n_components
+        results.Z = pd.DataFrame(data=x_grid[:n_c].T,columns=self._mixture_components,index=times)
+        results.dZdt = pd.DataFrame(data=ode_grid[:n_c].T,columns=self._mixture_components,index=times)
+        results.X = pd.DataFrame(data=x_grid[n_c:].T,columns=self._complementary_states,index=times)
+        results.dXdt = pd.DataFrame(data=ode_grid[n_c:].T,columns=self._complementary_states,index=times)
 
-        columns = unfixed_names + fixed_names
-        y_array = np.array(y_results).reshape((self._n_times,self._n_algebraics))
-        results.Y = pd.DataFrame(data=y_array,columns=columns,index=times)
+        y_array = np.zeros((n_times,self._n_algebraics))
+        y_array[:,:n_unfixed] = y_grid.T
+        results.Y = pd.DataFrame(data=y_array,columns=system['unfixed_names']+system['fixed_names'],index=times)
 
         # get the fixed series map in the results
         for s,pair in enumerate(self._fixed_variable_names):
-            var_name = pair[0]
-            var_idx = pair[1]
-            var = getattr(results,var_name)
-            serie = var[var_idx]
-            fixed_serie = self._fixed_trajectories[s] 
-            for t in times:
-                serie[t] = fixed_serie[t] 
-        
-        w = np.zeros((self._n_components,self._n_meas_times))
-        # for the noise term
-        if sigmas:
-            for i,k in enumerate(self._mixture_components):
-                if sigmas.has_key(k):
-                    sigma = sigmas[k]**0.5
-                    dw_k = np.random.normal(0.0,sigma,self._n_meas_times)
-                    w[i,:] = np.cumsum(dw_k)
-            
-        c_noise_results = []
-        for i,t in enumerate(self._meas_times):
-            for j,k in enumerate(self._mixture_components):
-                c_noise_results.append(results.Z[k][t]+w[j,i])
-        
-        c_noise_array = np.array(c_noise_results).reshape((self._n_meas_times,self._n_components))
-        results.C = pd.DataFrame(data=c_noise_array,
-                                 columns=self._mixture_components,
-                                 index=self._meas_times)
-        
-        if self._spectra_given:
-            # solves over determined system
-            D_data = self.model.D
-            s_array = self._solve_S_from_DC(results.C,tee=tee)
+            var = getattr(results,pair[0])
+            var[pair[1]] = fixed_values[s,:]
+        return results
 
-            d_results = []
-            for t in self._meas_times:
-                for l in self._meas_lambdas:
-                    d_results.append(D_data[t,l])
-                    
-            d_array = np.array(d_results).reshape((self._n_meas_times,self._n_meas_lambdas))
+    def _checked_ode(self,odes,name,description):
+        """Returns the ode expression of a state after checking it is not nan.
+
+           This method is not intended to be used by users directly
+
+        """
+        expr = odes[name]
+        if isinstance(expr,ca.SX):
+            try:
+                representation = expr.getRepresentation()
+            except AttributeError:
+                representation = expr.repr()
         else:
+            representation = str(expr)
+        if 'nan' in representation:
+            raise RuntimeError('{} for {} is nan.\n'.format(description,name)+
+                'This usually happens when not using casadi.operator\n'+
+                'e.g casadi.exp(expression)\n')
+        return expr
 
-            s_results = []
-            for l in self._meas_lambdas:
-                for k in self._mixture_components:
-                    s_results.append(self.model.S[l,k])
 
-            d_results = []
-            if sigmas:
-                sigma_d = sigmas.get('device')**0.5 if sigmas.has_key('device') else 0
-            else:
-                sigma_d = 0
-            if s_results and c_noise_results:
-                for i,t in enumerate(self._meas_times):
-                    for j,l in enumerate(self._meas_lambdas):
-                        suma = 0.0
-                        for w,k in enumerate(self._mixture_components):
-                            C = c_noise_results[i*self._n_components+w]
-                            S = s_results[j*self._n_components+w]
-                            suma+= C*S
-                        if sigma_d:
-                            suma+= np.random.normal(0.0,sigma_d)
-                        d_results.append(suma)
-
-
-            s_array = np.array(s_results).reshape((self._n_meas_lambdas,self._n_components))
-            d_array = np.array(d_results).reshape((self._n_meas_times,self._n_meas_lambdas))
-            
-        # stores everything in restuls object
-        results.S = pd.DataFrame(data=s_array,
-                                 columns=self._mixture_components,
-                                 index=self._meas_lambdas)
-        results.D = pd.DataFrame(data=d_array,
-                                 columns=self._meas_lambdas,
-                                 index=self._meas_times)
-        
-        param_vals = dict()
-        for name in self.model.parameter_names:
-            param_vals[name] = self.model.P[name]
+def _unit_interval_integrator(solver, system, opts):
+    """Creates an integrator of the system from time 0 to 1.
 
-        results.P = param_vals
-        
-        return results
+       This method is not intended to be used by users directly
+
+    """
+    try:
+        return ca.integrator("I", solver, system, 0.0, 1.0, opts)
+    except (NotImplementedError, TypeError):
+        # casadi versions before 3.6 take the final time as an option
+        opts = dict(opts)
+        opts['tf'] = 1.0
+        return ca.integrator("I", solver, system, opts)
+
+
+def compile_function(function, directory=None, compiler=None, flags=None):
+    """Compiles a casadi function to a shared library and loads it as an external function.
+
+    C code is generated for the function, its jacobian and its first order
+    forward and reverse derivatives, and compiled with the system compiler.
+    The library is cached in the directory with a name built from a hash of
+    the serialized function, so the same expressions are compiled only once,
+    also across processes.
+
+    Args:
+        function (casadi Function): function to compile
+
+        directory (str, optional): folder of the cached libraries. Default kipet_codegen
+        in the temporary directory of the system
+
+        compiler (str, optional): compiler command. Default environment variable CC or gcc
+
+        flags (list, optional): compiler flags. Default ['-O3']
+
+    Returns:
+        casadi external Function with the same name, inputs and outputs
+
+    """
+    if directory is None:
+        directory = os.path.join(tempfile.gettempdir(), 'kipet_codegen')
+    directory = os.path.abspath(directory)
+    if compiler is None:
+        compiler = os.environ.get('CC', 'gcc')
+    if flags is None:
+        flags = ['-O3']
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    try:
+        serialized = function.serialize()
+    except AttributeError:
+        serialized = str(function)
+    key = hashlib.sha1('\n'.join([ca.__version__, compiler, ' '.join(flags), serialized]).encode('utf-8'))
+    name = function.name()
+    library = os.path.join(directory, '{}_{}{}'.format(name, key.hexdigest()[:20], _shared_library_suffix()))
+
+    if not os.path.isfile(library):
+        tmp_name = '{}_{}'.format(name, os.getpid())
+        source = os.path.join(directory, tmp_name + '.c')
+        tmp_library = os.path.join(directory, tmp_name + _shared_library_suffix())
+        generator = ca.CodeGenerator(tmp_name + '.c', {'with_header': False})
+        generator.add(function)
+        generator.add(function.jacobian())
+        generator.add(function.forward(1))
+        generator.add(function.reverse(1))
+        try:
+            generator.generate(directory + os.sep)
+            command = [compiler, '-fPIC', '-shared'] + list(flags) + [source, '-o', tmp_library]
+            try:
+                process = subprocess.Popen(command, cwd=directory,
+                                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError:
+                raise RuntimeError('Compiler {} not found. Set CC or pass compiler'.format(compiler))
+            out, err = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError('Compilation of {} failed:\n{}'.format(name, err.decode('utf-8', 'replace')))
+            # rename is atomic, concurrent processes never load a partial library
+            os.rename(tmp_library, library)
+        finally:
+            if os.path.exists(source):
+                os.remove(source)
+
+    return ca.external(name, library)
+
+
+def _dae_function(dae):
+    """Turns a DAE dictionary into a casadi Function with the integrator input/output layout.
+
+       This method is not intended to be used by users directly
+
+    """
+    if not hasattr(ca, 'dyn_in'):
+        raise RuntimeError('Compiled right-hand sides need casadi 3.6 or newer')
+    names_in = ca.dyn_in()
+    names_out = ca.dyn_out()
+    inputs = [dae[k] if k in dae else ca.SX(0, 1) for k in names_in]
+    outputs = [ca.SX(dae[k]) if k in dae else ca.SX(0, 1) for k in names_out]
+    return ca.Function('kipet_dae', inputs, outputs, names_in, names_out)
+
+
+def _shared_library_suffix():
+    if sys.platform.startswith('win'):
+        return '.dll'
+    if sys.platform == 'darwin':
+        return '.dylib'
+    return '.so'
@@ -5,6 +5,7 @@ from __future__ import division
 from pyomo.environ import *
 from pyomo.dae import *
 from kipet.library.ParameterEstimator import *
+from kipet.library.sensitivity_io import *
 from pyomo.core.base.expr import Expr_if
 from scipy.optimize import least_squares
 import matplotlib.pyplot as plt
@@ -184,28 +185,27 @@ class EstimabilityAnalyzer(ParameterEstimator):
             idx_to_param[count_dcdp]=p
             count_dcdp+=1
           
-        #: Clear this file
-        with open('ipopt.opt', 'w') as f:
-            f.close()
-                
-        #first solve with Ipopt
-        ip = SolverFactory('ipopt')
-        solver_results = ip.solve(m, tee=False,
-                                  report_timing=False)
-
-        m.ipopt_zL_in.update(m.ipopt_zL_out)
-        m.ipopt_zU_in.update(m.ipopt_zU_out) 
-        
-        k_aug = SolverFactory('k_aug')
-        k_aug.options['dsdp_mode'] = ""  #: sensitivity mode!
-        #solve with k_aug in sensitivity mode
-        k_aug.solve(m, tee=True)
-        print("Done solving sensitivities")
-
-        dsdp = np.loadtxt('dxdp_.dat')
-        
-        if os.path.exists('dxdp_.dat'):
-            os.remove('dxdp_.dat')
+        # k_aug and ipopt exchange files in a scratch directory
+        with scratch_directory() as path:
+            #: Clear this file
+            with open(os.path.join(path, 'ipopt.opt'), 'w') as f:
+                f.close()
+
+            #first solve with Ipopt
+            ip = SolverFactory('ipopt')
+            solver_results = solve_in_directory(ip, path, m, tee=False,
+                                                report_timing=False)
+
+            m.ipopt_zL_in.update(m.ipopt_zL_out)
+            m.ipopt_zU_in.update(m.ipopt_zU_out)
+
+            k_aug = SolverFactory('k_aug')
+            k_aug.options['dsdp_mode'] = ""  #: sensitivity mode!
+            #solve with k_aug in sensitivity mode
+            solve_in_directory(k_aug, path, m, tee=True)
+            print("Done solving sensitivities")
+
+            dsdp = read_matrix(os.path.join(path, 'dxdp_.dat'))
         print(idx_to_param)
         
         return dsdp , idx_to_param
@@ -284,7 +284,8 @@ class EstimabilityAnalyzer(ParameterEstimator):
         self.cloned_before_k_aug = self.model.clone()
         dsdp, idx_to_param = self.get_sensitivities_for_params(tee=True, sigmasq=sigmas)
 
-        nvars = np.size(dsdp,0)
+        if dsdp.ndim == 1:
+            dsdp = dsdp.reshape(-1, 1)
         nparams = 0
         for v in six.itervalues(self.model.P):
             if v.is_fixed():
@@ -293,109 +294,27 @@ class EstimabilityAnalyzer(ParameterEstimator):
                 continue
             nparams += 1
 
-        dsdp_scaled = dsdp
-
         # scale the sensitivities
-        i=0
+        scaling = np.ones(dsdp.shape[1])
+        i = 0
         for k, p in self.model.P.items():
             if p.is_fixed():
-                continue            
-            for row in range(len(dsdp)):
-                dsdp_scaled[row][i] = dsdp[row][i]*param_scaling[k]/meas_scaling
+                continue
+            scaling[i] = param_scaling[k]/meas_scaling
             i += 1
+        dsdp_scaled = dsdp*scaling
+
+        # The ranking strategy of Yao: the next parameter is the one whose sensitivities are the
+        # worst predicted (largest residual norm) by the sensitivities of the ranked parameters
+        n_rank = min(nparams, max(nparams - 1, 2))
+        ranked_columns = rank_columns_yao(dsdp_scaled, n_rank)
+        if len(ranked_columns) < n_rank:
+            print("The remaining sensitivities are linearly dependent on the ranked ones. Unable to continue the procedure")
+        for i, col in enumerate(ranked_columns):
+            self.param_ranks[i + 1] = idx_to_param[col + 1]
+        if len(self.param_ranks) == nparams - 1:
+            print("All parameters have been ranked")
 
-        # euclidean norm for each column of Hessian relating parameters to outputs
-        eucnorm = dict()
-        count=0
-        for i in range(nparams):
-            total = 0
-            for row in range(len(dsdp)):
-                total += dsdp[row][count]**2           
-            float(total)
-            total = np.asscalar(total)
-            sqr = (total)**(0.5)
-            eucnorm[count]=sqr
-            count+=1
-        
-        # sort the norms and link them to the relevant parameters
-        sorted_euc = sorted(eucnorm.values(), reverse=True)
-
-        count=0
-        ordered_params = dict()
-        for p in idx_to_param:
-            for t in idx_to_param:
-                if sorted_euc[p-1]==eucnorm[t-1]:
-                    ordered_params[count] = t-1
-            count +=1
-        
-        # set the first ranked parameter as the one with highest norm
-        iter_count=0
-        self.param_ranks[1] = idx_to_param[ordered_params[0]+1]
-            
-        #The ranking strategy of Yao, where the X and Z matrices are formed
-        next_est = dict()
-        X= None
-        kcol = None
-        for i in range(nparams-1):
-            if i==0:
-                X = np.zeros((nvars,1))
-            
-            # Form the appropriate matrix
-            for x in range(i+1):
-                paramhere = ordered_params[x]
-                kcol = dsdp[:,ordered_params[x]].T
-                recol= kcol.reshape((nvars,1))
-                if x >= 1:
-                    X = np.append(X,np.zeros([len(X),1]),1)
-                for n in range(nvars):
-                    X[n][x] = recol[n][0]
-            # Use Ordinary Least Squares to use X to predict Z
-            # try is here to catch any error resulting from a singular matrix
-            # perhaps not the most elegant way of checking for this
-            try:
-                A = X.T.dot(X)
-                B= np.linalg.inv(A)
-                C = B.dot(X.T)
-                D=X.dot(C)
-                Z = dsdp.T
-                Zbar=D.dot(Z.T)
-                #Get residuals of prediction
-                Res = Z.T - Zbar
-            except:
-                print("There was an error during the OLS prediction. Most likely caused by a singular matrix. Unable to continue the procedure")
-                break
-            
-            # Calculate the magnitude of residuals
-            magres = dict()
-            counter=0
-            for i in range(nparams):
-                total = 0
-                for row in range(len(Res)):
-                    total += Res[row][counter]**2
-                float(total)
-                total = np.asscalar(total)
-                sqr = (total)**(0.5)
-                magres[counter]=sqr
-                counter +=1
-
-            # Sort the residuals and ensure the params are correctly assigned
-            sorted_magres = sorted(magres.values(), reverse=True)
-            count2=0
-            for p in idx_to_param:
-                for t in idx_to_param:
-                    if sorted_magres[p-1]==magres[t-1]:
-                        next_est[count2] = t
-                count2 += 1
-
-            # Add next most estimable param to the ranking list  
-            self.param_ranks[(iter_count+2)]=idx_to_param[next_est[0]]
-            iter_count += 1
-            
-            #print("======================PARAMETER RANKED======================")
-            if len(self.param_ranks) == nparams - 1:
-                print("All parameters have been ranked")
-                break
-        
         #adding the unranked parameters to the list
         #NOTE: if param appears here then it was not evaluated (i.e. it was the least estimable)
         count = 0
@@ -437,7 +356,7 @@ class EstimabilityAnalyzer(ParameterEstimator):
 
         return self.ordered_params
 
-    def run_analyzer(self, method = None, parameter_rankings = None, meas_scaling = None, variances = None):
+    def run_analyzer(self, method = None, parameter_rankings = None, meas_scaling = None, variances = None, **kwds):
         """This function performs the estimability analysis. The user selects the method to be used. 
         The default will be selected based on the type of data selected. For now, only the method of 
         Wu, McLean, Harris, and McAuley (2011) using the means squared error is used. Other estimability 
@@ -460,6 +379,8 @@ class EstimabilityAnalyzer(ParameterEstimator):
         
         variances: dict
             variances are required, as needed by the parameter estimator.
+
+        **kwds: options of the selected method (see wu_estimability)
         
         returns: list
             list of parameters that should remain in the parameter estimation, while all other 
@@ -512,12 +433,12 @@ class EstimabilityAnalyzer(ParameterEstimator):
                 raise RuntimeError('The sigmas must be type dict')
         
         if method == "Wu":
-            estimable_params = self.wu_estimability(parameter_rankings, meas_scaling, variances)
+            estimable_params = self.wu_estimability(parameter_rankings, meas_scaling, variances, **kwds)
             return estimable_params
         else:
             raise RuntimeError("the estimability method must be 'Wu' as this is the only supported method as of now")
 
-    def wu_estimability(self, parameter_rankings = None, meas_scaling = None, sigmas = None):
+    def wu_estimability(self, parameter_rankings = None, meas_scaling = None, sigmas = None, **kwds):
         """This function performs the estimability analysis of Wu, McLean, Harris, and McAuley (2011) 
         using the means squared error. 
 
@@ -532,54 +453,46 @@ class EstimabilityAnalyzer(ParameterEstimator):
         
         sigmas: dict
             dictionary containing all the variances as required by the parameter estimator
+
+        parallel: bool, optional
+            flag to solve the simplified models in a pool of worker processes. Default False
+
+        n_workers: int, optional
+            number of worker processes when parallel is True. Default number of cores
+
+        warm_start: bool, optional
+            when solving serially, initializes the model with k+1 parameters from the solution
+            of the model with k parameters. Default False
         
         Returns:
         -----------
             list of parameters that should remain in the parameter estimation, while all other parameters should be fixed.
         """
         
+        parallel = kwds.pop('parallel', False)
+        n_workers = kwds.pop('n_workers', None)
+        warm_start = kwds.pop('warm_start', False)
+
         J = dict()
-        params_estimated = list()
-        cloned_full_model = dict()
-        cloned_pestim = dict()
         results = dict()
         # For now, instead of using Levenberg-Marquardt least squares, we will use Kipet to perform the estimation
-        # of every model. Here we generate each of the simplified models.
-        # first we clone the main model so that we work with the full model at every iteration
-        count = 1
-        for p in parameter_rankings:
-            cloned_full_model[count] = self.cloned_before_k_aug.clone()
-            count += 1
-        count = 1
-        # Then we go create each simplified model, fixing remaining variables
-        for p in parameter_rankings:
-            params_estimated.append(p)            
-            #print("performing parameter estimation for: ", params_estimated)
-            for v,k in six.iteritems(cloned_full_model[count].P):
-                if v in params_estimated:
-                    continue
-                else:
-                    #print("fixing the parameters for:",v,k)
-                    #fix parameters not in simplified model
-                    ub = value(cloned_full_model[count].P[v])
-                    lb = ub
-                    cloned_full_model[count].P[v].setlb(lb)
-                    cloned_full_model[count].P[v].setub(ub)
-            # We then solve the Parameter estimaion problem for the SM
-            options = dict()            
-            cloned_pestim[count] = ParameterEstimator(cloned_full_model[count])
-            results[count] = cloned_pestim[count].run_opt('ipopt',
-                                        tee=False,
-                                        solver_opts = options,
-                                        variances=sigmas
-                                        )
-            #for v,k in six.iteritems(results[count].P):                
-                #print(v,k)
-            # Then compute the scaled residuals to obtain the Jk in the Wu et al paper   
-            J [count] = self._compute_scaled_residuals(results[count], meas_scaling)
-            count += 1            
+        # of every model. Each simplified model is a clone of the full model with the parameters
+        # ranked after the first k fixed
+        count = len(parameter_rankings)
+        if parallel:
+            outputs = fork_map(_solve_simplified_model, range(1, count + 1),
+                               shared=(self, parameter_rankings, meas_scaling, sigmas),
+                               n_workers=n_workers)
+            for k, (output, error) in enumerate(outputs):
+                if error is not None:
+                    raise RuntimeError('Simplified model with {} parameters failed:\n{}'.format(k + 1, error))
+                J[k + 1], results[k + 1] = output
+        else:
+            for k in range(1, count + 1):
+                previous = results.get(k - 1) if warm_start else None
+                J[k], results[k] = self._solve_simplified_model(k, parameter_rankings, meas_scaling, sigmas,
+                                                                previous)
         #print(J)
-        count = count - 1
         # Since the estimability procedure suggested by Wu will always skip the last
         # parameter, we should check whether all parameters can be estimated
         # For now this is done by checking that the final parameter does not provide a massive decrease
@@ -632,6 +545,54 @@ class EstimabilityAnalyzer(ParameterEstimator):
             count += 1
         return estimable_params
     
+    def _solve_simplified_model(self, k, parameter_rankings, meas_scaling, sigmas, initial_results=None):
+        """Solves the simplified model with the first k ranked parameters free and the rest fixed.
+
+        Args:
+            k (int): number of parameters estimated
+
+            parameter_rankings (list): parameters from most estimable to least estimable
+
+            meas_scaling (float): measurement scaling used in the parameter ranking
+
+            sigmas (dict): variances as required by the parameter estimator
+
+            initial_results (ResultsObject, optional): solution used as initial point
+
+        Returns:
+            tuple with the scaled residuals (Jk in Wu et al) and the results object
+
+        This method is not intended to be used by users directly
+        """
+        params_estimated = parameter_rankings[:k]
+        model = self.cloned_before_k_aug.clone()
+        for v, p in six.iteritems(model.P):
+            if v in params_estimated:
+                continue
+            #fix parameters not in simplified model
+            ub = value(model.P[v])
+            lb = ub
+            model.P[v].setlb(lb)
+            model.P[v].setub(ub)
+
+        # We then solve the Parameter estimaion problem for the SM
+        pestim = ParameterEstimator(model)
+        if initial_results is not None:
+            for v in parameter_rankings[:k - 1]:
+                model.P[v].value = initial_results.P[v]
+            for name in ['Z', 'dZdt', 'X', 'dXdt', 'Y']:
+                trajectory = getattr(initial_results, name, None)
+                if isinstance(trajectory, pd.DataFrame) and not trajectory.empty:
+                    pestim.initialize_from_trajectory(name, trajectory)
+
+        options = dict()
+        results = pestim.run_opt('ipopt',
+                                 tee=False,
+                                 solver_opts=options,
+                                 variances=copy.deepcopy(sigmas))
+        # Then compute the scaled residuals to obtain the Jk in the Wu et al paper
+        return self._compute_scaled_residuals(results, meas_scaling), results
+
     def _compute_scaled_residuals(self, model, meas_scaling = None):
         """
         Computes the square of residuals between the optimal solution (Z) and the concentration data (C)
@@ -663,4 +624,56 @@ class EstimabilityAnalyzer(ParameterEstimator):
             for t in self._meas_times:                
                 E += self.residuals[t, c] / (meas_scaling ** 2)
                 
-        return E
\ No newline at end of file
+        return E
+
+
+def _solve_simplified_model(shared, k):
+    """Solves the k-th simplified model of the Wu et al procedure in a worker process.
+
+       This method is not intended to be used by users directly
+
+    """
+    analyzer, parameter_rankings, meas_scaling, sigmas = shared
+    return analyzer._solve_simplified_model(k, parameter_rankings, meas_scaling, sigmas)
+
+
+def rank_columns_yao(M, n_rank=None, tol=1e-10):
+    """Ranks the columns of a sensitivity matrix following Yao et al. (2003).
+
+    The first column is the one with largest euclidean norm. Every next column
+    is the one with the largest residual after projecting on the ranked columns.
+    The projection is updated by Gram-Schmidt with a rank one deflation of the
+    residual matrix, so no normal equations are formed or inverted.
+
+    Args:
+        M (ndarray): scaled sensitivities with one column per parameter
+
+        n_rank (int, optional): number of columns to rank. Default all
+
+        tol (float, optional): relative norm below which the remaining columns are
+        considered linearly dependent on the ranked ones and the ranking stops
+
+    Returns:
+        list with the indices of the ranked columns
+    """
+    R = np.array(M, dtype=float, copy=True)
+    n_cols = R.shape[1]
+    if n_rank is None:
+        n_rank = n_cols
+    norms = np.sqrt(np.einsum('ij,ij->j', R, R))
+    threshold = tol*max(norms.max(), np.finfo(float).tiny)
+    ranked = list()
+    available = np.ones(n_cols, dtype=bool)
+    while len(ranked) < min(n_rank, n_cols):
+        candidates = np.where(available, norms, -1.0)
+        j = int(np.argmax(candidates))
+        if candidates[j] <= threshold:
+            break
+        ranked.append(j)
+        available[j] = False
+        q = R[:, j]/norms[j]
+        # project out the new direction (twice for numerical orthogonality)
+        for _ in range(2):
+            R -= np.outer(q, q.dot(R))
+        norms = np.sqrt(np.einsum('ij,ij->j', R, R))
+    return ranked
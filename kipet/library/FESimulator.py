@@ -54,7 +54,7 @@ class FESimulator(PyomoSimulator):
             if t[0] == st:
                 self.ics_['X',t[1]] = v.value
 
-    def call_fe_factory(self, inputs_sub=None, jump_states=None, jump_times=None, feed_times=None):#added for inclusion of discrete jumps CS
+    def call_fe_factory(self, inputs_sub=None, jump_states=None, jump_times=None, feed_times=None, solver="newton"):#added for inclusion of discrete jumps CS
         """
         call_fe_factory:
     
@@ -66,6 +66,7 @@ class FESimulator(PyomoSimulator):
                     jump_states (dict): dictionary of which variables and states are inputted and by how much
                     jump_times (dict): dictionary in same form as jump_states with times of input
                     feed_times (list): list of additional times needed, should be the same times as jump_times 
+                    solver (str): "newton" (default) solves each element in-process, "ipopt" calls ipopt per element
         """
         #added for inclusion of inputs of different kind CS
         self.inputs_sub=inputs_sub
@@ -84,4 +85,4 @@ class FESimulator(PyomoSimulator):
 
         if jump_times!=None and jump_states!=None:
             init.load_discrete_jump(jump_states, jump_times, feed_times) #added for inclusion of discrete jumps
-        init.run()
+        init.run(solver=solver)
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from pyomo.environ import *
+from kipet.library.TemplateBuilder import TemplateBuilder, _frame_to_dict
+from kipet.library.PyomoSimulator import PyomoSimulator
+from collections import OrderedDict
+import hashlib
+import marshal
+import warnings
+import weakref
+import os
+
+try:
+    import cloudpickle as _pickle
+except ImportError:
+    import pickle as _pickle
+
+
+class ModelCache(object):
+    """Cache of discretized and default-initialized pyomo models.
+
+    Models are keyed on the structure of the TemplateBuilder (components,
+    initial conditions, parameter names, ODE/algebraic rule code, time and
+    wavelength sets, non-absorbing and known-absorbance species) and the
+    discretization options. Parameter values and bounds, the values of the
+    data sets and the known absorbances are not part of the key: they are
+    loaded into the clone that is handed out, so changing them does not
+    trigger a new discretization.
+
+    Note:
+        The rules are identified by their code and closure values. Rules that
+        read global variables whose values change between calls must not be cached.
+
+    Attributes:
+        directory (str): folder where models are persisted or None
+
+        max_models (int): maximum number of models kept in memory or None
+
+    """
+
+    def __init__(self, directory=None, max_models=None):
+        """ModelCache constructor.
+
+        Args:
+            directory (str, optional): folder to persist the models so that new processes
+            do not need to discretize again. Default None (memory only)
+
+            max_models (int, optional): maximum number of models kept in memory, least
+            recently used models are dropped first. Default None (no limit)
+
+        """
+        self.directory = directory
+        self.max_models = max_models
+        self._models = OrderedDict()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_model(self, builder, start_time, end_time, discretization=None):
+        """Returns a fresh copy of the model created and discretized from the builder.
+
+        Args:
+            builder (TemplateBuilder): model template
+
+            start_time (float): initial time considered in the model
+
+            end_time (float): final time considered in the model
+
+            discretization (dict, optional): arguments of PyomoSimulator.apply_discretization,
+            e.g. {'transformation': 'dae.collocation', 'nfe': 60, 'ncp': 3, 'scheme': 'LAGRANGE-RADAU'}.
+            Default None (model is not discretized)
+
+        Returns:
+            Pyomo ConcreteModel
+        """
+        key = builder_structure_key(builder, start_time, end_time, discretization)
+        model = self._models.get(key)
+        if model is None:
+            model = self._load(key)
+        if model is None:
+            model = builder.create_pyomo_model(start_time, end_time)
+            if discretization is not None:
+                options = dict(discretization)
+                transformation = options.pop('transformation', 'dae.collocation')
+                PyomoSimulator(model).apply_discretization(transformation, **options)
+            self._store(key, model)
+            self._save(key, model)
+            return model.clone()
+
+        self._store(key, model)
+        model = model.clone()
+        _load_builder_values(model, builder)
+        return model
+
+    def clear(self):
+        """Removes all models from memory (persisted models are kept)"""
+        self._models.clear()
+
+    def __len__(self):
+        return len(self._models)
+
+    def _store(self, key, model):
+        self._models[key] = model
+        if hasattr(self._models, 'move_to_end'):
+            self._models.move_to_end(key)
+        if self.max_models is not None:
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+
+    def _filename(self, key):
+        return os.path.join(self.directory, 'kipet_model_{}.pkl'.format(key))
+
+    def _load(self, key):
+        if self.directory is None or not os.path.isfile(self._filename(key)):
+            return None
+        try:
+            with open(self._filename(key), 'rb') as f:
+                model = _pickle.load(f)
+            _set_derivative_references(model, _derivative_names(model))
+            return model
+        except Exception as e:
+            warnings.warn('Could not load cached model {}: {}'.format(self._filename(key), e))
+            return None
+
+    def _save(self, key, model):
+        if self.directory is None:
+            return
+        filename = self._filename(key)
+        tmp_name = '{}.{}.tmp'.format(filename, os.getpid())
+        # pyomo.dae keeps weak references from the state variables to their DerivativeVars,
+        # which can not be pickled. They are stored by name and restored after dumping.
+        derivative_names = _derivative_names(model)
+        try:
+            _set_derivative_names(model, derivative_names)
+            with open(tmp_name, 'wb') as f:
+                _pickle.dump(model, f, protocol=2)
+            os.rename(tmp_name, filename)
+        except Exception as e:
+            warnings.warn('Could not persist model {} (rules may not be picklable, '
+                          'install cloudpickle): {}'.format(filename, e))
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+        finally:
+            _set_derivative_references(model, derivative_names)
+
+
+def builder_structure_key(builder, start_time, end_time, discretization=None):
+    """Returns a hash of everything in a builder that changes the structure of its model.
+
+    Args:
+        builder (TemplateBuilder): model template
+
+        start_time (float): initial time considered in the model
+
+        end_time (float): final time considered in the model
+
+        discretization (dict, optional): discretization options
+
+    Returns:
+        str hexadecimal digest
+    """
+    def labels(frame, axis):
+        if frame is None:
+            return None
+        return tuple(getattr(frame, axis).tolist())
+
+    structure = (sorted(builder._component_names),
+                 sorted(builder._complementary_states),
+                 sorted(builder._algebraics),
+                 sorted(builder._init_conditions.items()),
+                 sorted(builder._parameters.keys()),
+                 _rule_identity(builder._odes),
+                 _rule_identity(builder._algebraic_constraints),
+                 float(start_time), float(end_time),
+                 sorted(builder._meas_times),
+                 sorted(builder._feed_times) if builder._feed_times is not None else None,
+                 labels(builder._spectral_data, 'index'), labels(builder._spectral_data, 'columns'),
+                 labels(builder._concentration_data, 'index'), labels(builder._concentration_data, 'columns'),
+                 labels(builder._absorption_data, 'index'), labels(builder._absorption_data, 'columns'),
+                 builder._is_D_deriv, builder._is_C_deriv,
+                 sorted(builder._non_absorbing) if builder._is_non_abs_set else None,
+                 sorted(builder._known_absorbance) if builder._is_known_abs_set else None,
+                 labels(builder._known_absorbance_data, 'index') if builder._is_known_abs_set else None,
+                 labels(builder._known_absorbance_data, 'columns') if builder._is_known_abs_set else None,
+                 sorted(discretization.items()) if discretization is not None else None)
+    return hashlib.sha1(repr(structure).encode('utf-8')).hexdigest()
+
+
+def _rule_identity(rule):
+    """Returns a description of a rule function based on its code and closure values.
+
+       This method is not intended to be used by users directly
+
+    """
+    if rule is None:
+        return None
+    code = getattr(rule, '__code__', None)
+    if code is None:
+        return repr(rule)
+    closure = getattr(rule, '__closure__', None) or ()
+    closure_values = list()
+    for cell in closure:
+        try:
+            closure_values.append(repr(cell.cell_contents))
+        except ValueError:
+            closure_values.append(None)
+    return (getattr(rule, '__module__', None),
+            getattr(rule, '__qualname__', rule.__name__),
+            hashlib.sha1(marshal.dumps(code)).hexdigest(),
+            tuple(closure_values))
+
+
+def _derivative_names(model):
+    """Returns the names of the DerivativeVars referenced by the state variables of a model.
+
+       This method is not intended to be used by users directly
+
+    """
+    names = dict()
+    for var in model.component_objects(Var, descend_into=True):
+        derivatives = getattr(var, '_derivative', None)
+        if not isinstance(derivatives, dict):
+            continue
+        var_names = dict()
+        for wrt, ref in derivatives.items():
+            if isinstance(ref, weakref.ReferenceType):
+                ref = ref()
+            var_names[wrt] = ref if isinstance(ref, str) else ref.name
+        names[var.name] = var_names
+    return names
+
+
+def _set_derivative_names(model, names):
+    """Replaces the weak references to DerivativeVars by their names so that the model can be pickled.
+
+       This method is not intended to be used by users directly
+
+    """
+    for var_name, var_names in names.items():
+        model.find_component(var_name)._derivative = dict(var_names)
+
+
+def _set_derivative_references(model, names):
+    """Restores the weak references to DerivativeVars replaced by _set_derivative_names.
+
+       This method is not intended to be used by users directly
+
+    """
+    for var_name, var_names in names.items():
+        model.find_component(var_name)._derivative = dict(
+            (wrt, weakref.ref(model.find_component(name))) for wrt, name in var_names.items())
+
+
+def _load_builder_values(model, builder):
+    """Loads the parameter values/bounds, the data values and the known absorbances of a builder into a cached model.
+
+       This method is not intended to be used by users directly
+
+    """
+    for p in model.parameter_names:
+        v = builder._parameters.get(p)
+        if p in builder._parameters_bounds:
+            lb, ub = builder._parameters_bounds[p]
+            model.P[p].setlb(lb)
+            model.P[p].setub(ub)
+        if v is not None:
+            model.P[p].fix(v)
+            continue
+        model.P[p].unfix()
+        if p in builder._parameters_init:
+            model.P[p].value = builder._parameters_init[p]
+        elif p in builder._parameters_bounds:
+            lb, ub = builder._parameters_bounds[p]
+            model.P[p].value = (ub - lb) / 2
+
+    if builder._spectral_data is not None:
+        d_dict = _frame_to_dict(builder._spectral_data, sorted(model.meas_times), sorted(model.meas_lambdas))
+        model.del_component('D')
+        model.D = Param(model.meas_times, model.meas_lambdas, initialize=d_dict)
+
+    if builder._concentration_data is not None:
+        for key, v in _frame_to_dict(builder._concentration_data).items():
+            model.C[key].fix(v)
+
+    if builder._absorption_data is not None:
+        for key, v in _frame_to_dict(builder._absorption_data).items():
+            model.S[key].fix(v)
+
+    if builder._is_known_abs_set:
+        model.known_absorbance_data = builder._known_absorbance_data
+        for component in builder._known_absorbance:
+            for l in model.meas_lambdas:
+                model.S[l, component].fix(builder._known_absorbance_data[component][l])
@@ -11,6 +11,7 @@ import scipy
 import copy
 import sys
 import six
+import warnings
 class Optimizer(PyomoSimulator):
     """Base optimizer class.
 
@@ -251,6 +252,130 @@ class Optimizer(PyomoSimulator):
         
         return results
 
+    def _check_wavelength_subset(self, wavelength_subset):
+        """Validates a subset of the measured wavelengths.
+
+           This method is not intended to be used by users directly
+
+        Args:
+            wavelength_subset (array_like): wavelengths
+
+        Returns:
+            sorted list of the wavelengths
+        """
+        measured = set(self._meas_lambdas)
+        lambdas = sorted(set(wavelength_subset))
+        unknown = [l for l in lambdas if l not in measured]
+        if unknown:
+            raise RuntimeError('Wavelengths {} are not measured wavelengths of the model'.format(unknown[:5]))
+        if len(lambdas) == 0:
+            raise RuntimeError('wavelength_subset is empty')
+        return lambdas
+
+    def _spectra_array(self, lambdas=None):
+        """Returns the spectral data D as an array with one row per measurement time.
+
+           This method is not intended to be used by users directly
+
+        Args:
+            lambdas (list, optional): wavelengths (columns). Default all measured wavelengths
+
+        Returns:
+            ndarray with shape (n_meas_times, len(lambdas))
+        """
+        if lambdas is None:
+            lambdas = self._meas_lambdas
+        D = self.model.D
+        return np.array([[value(D[t, l]) for l in lambdas] for t in self._meas_times])
+
+    def _add_projected_spectra(self, rank, components, lambdas=None):
+        """Adds the spectral data projected on its leading right singular vectors to the model.
+
+        D = C*S^T + E is replaced by D*V_r = C*(V_r^T*S)^T + E*V_r, with V_r the first rank
+        right singular vectors of D. The model gets the index set projection_basis, the
+        parameter D_projected[t,q] and the variable S_projected[q,k] = (V_r^T*S)[q,k] so
+        the least squares terms of the objectives scale with rank instead of with
+        the number of wavelengths.
+
+           This method is not intended to be used by users directly
+
+        Args:
+            rank (int): number of singular vectors kept
+
+            components (list): absorbing components
+
+            lambdas (list, optional): wavelengths to project. Default all measured wavelengths
+
+        Returns:
+            float with the squared norm of D not captured by the projection, i.e. the
+            constant that separates the projected and full least squares objectives
+        """
+        if lambdas is None:
+            lambdas = self._meas_lambdas
+        d_array = self._spectra_array(lambdas)
+        d_projected, basis, residual = project_spectra(d_array, rank)
+        rank = basis.shape[1]
+
+        m = self.model
+        m.projection_basis = Set(initialize=range(rank), ordered=True)
+        d_init = dict()
+        for i, t in enumerate(self._meas_times):
+            for q in range(rank):
+                d_init[t, q] = d_projected[i, q]
+        m.D_projected = Param(m.meas_times, m.projection_basis, initialize=d_init)
+
+        s_array = self._var_binding('S', lambdas, components).get_array()
+        s_array[np.isnan(s_array)] = 0.0
+        s_init = basis.T.dot(s_array)
+        m.S_projected = Var(m.projection_basis, components,
+                            initialize=dict(((q, k), s_init[q, j]) for q in range(rank)
+                                            for j, k in enumerate(components)))
+        return residual
+
+    def _recover_S_from_projection(self, components, c_name='C'):
+        """Maps the projected solution back to full resolution absorbances.
+
+        With the concentrations of the projected problem fixed, S[l,k] >= 0 is obtained for all
+        measured wavelengths by a nonnegative least squares fit of D (one block per wavelength)
+        and loaded into the model. The projection components are deleted.
+
+           This method is not intended to be used by users directly
+
+        Args:
+            components (list): absorbing components
+
+            c_name (str, optional): name of the concentration variable. Default 'C'
+
+        Returns:
+            None
+        """
+        self._fill_S_by_nnls(components, c_name=c_name)
+        for name in ('S_projected', 'D_projected', 'projection_basis'):
+            self.model.del_component(name)
+
+    def _fill_S_by_nnls(self, components, c_name='C', lambdas=None):
+        """Sets S[l,k] >= 0 by nonnegative least squares fits of D with the concentrations fixed.
+
+           This method is not intended to be used by users directly
+
+        Args:
+            components (list): absorbing components
+
+            c_name (str, optional): name of the concentration variable. Default 'C'
+
+            lambdas (list, optional): wavelengths to fit. Default all measured wavelengths
+
+        Returns:
+            None
+        """
+        if lambdas is None:
+            lambdas = self._meas_lambdas
+        if len(lambdas) == 0:
+            return
+        c_array = self._var_binding(c_name, self._meas_times, components).get_array()
+        s_array = nnls_blocked(c_array, self._spectra_array(lambdas))
+        self._var_binding('S', lambdas, components).set_array(s_array.T)
+
 # for redirecting stdout to files
 @contextmanager
 def stdout_redirector(stream):
@@ -260,3 +385,165 @@ def stdout_redirector(stream):
         yield
     finally:
         sys.stdout = old_stdout
+
+
+def project_spectra(d_array, rank):
+    """Projects spectral data on its leading right singular vectors.
+
+    Args:
+        d_array (ndarray): spectra with one row per measurement time
+
+        rank (int): number of singular vectors kept
+
+    Returns:
+        tuple (D*V_r, V_r, residual) with V_r the (n_wavelengths, rank) orthonormal basis and
+        residual the squared norm of D - D*V_r*V_r^T
+    """
+    rank = int(rank)
+    min_dim = min(d_array.shape)
+    if rank < 1:
+        raise RuntimeError('The projection rank must be a positive integer')
+    rank = min(rank, min_dim)
+    if 2 * rank < min_dim:
+        import scipy.sparse.linalg
+        _, s, Vt = scipy.sparse.linalg.svds(d_array, k=rank)
+        Vt = Vt[np.argsort(s)[::-1]]
+    else:
+        _, s, Vt = np.linalg.svd(d_array, full_matrices=False)
+        Vt = Vt[:rank]
+    basis = Vt.T
+    d_projected = d_array.dot(basis)
+    residual = max(np.einsum('ij,ij->', d_array, d_array) - np.einsum('ij,ij->', d_projected, d_projected), 0.0)
+    return d_projected, basis, residual
+
+
+def nnls_blocked(A, B, tol=None, max_iter=None):
+    """Solves min ||A*x_j - b_j|| s.t. x_j >= 0 for every column b_j of B.
+
+    All columns share the matrix A so the blocks are solved together with an
+    active-set method on the normal equations (fast combinatorial NNLS of
+    Van Benthem and Keenan). Columns with the same passive set are solved with
+    a single factorization, which makes the cost linear in the number of
+    columns. Used for the per-wavelength S and per-time C subproblems of
+    the variance estimator.
+
+    Args:
+        A (array_like): matrix of size m x n shared by all blocks
+
+        B (array_like): right hand sides of size m x k (or vector of size m)
+
+        tol (float, optional): tolerance on the dual variables. Default based on
+        machine precision and the norm of A^T*A
+
+        max_iter (int, optional): maximum number of active-set iterations. Default 3*n
+
+    Returns:
+        ndarray of size n x k (or vector of size n) with the nonnegative solutions
+
+    """
+    A = np.asarray(A, dtype=float)
+    B = np.asarray(B, dtype=float)
+    is_vector = B.ndim == 1
+    if is_vector:
+        B = B.reshape(-1, 1)
+    n = A.shape[1]
+    k = B.shape[1]
+
+    AtA = A.T.dot(A)
+    AtB = A.T.dot(B)
+    if tol is None:
+        tol = 10.0*np.finfo(float).eps*np.linalg.norm(AtA, 1)*max(A.shape)
+    if max_iter is None:
+        max_iter = 3*n
+
+    # unconstrained solution gives the initial passive sets
+    X = _passive_set_solve(AtA, AtB)
+    P = X > 0.0
+    X[~P] = 0.0
+    F = np.flatnonzero(~P.all(axis=0))
+
+    n_iter = 0
+    while F.size:
+        n_iter += 1
+        if n_iter > max_iter:
+            warnings.warn("nnls_blocked reached the maximum number of iterations "
+                          "with {} blocks not converged".format(F.size))
+            break
+        Y = X[:, F]
+        Pf = P[:, F]
+        AtB_f = AtB[:, F]
+        Xf = _passive_set_solve(AtA, AtB_f, Pf)
+
+        # moves back to the feasible region the blocks with negative entries
+        H = np.flatnonzero((Xf < 0.0).any(axis=0))
+        inner = 0
+        while H.size and inner < max_iter:
+            inner += 1
+            Yh = Y[:, H]
+            Xh = Xf[:, H]
+            Ph = Pf[:, H]
+            neg = Ph & (Xh < 0.0)
+            ratio = np.full(Xh.shape, np.inf)
+            ratio[neg] = Yh[neg]/(Yh[neg]-Xh[neg])
+            alpha = ratio.min(axis=0)
+            Yh = Yh+alpha*(Xh-Yh)
+            Ph = Ph & ~(neg & (ratio <= alpha)) & (Yh > tol)
+            Yh[~Ph] = 0.0
+            Xh = _passive_set_solve(AtA, AtB_f[:, H], Ph)
+            Y[:, H] = Yh
+            Pf[:, H] = Ph
+            Xf[:, H] = Xh
+            H = H[(Xh < 0.0).any(axis=0)]
+        Xf[Xf < 0.0] = 0.0
+
+        X[:, F] = Xf
+        P[:, F] = Pf
+
+        # optimality check on the dual variables of the active set
+        W = AtB_f-AtA.dot(Xf)
+        W[Pf] = -np.inf
+        not_optimal = (W > tol).any(axis=0)
+        F = F[not_optimal]
+        if F.size:
+            P[W[:, not_optimal].argmax(axis=0), F] = True
+
+    if is_vector:
+        return X[:, 0]
+    return X
+
+
+def _passive_set_solve(AtA, AtB, P=None):
+    """Solves the normal equations restricted to the passive set of every column.
+
+       This method is not intended to be used by users directly
+
+    Args:
+        AtA (ndarray): matrix A^T*A of size n x n
+
+        AtB (ndarray): matrix A^T*B of size n x k
+
+        P (ndarray, optional): boolean n x k passive sets. Default all variables passive
+
+    Returns:
+        ndarray of size n x k with zeros outside the passive sets
+
+    """
+    if P is None or P.all():
+        return _spd_solve(AtA, AtB)
+    K = np.zeros(AtB.shape)
+    patterns, inverse = np.unique(P.T, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    for u in range(patterns.shape[0]):
+        idx = np.flatnonzero(patterns[u])
+        if not idx.size:
+            continue
+        cols = np.flatnonzero(inverse == u)
+        K[np.ix_(idx, cols)] = _spd_solve(AtA[np.ix_(idx, idx)], AtB[np.ix_(idx, cols)])
+    return K
+
+
+def _spd_solve(M, rhs):
+    try:
+        return np.linalg.solve(M, rhs)
+    except np.linalg.LinAlgError:
+        return np.linalg.lstsq(M, rhs, rcond=None)[0]
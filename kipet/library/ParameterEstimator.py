@@ -5,6 +5,8 @@ from __future__ import division
 from pyomo.environ import *
 from pyomo.dae import *
 from kipet.library.Optimizer import *
+from kipet.library.parallel_tools import fork_map
+from kipet.library.sensitivity_io import *
 from pyomo.core.base.expr import Expr_if
 import numpy as np
 import six
@@ -30,6 +32,8 @@ class ParameterEstimator(Optimizer):
         self._estimability = False
         self._idx_to_variable = dict()
         self._n_actual = self._n_components
+        self._objective_value = None
+        self._termination_condition = None
         
         if hasattr(self.model, 'non_absorbing'):
             warnings.warn("Overriden by non_absorbing")
@@ -73,6 +77,8 @@ class ParameterEstimator(Optimizer):
         weights = kwds.pop('weights', [1.0, 1.0])
         covariance = kwds.pop('covariance', False)
         species_list = kwds.pop('subset_components', None)
+        projection_rank = kwds.pop('projection_rank', None)
+        wavelength_subset = kwds.pop('wavelength_subset', None)
 
         list_components = []
         if species_list is None:
@@ -85,6 +91,14 @@ class ParameterEstimator(Optimizer):
                     warnings.warn("Ignored {} since is not a mixture component of the model".format(k))
         if not self._spectra_given:
             raise NotImplementedError("Extended model requires spectral data model.D[ti,lj]")
+        if projection_rank is not None and (covariance or with_d_vars):
+            raise RuntimeError('projection_rank cannot be combined with covariance or with_d_vars')
+        if wavelength_subset is not None:
+            if covariance:
+                raise RuntimeError('wavelength_subset cannot be combined with covariance')
+            lambdas = self._check_wavelength_subset(wavelength_subset)
+        else:
+            lambdas = self._meas_lambdas
 
         if hasattr(self.model, 'non_absorbing'):
             warnings.warn("Overriden by non_absorbing!")
@@ -108,22 +122,31 @@ class ParameterEstimator(Optimizer):
 
         m = self.model
 
+        if projection_rank is not None:
+            projection_residual = self._add_projected_spectra(projection_rank, list_components,
+                                                              lambdas=lambdas)
+
         if with_d_vars:
             m.D_bar = Var(m.meas_times,
-                          m.meas_lambdas)
+                          lambdas)
 
             def rule_D_bar(m, t, l):
                 return m.D_bar[t, l] == sum(m.C[t, k] * m.S[l, k] for k in self._sublist_components)
 
             m.D_bar_constraint = Constraint(m.meas_times,
-                                            m.meas_lambdas,
+                                            lambdas,
                                             rule=rule_D_bar)
 
         # estimation
         def rule_objective(m):
             expr = 0
             for t in m.meas_times:
-                for l in m.meas_lambdas:
+                if projection_rank is not None:
+                    for q in m.projection_basis:
+                        D_bar = sum(m.C[t, k] * m.S_projected[q, k] for k in list_components)
+                        expr += (m.D_projected[t, q] - D_bar) ** 2 / (sigma_sq['device'])
+                    continue
+                for l in lambdas:
                     if with_d_vars:
                         expr += (m.D[t, l] - m.D_bar[t, l]) ** 2 / (sigma_sq['device'])
                     else:
@@ -145,16 +168,15 @@ class ParameterEstimator(Optimizer):
 
         if covariance and self.solver == 'ipopt_sens':
             self._tmpfile = "ipopt_hess"
-            solver_results = optimizer.solve(m, tee=False,
-                                             logfile=self._tmpfile,
-                                             report_timing=True)
-
-            print("Done solving building reduce hessian")
-            output_string = ''
-            with open(self._tmpfile, 'r') as f:
-                output_string = f.read()
-            if os.path.exists(self._tmpfile):
-                os.remove(self._tmpfile)
+            with scratch_directory() as path:
+                solver_results = solve_in_directory(optimizer, path, m, tee=False,
+                                                    logfile=self._tmpfile,
+                                                    report_timing=True)
+
+                print("Done solving building reduce hessian")
+                output_string = ''
+                with open(os.path.join(path, self._tmpfile), 'r') as f:
+                    output_string = f.read()
             # output_string = f.getvalue()
             ipopt_output, hessian_output = split_sipopt_string(output_string)
             # print hessian_output
@@ -209,17 +231,19 @@ class ParameterEstimator(Optimizer):
                 count_vars += 1
 
             self._tmpfile = "k_aug_hess"
-            ip = SolverFactory('ipopt')
-            solver_results = ip.solve(m, tee=False,
-                                      logfile=self._tmpfile,
-                                      report_timing=True)
-            k_aug = SolverFactory('k_aug')
-            # k_aug.options["compute_inv"] = ""
-            m.ipopt_zL_in.update(m.ipopt_zL_out)  #: be sure that the multipliers got updated!
-            m.ipopt_zU_in.update(m.ipopt_zU_out)
-            # m.write(filename="mynl.nl", format=ProblemFormat.nl)
-            k_aug.solve(m, tee=False)
-            print("Done solving building reduce hessian")
+            with scratch_directory() as path:
+                ip = SolverFactory('ipopt')
+                solver_results = solve_in_directory(ip, path, m, tee=False,
+                                                    logfile=self._tmpfile,
+                                                    report_timing=True)
+                k_aug = SolverFactory('k_aug')
+                # k_aug.options["compute_inv"] = ""
+                m.ipopt_zL_in.update(m.ipopt_zL_out)  #: be sure that the multipliers got updated!
+                m.ipopt_zU_in.update(m.ipopt_zU_out)
+                # m.write(filename="mynl.nl", format=ProblemFormat.nl)
+                solve_in_directory(k_aug, path, m, tee=False)
+                print("Done solving building reduce hessian")
+                unordered_hessian = read_matrix(os.path.join(path, 'result_red_hess.txt'))
 
             if not all_sigma_specified:
                 raise RuntimeError(
@@ -240,9 +264,6 @@ class ParameterEstimator(Optimizer):
 
             vlocsize = len(var_loc)
             print("var_loc size, ", vlocsize)
-            unordered_hessian = np.loadtxt('result_red_hess.txt')
-            if os.path.exists('result_red_hess.txt'):
-                os.remove('result_red_hess.txt')
             # hessian = read_reduce_hessian_k_aug(hessian_output, n_vars)
             # hessian =hessian_output
             # print(hessian)
@@ -254,6 +275,15 @@ class ParameterEstimator(Optimizer):
         else:
             solver_results = optimizer.solve(m, tee=tee)
 
+        self._termination_condition = solver_results.solver.termination_condition
+        self._objective_value = value(m.objective)
+        if projection_rank is not None:
+            # the part of D outside the projection is a constant of the full objective
+            self._objective_value += weights[0] * projection_residual / sigma_sq['device']
+            self._recover_S_from_projection(list_components)
+        elif wavelength_subset is not None:
+            excluded = [l for l in self._meas_lambdas if l not in set(lambdas)]
+            self._fill_S_by_nnls(list_components, lambdas=excluded)
         if with_d_vars:
             m.del_component('D_bar')
             m.del_component('D_bar_constraint')
@@ -327,19 +357,18 @@ class ParameterEstimator(Optimizer):
 
         if covariance and self.solver == 'ipopt_sens':
             self._tmpfile = "ipopt_hess"
-            solver_results = optimizer.solve(m, tee=False,
-                                             logfile=self._tmpfile,
-                                             report_timing=True)
-            # self.model.red_hessian.pprint
-            m.P.pprint()
-            print("Done solving building reduce hessian")
-            output_string = ''
-            with open(self._tmpfile, 'r') as f:
-                output_string = f.read()
-
-                print("output_string", output_string)
-            if os.path.exists(self._tmpfile):
-                os.remove(self._tmpfile)
+            with scratch_directory() as path:
+                solver_results = solve_in_directory(optimizer, path, m, tee=False,
+                                                    logfile=self._tmpfile,
+                                                    report_timing=True)
+                # self.model.red_hessian.pprint
+                m.P.pprint()
+                print("Done solving building reduce hessian")
+                output_string = ''
+                with open(os.path.join(path, self._tmpfile), 'r') as f:
+                    output_string = f.read()
+
+                    print("output_string", output_string)
             # output_string = f.getvalue()
             ipopt_output, hessian_output = split_sipopt_string(output_string)
             # print hessian_output
@@ -404,19 +433,21 @@ class ParameterEstimator(Optimizer):
                 count_vars += 1
 
             self._tmpfile = "k_aug_hess"
-            ip = SolverFactory('ipopt')
-            solver_results = ip.solve(m, tee=False,
-                                      logfile=self._tmpfile,
-                                      report_timing=True)
-            # m.P.pprint()
-            k_aug = SolverFactory('k_aug')
-
-            # k_aug.options["no_scale"] = ""
-            m.ipopt_zL_in.update(m.ipopt_zL_out)  #: be sure that the multipliers got updated!
-            m.ipopt_zU_in.update(m.ipopt_zU_out)
-            # m.write(filename="mynl.nl", format=ProblemFormat.nl)
-            k_aug.solve(m, tee=True)
-            print("Done solving building reduce hessian")
+            with scratch_directory() as path:
+                ip = SolverFactory('ipopt')
+                solver_results = solve_in_directory(ip, path, m, tee=False,
+                                                    logfile=self._tmpfile,
+                                                    report_timing=True)
+                # m.P.pprint()
+                k_aug = SolverFactory('k_aug')
+
+                # k_aug.options["no_scale"] = ""
+                m.ipopt_zL_in.update(m.ipopt_zL_out)  #: be sure that the multipliers got updated!
+                m.ipopt_zU_in.update(m.ipopt_zU_out)
+                # m.write(filename="mynl.nl", format=ProblemFormat.nl)
+                solve_in_directory(k_aug, path, m, tee=True)
+                print("Done solving building reduce hessian")
+                unordered_hessian = read_matrix(os.path.join(path, 'result_red_hess.txt'))
 
             if not all_sigma_specified:
                 raise RuntimeError(
@@ -437,9 +468,6 @@ class ParameterEstimator(Optimizer):
 
             vlocsize = len(var_loc)
             print("var_loc size, ", vlocsize)
-            unordered_hessian = np.loadtxt('result_red_hess.txt')
-            if os.path.exists('result_red_hess.txt'):
-                os.remove('result_red_hess.txt')
             # hessian = read_reduce_hessian_k_aug(hessian_output, n_vars)
             # hessian =hessian_output
             # print(hessian)
@@ -452,6 +480,8 @@ class ParameterEstimator(Optimizer):
         else:
             solver_results = optimizer.solve(m, tee=tee)
 
+        self._termination_condition = solver_results.solver.termination_condition
+        self._objective_value = value(m.objective)
         m.del_component('objective')
 
     def _define_reduce_hess_order(self):
@@ -507,30 +537,26 @@ class ParameterEstimator(Optimizer):
         all_H = hessian
         H = all_H[-nparams:, :]
         # H = hessian
-        print("Computing B matrix\n shape ({},{})".format(ntheta, nd))
-        self._compute_B_matrix(variances)
-        B = self.B_matrix
-        print("Computing Vd matrix\n shape ({},{})".format(nd, nd))
-        self._compute_Vd_matrix(variances)
-        Vd = self.Vd_matrix
-        """
-        Vd_dense = Vd.toarray()
-        print("multiplying H*B")
-        M1 = H.dot(B)
-        print("multiplying H*B*Vd")
-        M2 = M1.dot(Vd_dense)
-        print("multiplying H*B*Vd*Bt")
-        M3 = M2.dot(B.T)
-        print("multiplying H*B*Vd*Bt*Ht")
-        V_theta = M3.dot(H)
-        """
 
-        # R = B.T.dot(H)
-        R = B.T.dot(H.T)
-        A = Vd.dot(R)
-        L = H.dot(B)
-        Vtheta = A.T.dot(L.T)
-        V_theta = Vtheta.T
+        # B (ntheta x nd) is only nonzero in the C and S rows and Vd (nd x nd) is block diagonal
+        # with the block W = S*diag(sigma^2)*S^T + sigma_d^2*I repeated for every time. Hence
+        # H*B*Vd*B^T*H^T = sum_i (H*B)_i*W*(H*B)_i^T, with (H*B)_i the columns of time t_i.
+        # Neither B nor Vd is formed.
+        print("Computing H*B blocks\n shape ({},{},{})".format(nparams, nt, nw))
+        s_array = self._var_binding('S', self._meas_lambdas, self._sublist_components).get_array()
+        c_array = self._var_binding('C', self._meas_times, self._sublist_components).get_array()
+        v_array = np.array([variances[c] for c in self._sublist_components])
+        v_device = variances['device']
+        H_C = H[:, :nt * nc].reshape(nparams, nt, nc)
+        H_S = H[:, nt * nc:nc * (nt + nw)].reshape(nparams, nw, nc)
+        HB = np.einsum('pik,jk->pij', H_C, s_array)
+        HB += np.einsum('pjk,ik->pij', H_S, c_array)
+        HB *= -2.0 / v_device
+
+        print("Computing H*B*Vd*Bt*Ht")
+        HBS = np.einsum('pij,jk->pik', HB, s_array)
+        HB = HB.reshape(nparams, nd)
+        V_theta = np.einsum('pik,k,qik->pq', HBS, v_array, HBS) + v_device * HB.dot(HB.T)
 
         nt = self._n_meas_times
         nw = self._n_meas_lambdas
@@ -638,22 +664,16 @@ class ParameterEstimator(Optimizer):
         nd = nw * nt
         ntheta = nc * (nw + nt) + nparams
         self.B_matrix = np.zeros((ntheta, nw * nt))
-        for i, t in enumerate(self.model.meas_times):
-            for j, l in enumerate(self.model.meas_lambdas):
-                for k, c in enumerate(self._sublist_components):
-                    # r_idx1 = k*nt+i
-                    r_idx1 = i * nc + k
-                    r_idx2 = j * nc + k + nc * nt
-                    # r_idx2 = j * nc + k + nc * nw
-                    # c_idx = i+j*nt
-                    c_idx = i * nw + j
-                    # print(j, k, r_idx2)
-                    self.B_matrix[r_idx1, c_idx] = -2 * self.model.S[l, c].value / variances['device']
-                    # try:
-                    self.B_matrix[r_idx2, c_idx] = -2 * self.model.C[t, c].value / variances['device']
-                    # except IndexError:
-                    #     pass
-        # sys.exit()
+        s_array = self._var_binding('S', self._meas_lambdas, self._sublist_components).get_array()
+        c_array = self._var_binding('C', self._meas_times, self._sublist_components).get_array()
+        # rows i*nc+k (C[t_i,c_k]) and columns i*nw+j (D[t_i,l_j])
+        B_C = self.B_matrix[:nt * nc].reshape(nt, nc, nt, nw)
+        idx = np.arange(nt)
+        B_C[idx, :, idx, :] = -2 * s_array.T / variances['device']
+        # rows nc*nt+j*nc+k (S[l_j,c_k]) and columns i*nw+j (D[t_i,l_j])
+        B_S = self.B_matrix[nt * nc:nc * (nt + nw)].reshape(nw, nc, nt, nw)
+        idx = np.arange(nw)
+        B_S[idx, :, :, idx] = -2 * c_array.T / variances['device']
 
     def _compute_Vd_matrix(self, variances, **kwds):
         """Builds d covariance matrix
@@ -690,39 +710,12 @@ class ParameterEstimator(Optimizer):
                             col.append(q*nw+p)
                             data.append(val)
         """
-        s_array = np.zeros(nw * nc)
-        v_array = np.zeros(nc)
-        for k, c in enumerate(self._sublist_components):
-            v_array[k] = variances[c]
-
-        for j, l in enumerate(self.model.meas_lambdas):
-            for k, c in enumerate(self._sublist_components):
-                s_array[j * nc + k] = self.model.S[l, c].value
-
-        row = []
-        col = []
-        data = []
-        nd = nt * nw
-        # Vd_dense = np.zeros((nd,nd))
-        v_device = variances['device']
-        for i in range(nt):
-            for j in range(nw):
-                val = sum(v_array[k] * s_array[j * nc + k] ** 2 for k in range(nc)) + v_device
-                row.append(i * nw + j)
-                col.append(i * nw + j)
-                data.append(val)
-                # Vd_dense[i*nw+j,i*nw+j] = val
-                for p in range(nw):
-                    if j != p:
-                        val = sum(v_array[k] * s_array[j * nc + k] * s_array[p * nc + k] for k in range(nc))
-                        row.append(i * nw + j)
-                        col.append(i * nw + p)
-                        data.append(val)
-                        # Vd_dense[i*nw+j,i*nw+p] = val
-
-        self.Vd_matrix = scipy.sparse.coo_matrix((data, (row, col)),
-                                                 shape=(nd, nd)).tocsr()
-        # self.Vd_matrix = Vd_dense
+        s_array = self._var_binding('S', self._meas_lambdas, self._sublist_components).get_array()
+        v_array = np.array([variances[c] for c in self._sublist_components])
+        # same block S*diag(sigma^2)*S^T + sigma_d^2*I at every measurement time
+        block = (s_array * v_array).dot(s_array.T) + variances['device'] * np.eye(nw)
+        self.Vd_matrix = scipy.sparse.kron(scipy.sparse.identity(nt, format='csr'),
+                                           scipy.sparse.csr_matrix(block), format='csr')
 
     def _compute_residuals(self):
         """
@@ -881,6 +874,16 @@ class ParameterEstimator(Optimizer):
             being used by the estimability analysis and therefore will need to return the
             hessian for analysis.
 
+            projection_rank (int, optional): solves the spectral problem with D projected on
+            its leading projection_rank right singular vectors, i.e. for C and a reduced
+            (projection_rank x n_components) absorbance matrix, and then recovers the full S
+            by nonnegative least squares. The problem size no longer grows with the number of
+            wavelengths. Not available with covariance or with_d_vars. Default None (full problem)
+
+            wavelength_subset (list, optional): wavelengths used in the spectral objective, e.g.
+            from data_tools.select_wavelengths. S at the other wavelengths is fitted by nonnegative
+            least squares after the solve. Not available with covariance. Default all wavelengths
+
         Returns:
             Results object with loaded results
 
@@ -998,6 +1001,8 @@ class ParameterEstimator(Optimizer):
                 "WARNING: The model has an active objective. Running optimization with models objective.\n"
                 " To solve optimization with default objective (Weifengs) deactivate all objectives in the model.")
             solver_results = opt.solve(self.model, tee=tee)
+            self._termination_condition = solver_results.solver.termination_condition
+            self._objective_value = value(self.model.component(active_objectives[0]))
         elif self._spectra_given:
             self._solve_extended_model(variances, opt,
                                        tee=tee,
@@ -1033,6 +1038,7 @@ class ParameterEstimator(Optimizer):
             param_vals[name] = self.model.P[name].value
 
         results.P = param_vals
+        results.solver_statistics['objective'] = self._objective_value
 
         if self._estimability == True:
             return self.hessian, results
@@ -1040,6 +1046,144 @@ class ParameterEstimator(Optimizer):
             return results
 
 
+    def run_multistart(self, solver, **kwds):
+        """Solves the parameter estimation problem from several starting points in parallel.
+
+        Starting values of the unfixed parameters are sampled within the bounds given
+        in TemplateBuilder.add_parameter. Every start is solved on a clone of the
+        discretized model in a pool of forked worker processes. The parameters and
+        trajectories of the best solution are loaded in the model of this estimator.
+
+        Args:
+            solver (str): name of the nonlinear solver to used
+
+            n_starts (int, optional): number of sampled starting points. Default 10
+
+            sampling (str, optional): 'lhs' (latin hypercube), 'sobol' or 'random'. Default 'lhs'
+
+            seed (int, optional): seed of the sampling
+
+            include_initial (bool, optional): flag to also solve from the current parameter
+            values. Default True
+
+            n_workers (int, optional): number of worker processes. Default number of cores
+
+            **kwds: options passed to run_opt (solver_opts, variances, with_d_vars...)
+
+        Returns:
+            tuple (best, ranked). best is the Results object with the lowest objective and
+            ranked the list of Results objects of all starts that terminated optimal, sorted
+            by objective. Each one stores its starting point in solver_statistics['start'] and
+            the solver termination condition in solver_statistics['termination_condition'].
+            Starts that fail or do not terminate optimal are reported and left out
+
+        """
+        n_starts = kwds.pop('n_starts', 10)
+        sampling = kwds.pop('sampling', 'lhs')
+        seed = kwds.pop('seed', None)
+        include_initial = kwds.pop('include_initial', True)
+        n_workers = kwds.pop('n_workers', None)
+
+        if kwds.get('covariance', False) or kwds.get('estimability', False):
+            raise RuntimeError('run_multistart does not support covariance or estimability. '
+                               'Call run_opt from the best solution instead')
+        if not self.model.time.get_discretization_info():
+            raise RuntimeError('apply discretization first before initializing')
+
+        names = [k for k, v in self.model.P.items() if not v.is_fixed()]
+        bounds = []
+        for k in names:
+            lb, ub = self.model.P[k].bounds
+            if lb is None or ub is None:
+                raise RuntimeError('Parameter {} needs lower and upper bounds for multistart'.format(k))
+            bounds.append((lb, ub))
+
+        samples = sample_parameter_starts(bounds, n_starts, sampling=sampling, seed=seed)
+        starts = [dict(zip(names, row)) for row in samples.tolist()]
+        if include_initial:
+            starts.insert(0, dict((k, self.model.P[k].value) for k in names))
+
+        print("Solving {} starting points".format(len(starts)))
+        outputs = fork_map(_solve_from_start, starts,
+                           shared=(self, solver, kwds),
+                           n_workers=n_workers)
+
+        ranked = []
+        for start, (results, error) in zip(starts, outputs):
+            if error is not None or results.solver_statistics.get('objective') is None:
+                print("Start {} failed:\n{}".format(start, error))
+                continue
+            condition = results.solver_statistics.get('termination_condition')
+            if condition != TerminationCondition.optimal:
+                print("Start {} did not converge: termination condition {}".format(start, condition))
+                continue
+            ranked.append(results)
+        if not ranked:
+            raise RuntimeError('All starting points failed or did not converge')
+        ranked.sort(key=lambda r: r.solver_statistics['objective'])
+
+        best = ranked[0]
+        for k, v in best.P.items():
+            self.model.P[k].value = v
+        for name in ['Z', 'dZdt', 'X', 'dXdt', 'C', 'S', 'Y']:
+            trajectory = getattr(best, name, None)
+            if isinstance(trajectory, pd.DataFrame) and not trajectory.empty:
+                self.initialize_from_trajectory(name, trajectory)
+        return best, ranked
+
+
+def sample_parameter_starts(bounds, n_samples, sampling='lhs', seed=None):
+    """Samples points in a box.
+
+    Args:
+        bounds (list): (lower, upper) tuple for each dimension
+
+        n_samples (int): number of points
+
+        sampling (str, optional): 'lhs' (latin hypercube), 'sobol' or 'random'. Default 'lhs'
+
+        seed (int, optional): seed of the random generator
+
+    Returns:
+        ndarray with shape (n_samples, len(bounds))
+
+    """
+    rng = np.random.RandomState(seed)
+    dim = len(bounds)
+    if sampling == 'lhs':
+        unit = (np.argsort(rng.rand(n_samples, dim), axis=0) + rng.rand(n_samples, dim)) / n_samples
+    elif sampling == 'sobol':
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise RuntimeError('Sobol sampling requires scipy>=1.7. Try lhs')
+        unit = qmc.Sobol(d=dim, scramble=True, seed=seed).random(n_samples)
+    elif sampling == 'random':
+        unit = rng.rand(n_samples, dim)
+    else:
+        raise RuntimeError('Sampling {} not supported. Try lhs, sobol or random'.format(sampling))
+    lower = np.array([b[0] for b in bounds], dtype=float)
+    upper = np.array([b[1] for b in bounds], dtype=float)
+    return lower + unit * (upper - lower)
+
+
+def _solve_from_start(shared, start):
+    """Solves the estimation problem of a clone of the model from a starting point.
+
+       This method is not intended to be used by users directly
+
+    """
+    estimator, solver, kwds = shared
+    model = estimator.model.clone()
+    for k, v in start.items():
+        model.P[k].value = v
+    start_estimator = ParameterEstimator(model)
+    results = start_estimator.run_opt(solver, **copy.deepcopy(kwds))
+    results.solver_statistics['start'] = start
+    results.solver_statistics['termination_condition'] = start_estimator._termination_condition
+    return results
+
+
 def split_sipopt_string(output_string):
     start_hess = output_string.find('DenseSymMatrix')
     ipopt_string = output_string[:start_hess]
@@ -1073,20 +1217,7 @@ def read_reduce_hessian2(hessian_string, n_vars):
 
 
 def read_reduce_hessian(hessian_string, n_vars):
-    hessian = np.zeros((n_vars, n_vars))
-    for i, line in enumerate(hessian_string.split('\n')):
-        if i > 0:  # ignores header
-            if line not in ['', ' ', '\t']:
-                hess_line = line.split(']=')
-                if len(hess_line) == 2:
-                    value = float(hess_line[1])
-                    column_line = hess_line[0].split(',')
-                    col = int(column_line[1])
-                    row_line = column_line[0].split('[')
-                    row = int(row_line[1])
-                    hessian[row, col] = float(value)
-                    hessian[col, row] = float(value)
-    return hessian
+    return read_reduced_hessian(hessian_string, n_vars)
 
 #######################additional for inputs###CS
 def t_ij(time_set, i, j):
@@ -1141,17 +1272,4 @@ def fe_cp(time_set, feedtime):
 ################################################
 
 def read_reduce_hessian_k_aug(hessian_string, n_vars):
-    hessian = np.zeros((n_vars, n_vars))
-    for i, line in enumerate(hessian_string.split('\n')):
-        if i > 0:  # ignores header
-            if line not in ['', ' ', '\t']:
-                hess_line = line.split(']=')
-                if len(hess_line) == 2:
-                    value = float(hess_line[1])
-                    column_line = hess_line[0].split(',')
-                    col = int(column_line[1])
-                    row_line = column_line[0].split('[')
-                    row = int(row_line[1])
-                    hessian[row, col] = float(value)
-                    hessian[col, row] = float(value)
-    return hessian
+    return read_reduced_hessian(hessian_string, n_vars)
@@ -2,6 +2,7 @@ from pyomo.environ import *
 from pyomo.dae import *
 from kipet.library.ResultsObject import *
 from kipet.library.Simulator import *
+from kipet.library.VarArrayBinding import VarArrayBinding
 import warnings
 import six
 import sys
@@ -39,6 +40,7 @@ class PyomoSimulator(Simulator):
         self._spectra_given = hasattr(self.model, 'D')
         self._concentration_given = hasattr(self.model, 'C')
         self._absorption_given = hasattr(self.model, 'S') #added for special case of absorption data available but not concentration data CS
+        self._bindings = dict()
 
         #creates scaling factor suffix
         if not hasattr(self.model, 'scaling_factor'):
@@ -63,17 +65,15 @@ class PyomoSimulator(Simulator):
         else:
             print('***WARNING: Model already discretized. Ignoring second discretization')
 
-    def fix_from_trajectory(self,variable_name,variable_index,trajectories):
+    def fix_from_trajectory(self,variable_name,variable_index,trajectories,interpolation='linear'):
 
         if variable_name in ['X','dXdt','Z','dZdt']:
             raise NotImplementedError("Fixing state variables is not allowd. Only algebraics can be fixed")
         
         single_traj = trajectories[variable_index]
         sim_times = sorted(self._times)
-        var = getattr(self.model,variable_name)
-        for i,t in enumerate(sim_times):
-            value = interpolate_from_trayectory(t,single_traj)
-            var[t,variable_index].fix(value)
+        values = interpolate_trajectories(sim_times,single_traj,interpolation)
+        self._var_binding(variable_name,sim_times,[variable_index]).set_array(values.reshape(-1,1),fix=True)
 
     def unfix_time_dependent_variable(self,variable_name,variable_index):
         var = getattr(self.model,variable_name)
@@ -148,7 +148,7 @@ class PyomoSimulator(Simulator):
         for k,v in params.items():
             self.model.P[k].value = v
             
-    def initialize_from_trajectory(self,variable_name,trajectories):
+    def initialize_from_trajectory(self,variable_name,trajectories,interpolation='linear'):
         """Initializes discretized points with values from trajectories.
 
         Args:
@@ -158,6 +158,8 @@ class PyomoSimulator(Simulator):
             variable is indexed. If the variable is by two sets then the first set is
             the indices of the data frame, the second set is the columns
 
+            interpolation (str,optional): 'linear', 'cubic' or 'pchip'. Default 'linear'
+
         Returns:
             None
 
@@ -246,12 +248,32 @@ class PyomoSimulator(Simulator):
                             else:
                                 var[t,component].value = None
         """
-        for component in to_initialize:
-            single_trajectory = trajectories[component]
-            for t in inner_set:
-                val = interpolate_from_trayectory(t,single_trajectory)
-                if not np.isnan(val):
-                    var[t,component].value = val
+        if to_initialize:
+            rows = sorted(inner_set)
+            values = interpolate_trajectories(rows,trajectories[to_initialize],interpolation)
+            self._var_binding(variable_name,rows,to_initialize).set_array(values,skip_nan=True)
+
+    def _var_binding(self,variable_name,rows,columns):
+        """Returns the VarArrayBinding of a variable for the given index sets.
+
+           This method is not intended to be used by users directly
+
+        Args:
+            variable_name (str): Name of the variable in pyomo model
+
+            rows (array_like): ordered elements of the first index set
+
+            columns (array_like): ordered elements of the second index set
+
+        Returns:
+            VarArrayBinding. Created on first use and cached afterwards
+        """
+        key = (variable_name,tuple(rows),tuple(columns))
+        binding = self._bindings.get(key)
+        if binding is None:
+            binding = VarArrayBinding(getattr(self.model,variable_name),rows,columns)
+            self._bindings[key] = binding
+        return binding
                 
     def scale_variables_from_trajectory(self,variable_name,trajectories):
         """Scales discretized variables with maximum value of the trajectory.
@@ -319,11 +341,12 @@ class PyomoSimulator(Simulator):
                     raise RuntimeError('Algebraics {} is not in model algebraics'.format(component))
         
         tol = 1e-5
-        for component in columns:
-            if nominal_vals[component]>= tol:
-                scale = 1.0/nominal_vals[component]
-                for t in inner_set:
-                    self.model.scaling_factor.set_value(var[t,component],scale)
+        to_scale = [component for component in columns if nominal_vals[component]>= tol]
+        if to_scale:
+            scales = [1.0/nominal_vals[component] for component in to_scale]
+            binding = self._var_binding(variable_name,sorted(inner_set),to_scale)
+            for var_data,scale in zip(binding.var_data(),scales*binding.shape[0]):
+                self.model.scaling_factor.set_value(var_data,scale)
 
         self._ipopt_scaled = True
             
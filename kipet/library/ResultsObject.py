@@ -4,8 +4,13 @@ import pandas as pd
 import numpy as np
 from pyomo.core import *
 from pyomo.environ import *
+import weakref
 import six
 
+# sorted index sets and ordered var data of 2D variables loaded in compact mode.
+# Reused by every ResultsObject loading the same variable
+_compact_layouts = weakref.WeakKeyDictionary()
+
 class ResultsObject(object):
     def __init__(self):
         """
@@ -25,6 +30,55 @@ class ResultsObject(object):
         self.P = None
         self.dZdt = None
         self.dXdt = None
+        self._arrays = dict()
+
+    def __getattr__(self, name):
+        # only called when name is not an attribute. Variables stored in
+        # compact mode are exposed as DataFrames sharing the stored array
+        arrays = self.__dict__.get('_arrays')
+        if arrays and name in arrays:
+            values, index, columns = arrays[name]
+            return pd.DataFrame(data=values, index=index, columns=columns, copy=False)
+        raise AttributeError("'ResultsObject' object has no attribute '{}'".format(name))
+
+    def set_array(self, name, values, index, columns):
+        """Stores a 2D variable as a contiguous array (compact mode).
+
+        Args:
+            name (str): name of the variable (e.g. 'Z')
+
+            values (ndarray): array with shape (len(index), len(columns))
+
+            index (array_like): sorted row labels
+
+            columns (array_like): sorted column labels
+
+        Returns:
+            None
+
+        """
+        self.__dict__.pop(name, None)
+        self._arrays[name] = (np.ascontiguousarray(values, dtype=float), index, columns)
+
+    def get_array(self, name):
+        """Returns the values of a variable as a numpy array.
+
+        Note:
+            For variables stored in compact mode no copy is made
+
+        Args:
+            name (str): name of the variable (e.g. 'Z')
+
+        Returns:
+            ndarray
+        """
+        if name not in self.__dict__ and name in self._arrays:
+            return self._arrays[name][0]
+        return np.array(getattr(self, name))
+
+    def is_compact(self, name):
+        """Returns True if the variable is stored in compact mode"""
+        return name not in self.__dict__ and name in self._arrays
 
     def __str__(self):
         string = "\nRESULTS\n"
@@ -48,11 +102,25 @@ class ResultsObject(object):
         return string
 
     def compute_var_norm(self,variable_name,norm_type=np.inf):
-        var = getattr(self,variable_name)
-        var_array = np.array(var)
+        var_array = self.get_array(variable_name)
         return np.linalg.norm(var_array,norm_type)
     
-    def load_from_pyomo_model(self,instance,to_load=[]):
+    def load_from_pyomo_model(self,instance,to_load=[],compact=False):
+        """Loads the values of the variables of a pyomo model.
+
+        Args:
+            instance (ConcreteModel): pyomo model
+
+            to_load (list,optional): names of the variables to load. Default all variables
+
+            compact (bool,optional): flag to store 2D variables as contiguous arrays
+            with one bulk extraction per variable. DataFrames are then created on
+            access as views of the arrays. Default False
+
+        Returns:
+            None
+
+        """
 
         model_variables = set()
         for block in instance.block_data_objects():
@@ -80,6 +148,9 @@ class ResultsObject(object):
                     setattr(self,name,v.value)
                 elif v.dim()==1:
                     setattr(self,name,pd.Series(v.get_values()))
+                elif v.dim()==2 and compact:
+                    values, index, columns = _compact_values(v)
+                    self.set_array(name, values, index, columns)
                 elif v.dim()==2:
                     d = v.get_values()
                     keys = d.keys()
@@ -110,3 +181,42 @@ class ResultsObject(object):
                 else:
                     raise RuntimeError('load_from_pyomo_model function not supported for models with variables with dimension>2')
                 
+
+
+def _compact_layout(v):
+    """Returns sorted index sets and ordered var data of a 2D variable.
+
+       This method is not intended to be used by users directly
+
+    """
+    layout = _compact_layouts.get(v)
+    if layout is not None and len(layout[3]) == len(v):
+        return layout
+    split_keys = v._implicit_subsets
+    s_first_set = sorted(set(split_keys[0]))
+    s_second_set = sorted(set(split_keys[1]))
+    row = dict((w, i) for i, w in enumerate(s_first_set))
+    col = dict((k, j) for j, k in enumerate(s_second_set))
+    n = len(s_second_set)
+    keys = list(v.keys())
+    positions = np.array([row[w]*n+col[k] for w, k in keys], dtype=int)
+    var_data = [v[key] for key in keys]
+    layout = (np.array(s_first_set), np.array(s_second_set), positions, var_data)
+    _compact_layouts[v] = layout
+    return layout
+
+
+def _compact_values(v):
+    """Extracts all values of a 2D variable in one array.
+
+       This method is not intended to be used by users directly
+
+    """
+    index, columns, positions, var_data = _compact_layout(v)
+    values = np.array([vd.value for vd in var_data], dtype=float)
+    if positions.size == index.size*columns.size:
+        dense = np.empty(index.size*columns.size)
+    else:
+        dense = np.full(index.size*columns.size, np.nan)
+    dense[positions] = values
+    return dense.reshape(index.size, columns.size), index, columns
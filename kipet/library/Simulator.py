@@ -4,6 +4,7 @@ from kipet.library.ResultsObject import *
 import numpy as np
 import math
 import scipy
+import scipy.interpolate
 
 # need to move this two functions to utils
 def find_nearest(array,value):
@@ -34,6 +35,61 @@ def interpolate_from_trayectory(t,trajectory):
         y_tuple = (val,val1)
         return interpolate_linearly(t,x_tuple,y_tuple)
 
+def interpolate_trajectories(times,trajectories,method='linear'):
+    """Interpolates all columns of a trajectory at the given times in one pass.
+
+    Outside the time range of the trajectory the first or last value is used
+    (same as numpy.interp).
+
+    Args:
+        times (array_like): times where the trajectories are evaluated
+
+        trajectories (DataFrame or Series): values indexed by time
+
+        method (str,optional): 'linear', 'cubic' (cubic spline) or 'pchip'
+        (shape preserving cubic). Columns with nan values are always interpolated
+        linearly. Default 'linear'
+
+    Returns:
+        ndarray with shape (len(times),n_columns). One dimensional for a Series
+
+    """
+    if method not in ['linear','cubic','pchip']:
+        raise RuntimeError('Interpolation method {} not supported. Try linear, cubic or pchip'.format(method))
+    if not trajectories.index.is_monotonic_increasing:
+        trajectories = trajectories.sort_index()
+    x = np.asarray(times,dtype=float)
+    xp = np.asarray(trajectories.index,dtype=float)
+    fp = np.asarray(trajectories,dtype=float)
+    is_series = fp.ndim == 1
+    if is_series:
+        fp = fp.reshape(-1,1)
+
+    n = xp.size
+    if n == 1:
+        values = np.repeat(fp,x.size,axis=0)
+    else:
+        idx = np.clip(np.searchsorted(xp,x,side='right')-1,0,n-2)
+        w = np.clip((x-xp[idx])/(xp[idx+1]-xp[idx]),0.0,1.0).reshape(-1,1)
+        f0 = fp[idx]
+        f1 = fp[idx+1]
+        values = f0+w*(f1-f0)
+        # exact nodes do not depend on the neighbouring values (may be nan)
+        values = np.where(w == 0.0,f0,np.where(w == 1.0,f1,values))
+
+        if method in ['cubic','pchip'] and n > 2:
+            smooth = ~np.isnan(fp).any(axis=0)
+            if smooth.any():
+                if method == 'cubic':
+                    interpolant = scipy.interpolate.CubicSpline(xp,fp[:,smooth],axis=0)
+                else:
+                    interpolant = scipy.interpolate.PchipInterpolator(xp,fp[:,smooth],axis=0)
+                values[:,smooth] = interpolant(np.clip(x,xp[0],xp[-1]))
+
+    if is_series:
+        return values[:,0]
+    return values
+
 class Simulator(object):
     """Base simulator class.
 
@@ -85,19 +141,11 @@ class Simulator(object):
 
     def compute_D_given_SC(self,results,sigma_d=0):
         # this requires results to have S and C computed already
-        d_results = []
-        for i,t in enumerate(self._meas_times):
-            for j,l in enumerate(self._meas_lambdas):
-                suma = 0.0
-                for w,k in enumerate(self._mixture_components):
-                    C =  results.C[k][t]  
-                    S = results.S[k][l]
-                    suma+= C*S
-                if sigma_d:
-                    suma+= np.random.normal(0.0,sigma_d)
-                d_results.append(suma)
-                    
-        d_array = np.array(d_results).reshape((self._n_meas_times,self._n_meas_lambdas))
+        c_array = np.array(results.C.loc[self._meas_times,self._mixture_components],dtype=float)
+        s_array = np.array(results.S.loc[self._meas_lambdas,self._mixture_components],dtype=float)
+        d_array = c_array.dot(s_array.T)
+        if sigma_d:
+            d_array += np.random.normal(0.0,sigma_d,size=d_array.shape)
         results.D = pd.DataFrame(data=d_array,
                                  columns=self._meas_lambdas,
                                  index=self._meas_times)
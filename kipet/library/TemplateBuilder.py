@@ -21,6 +21,7 @@ try:
         import imp
 
         imp.find_module('casadi')
+    import casadi as ca
     from kipet.library.CasadiModel import CasadiModel
     from kipet.library.CasadiModel import KipetCasadiStruct
 
@@ -534,7 +535,7 @@ class TemplateBuilder(object):
 
         # Sets
         pyomo_model.mixture_components = Set(initialize=self._component_names)
-        pyomo_model.parameter_names = Set(initialize=self._parameters.keys())
+        pyomo_model.parameter_names = Set(initialize=list(self._parameters.keys()))
         pyomo_model.complementary_states = Set(initialize=self._complementary_states)
         pyomo_model.states = pyomo_model.mixture_components | pyomo_model.complementary_states
 
@@ -599,10 +600,10 @@ class TemplateBuilder(object):
                             # bounds=(0.0,None),
                             initialize=1)
         
-        for t, s in pyomo_model.Z:
-            if t == pyomo_model.start_time.value:
-                pyomo_model.Z[t, s].value = self._init_conditions[s]
-                #pyomo_model.Z[t, s].fixed = True
+        # only the start time has initial conditions
+        for s in pyomo_model.mixture_components:
+            pyomo_model.Z[start_time, s].value = self._init_conditions[s]
+            #pyomo_model.Z[start_time, s].fixed = True
             
         pyomo_model.dZdt = DerivativeVar(pyomo_model.Z,
                                          wrt=pyomo_model.time)
@@ -633,10 +634,7 @@ class TemplateBuilder(object):
             pyomo_model.P[k].setub(ub)
             
         if self._concentration_data is not None:
-            c_dict = dict()
-            for k in self._concentration_data.columns:
-                for c in self._concentration_data.index:
-                    c_dict[c, k] = float(self._concentration_data[k][c])
+            c_dict = _frame_to_dict(self._concentration_data)
         else:
             c_dict = 1.0
         
@@ -651,23 +649,19 @@ class TemplateBuilder(object):
                             initialize=c_dict)
 
         if self._concentration_data is not None:
-            for t in pyomo_model.meas_times:
-                for k in pyomo_model.mixture_components:
-                    pyomo_model.C[t, k].fixed = True
+            pyomo_model.C.fix()
             
-        else:
-            for t, c in pyomo_model.C:
-                if t == pyomo_model.start_time.value:
-                    pyomo_model.C[t, c].value = self._init_conditions[c]
+        elif start_time in pyomo_model.meas_times:
+            for c in pyomo_model.mixture_components:
+                pyomo_model.C[start_time, c].value = self._init_conditions[c]
                                 
         pyomo_model.X = Var(pyomo_model.time,
                             pyomo_model.complementary_states,
                             initialize=1.0)
 
         # Fixes parameters that were given numeric values
-        for t, s in pyomo_model.X:
-            if t == pyomo_model.start_time.value:
-                pyomo_model.X[t, s].value = self._init_conditions[s]
+        for s in pyomo_model.complementary_states:
+            pyomo_model.X[start_time, s].value = self._init_conditions[s]
 
         pyomo_model.dXdt = DerivativeVar(pyomo_model.X,
                                          wrt=pyomo_model.time)
@@ -677,10 +671,7 @@ class TemplateBuilder(object):
                             initialize=1.0)
 
         if self._absorption_data is not None:
-            s_dict = dict()
-            for k in self._absorption_data.columns:
-                for l in self._absorption_data.index:
-                    s_dict[l, k] = float(self._absorption_data[k][l])
+            s_dict = _frame_to_dict(self._absorption_data)
         else:
             s_dict = 1.0
             
@@ -695,9 +686,7 @@ class TemplateBuilder(object):
                             initialize=s_dict)
 
         if self._absorption_data is not None:
-            for l in pyomo_model.meas_lambdas:
-                for k in pyomo_model.mixture_components:
-                    pyomo_model.S[l, k].fixed = True
+            pyomo_model.S.fix()
 
         # Fixes parameters that were given numeric values
         for p, v in self._parameters.items():
@@ -707,10 +696,7 @@ class TemplateBuilder(object):
 
         # spectral data
         if self._spectral_data is not None:
-            s_data_dict = dict()
-            for t in pyomo_model.meas_times:
-                for l in pyomo_model.meas_lambdas:
-                        s_data_dict[t, l] = float(self._spectral_data[l][t])
+            s_data_dict = _frame_to_dict(self._spectral_data, m_times, m_lambdas)
 
             pyomo_model.D = Param(pyomo_model.meas_times,
                                   pyomo_model.meas_lambdas,
@@ -814,6 +800,9 @@ class TemplateBuilder(object):
                 list_lambdas = list(self._absorption_data.index)
                 m_times = sorted(list_times)
                 m_lambdas = sorted(list_lambdas)
+            if self._concentration_data is not None:
+                list_times = list(self._concentration_data.index)
+                m_times = sorted(set(m_times).union(list_times))
 
             if m_times:
                 if m_times[0] < start_time:
@@ -835,10 +824,14 @@ class TemplateBuilder(object):
             casadi_model.S = KipetCasadiStruct('S', list(casadi_model.meas_lambdas))
 
             if self._parameters_bounds:
-                warnings.warn('Casadi_model do not take bounds on parameters. This is ignored in the integration')
+                warnings.warn('Bounds on parameters of a casadi_model are ignored by CasadiSimulator. '
+                              'They are only used by CasadiParameterEstimator')
 
             # Parameters
             casadi_model.init_conditions = self._init_conditions
+            # initial guesses and bounds are only used by CasadiParameterEstimator
+            casadi_model.parameter_init = dict(self._parameters_init)
+            casadi_model.parameter_bounds = dict(self._parameters_bounds)
             casadi_model.start_time = start_time
             casadi_model.end_time = end_time
 
@@ -847,16 +840,15 @@ class TemplateBuilder(object):
                     for k in casadi_model.mixture_components:
                         casadi_model.S[l, k] = float(self._absorption_data[k][l])
 
+            if self._concentration_data is not None:
+                casadi_model.C_data = _frame_to_dict(self._concentration_data)
+
             if self._spectral_data is not None:
                 casadi_model.D = dict()
                 for t in casadi_model.meas_times:
                     for l in casadi_model.meas_lambdas:
                         casadi_model.D[t, l] = float(self._spectral_data[l][t])
 
-            # Fixes parameters that were given numeric values
-            for p, v in self._parameters.items():
-                if v is not None:
-                    casadi_model.P[p] = v
             # validate the model before writing constraints
             self._validate_data(casadi_model, start_time, end_time)
             # ignores the time indes t=0
@@ -870,6 +862,29 @@ class TemplateBuilder(object):
                 alg_const = self._algebraic_constraints(casadi_model, 0)
                 for c in alg_const:
                     casadi_model.alg_exprs.append(c)
+
+            # expressions with all parameters symbolic, so that parameter values
+            # can be changed without rebuilding the model (e.g. ensemble simulations)
+            casadi_model.parameter_symbols = dict((p, casadi_model.P[p]) for p in casadi_model.parameter_names)
+            casadi_model.parametric_odes = dict(casadi_model.odes)
+            casadi_model.parametric_alg_exprs = list(casadi_model.alg_exprs)
+
+            # Fixes parameters that were given numeric values
+            fixed_symbols = list()
+            fixed_values = list()
+            for p, v in self._parameters.items():
+                if v is not None:
+                    fixed_symbols.append(casadi_model.P[p])
+                    fixed_values.append(float(v))
+                    casadi_model.P[p] = v
+            if fixed_symbols:
+                symbols = ca.vertcat(*fixed_symbols)
+                values = ca.vertcat(*fixed_values)
+                for k, expr in casadi_model.odes.items():
+                    if isinstance(expr, ca.SX):
+                        casadi_model.odes[k] = ca.substitute(expr, symbols, values)
+                casadi_model.alg_exprs = [ca.substitute(expr, symbols, values) if isinstance(expr, ca.SX) else expr
+                                          for expr in casadi_model.alg_exprs]
             return casadi_model
         else:
             raise RuntimeError('Install casadi to create casadi models')
@@ -998,4 +1013,28 @@ class TemplateBuilder(object):
             for l in lambdas:
                 S[l, component].set_value(self._known_absorbance_data[component][l])
                 S[l, component].fix()
-        print("we got here again")
\ No newline at end of file
+        print("we got here again")
+
+def _frame_to_dict(frame, rows=None, columns=None):
+    """Returns {(row, column): value} for the entries of a DataFrame.
+
+    The values are taken from the underlying array in one step instead of
+    one lookup per entry.
+
+    This method is not intended to be used by users directly
+
+    Args:
+        frame (DataFrame): data
+
+        rows (list, optional): row labels in the order of the keys. Default frame.index
+
+        columns (list, optional): column labels in the order of the keys. Default frame.columns
+
+    Returns:
+        dict
+    """
+    if rows is not None or columns is not None:
+        frame = frame.loc[rows if rows is not None else frame.index,
+                          columns if columns is not None else frame.columns]
+    values = np.asarray(frame.values, dtype=float).ravel().tolist()
+    return dict(zip(itertools.product(frame.index.tolist(), frame.columns.tolist()), values))
@@ -0,0 +1,92 @@
+from __future__ import print_function
+import numpy as np
+
+
+class VarArrayBinding(object):
+    """Bulk transfer of values between a pyomo variable indexed by two sets and a numpy array.
+
+    The ordered list of variable data objects is computed once. Moving values
+    in or out of the model is then a single pass over that list, without
+    index lookups in the pyomo component.
+
+    Attributes:
+        var (Var): pyomo variable indexed by two sets
+
+        rows (list): ordered elements of the first index set (array rows)
+
+        columns (list): ordered elements of the second index set (array columns)
+
+        shape (tuple): shape of the arrays exchanged with the variable
+
+    """
+
+    def __init__(self, var, rows, columns):
+        """VarArrayBinding constructor.
+
+        Args:
+            var (Var): pyomo variable indexed by two sets
+
+            rows (array_like): elements of the first index set in the order of the array rows
+
+            columns (array_like): elements of the second index set in the order of the array columns
+
+        """
+        self.var = var
+        self.rows = list(rows)
+        self.columns = list(columns)
+        self.shape = (len(self.rows), len(self.columns))
+        self._var_data = [var[r, c] for r in self.rows for c in self.columns]
+
+    def get_array(self):
+        """Returns the values of the variable.
+
+        Returns:
+            ndarray with shape (len(rows), len(columns)). Variables without value are nan
+        """
+        values = np.array([vd.value for vd in self._var_data], dtype=float)
+        return values.reshape(self.shape)
+
+    def set_array(self, values, skip_nan=False, fix=False):
+        """Sets the values of the variable.
+
+        Args:
+            values (array_like): array broadcastable to shape (len(rows), len(columns))
+
+            skip_nan (bool,optional): flag to leave untouched the variables with nan values.
+            Default False
+
+            fix (bool,optional): flag to also fix the variables. Default False
+
+        Returns:
+            None
+        """
+        flat = np.broadcast_to(np.asarray(values, dtype=float), self.shape).ravel()
+        if skip_nan:
+            mask = ~np.isnan(flat)
+            if not mask.all():
+                var_data = [vd for vd, m in zip(self._var_data, mask) if m]
+                flat = flat[mask]
+            else:
+                var_data = self._var_data
+        else:
+            var_data = self._var_data
+        if fix:
+            for vd, v in zip(var_data, flat.tolist()):
+                vd.fix(v)
+        else:
+            for vd, v in zip(var_data, flat.tolist()):
+                vd.value = v
+
+    def fix(self):
+        """Fixes all variables at their current values"""
+        for vd in self._var_data:
+            vd.fixed = True
+
+    def unfix(self):
+        """Unfixes all variables"""
+        for vd in self._var_data:
+            vd.fixed = False
+
+    def var_data(self):
+        """Returns the variable data objects in row major order"""
+        return list(self._var_data)
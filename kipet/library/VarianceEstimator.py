@@ -7,7 +7,7 @@ from pyomo.opt import (ReaderFactory,
                        ResultsFormat)
 from kipet.library.Optimizer import *
 from scipy.optimize import least_squares
-from scipy.sparse import coo_matrix
+from scipy.sparse import coo_matrix, csr_matrix
 #import pyutilib.subprocess
 import matplotlib.pylab as plt
 import subprocess
@@ -69,8 +69,28 @@ class VarianceEstimator(Optimizer):
             lsq_ipopt (bool,optional): Determines whether to use ipopt for solving the least squares 
             problems in Weifengs procedure. Default False. The default used scipy.least_squares.
 
+            lsq_method (str,optional): Method for the S and C least squares problems in Weifengs
+            procedure. 'scipy' (scipy.least_squares), 'ipopt' (same as lsq_ipopt=True) or
+            'nnls_blocked' (one nonnegative least squares problem per wavelength and per time
+            point solved in batch without building pyomo models). Default 'scipy'.
+
             init_C (DataFrame,optional): Dataframe with concentration data used to start Weifengs procedure.
 
+            warm_start (bool,optional): Warm starts ipopt in the Z subproblem (and in the S and C
+            subproblems with lsq_method='ipopt') from the primal and dual solution of the previous
+            iteration. The objectives are built once, with the fixed values as mutable parameters.
+            This is a warm start only: the NL file is still written and ipopt is still launched
+            at every solve. Default False.
+
+            projection_rank (int,optional): Solves the initialization problem with the spectra
+            projected on their leading projection_rank right singular vectors and recovers S for
+            all wavelengths by nonnegative least squares. Default None (full problem).
+
+            wavelength_subset (array_like,optional): Wavelengths used in the initialization and in
+            all Z/S/C iterations, e.g. from data_tools.select_wavelengths. S at the other
+            wavelengths is fitted by nonnegative least squares at the end, before the variances
+            are estimated. Default all wavelengths.
+
         Returns:
 
             None
@@ -85,7 +105,11 @@ class VarianceEstimator(Optimizer):
         tol = kwds.pop('tolerance', 5.0e-5)
         A = kwds.pop('subset_lambdas', None)
         lsq_ipopt = kwds.pop('lsq_ipopt', False)
+        lsq_method = kwds.pop('lsq_method', 'ipopt' if lsq_ipopt else 'scipy')
         init_C = kwds.pop('init_C', None)
+        warm_start = kwds.pop('warm_start', False)
+        projection_rank = kwds.pop('projection_rank', None)
+        wavelength_subset = kwds.pop('wavelength_subset', None)
 
         # additional arguments for inputs CS
         inputs = kwds.pop("inputs", None)
@@ -107,7 +131,7 @@ class VarianceEstimator(Optimizer):
             raise RuntimeError('apply discretization first before initializing')
 
         self._create_tmp_outputs()
-        
+
         # deactivates objective functions                
         objectives_map = self.model.component_map(ctype=Objective, active=True)
         active_objectives_names = []
@@ -195,82 +219,110 @@ class VarianceEstimator(Optimizer):
             self.load_discrete_jump()
 ######################################################
 
-        # solves formulation 18
-        if init_C is None:
-            self._solve_initalization(solver, subset_lambdas=A, tee=tee)
-        else:
-            for t in self._meas_times:
-                for k in self._mixture_components:
-                    self.model.C[t, k].value = init_C[k][t]
-                    self.model.Z[t, k].value = init_C[k][t]
-
-            s_array = self._solve_S_from_DC(init_C)
-            S_frame = pd.DataFrame(data=s_array,
-                                   columns=self._mixture_components,
-                                   index=self._meas_lambdas)
+        # the initialization and the Z/S/C iterations only see the wavelength subset
+        self._meas_lambdas = sorted([l for l in self.model.meas_lambdas])
+        all_lambdas = self._meas_lambdas
+        if wavelength_subset is not None:
+            self._meas_lambdas = self._check_wavelength_subset(wavelength_subset)
+            print("Using {} of {} wavelengths".format(len(self._meas_lambdas), len(all_lambdas)))
+        self._n_meas_lambdas = len(self._meas_lambdas)
+        subset_lambdas = self._meas_lambdas
+
+        try:
+            # solves formulation 18
+            if init_C is None:
+                self._solve_initalization(solver, subset_lambdas=A, tee=tee, projection_rank=projection_rank)
+            else:
+                for t in self._meas_times:
+                    for k in self._mixture_components:
+                        self.model.C[t, k].value = init_C[k][t]
+                        self.model.Z[t, k].value = init_C[k][t]
+
+                s_array = self._solve_S_from_DC(init_C)
+                S_frame = pd.DataFrame(data=s_array,
+                                       columns=self._mixture_components,
+                                       index=self._meas_lambdas)
             
-            for l in self._meas_lambdas:
-                for k in self._mixture_components:
-                    self.model.S[l, k].value = S_frame[k][l] #1e-2
-                    #: Some of these are gonna be non-zero
-                    if hasattr(self.model, 'non_absorbing'):
-                        if k in self.model.non_absorbing:
-                            self.model.S[l, k].value = 0.0
+                for l in self._meas_lambdas:
+                    for k in self._mixture_components:
+                        self.model.S[l, k].value = S_frame[k][l] #1e-2
+                        #: Some of these are gonna be non-zero
+                        if hasattr(self.model, 'non_absorbing'):
+                            if k in self.model.non_absorbing:
+                                self.model.S[l, k].value = 0.0
                             
-                    if hasattr(self.model, 'known_absorbance'):
-                        if k in self.model.known_absorbance:
-                            self.model.S[l, k].value = self.model.known_absorbance_data[k][l]
-        #start looping
-        #print("{: >11} {: >20} {: >16} {: >16}".format('Iter','|Zi-Zi+1|','|Ci-Ci+1|','|Si-Si+1|'))
-        print("{: >11} {: >20}".format('Iter', '|Zi-Zi+1|'))
-        logiterfile = "iterations.log"
-        if os.path.isfile(logiterfile):
-            os.remove(logiterfile)
-
-        # backup
-        if lsq_ipopt:
-            self._build_s_model()
-            self._build_c_model()
-        else:
-            if species_list is None:
-                self._build_scipy_lsq_arrays()
-            else:
-                lsq_ipopt = True
+                        if hasattr(self.model, 'known_absorbance'):
+                            if k in self.model.known_absorbance:
+                                self.model.S[l, k].value = self.model.known_absorbance_data[k][l]
+            #start looping
+            #print("{: >11} {: >20} {: >16} {: >16}".format('Iter','|Zi-Zi+1|','|Ci-Ci+1|','|Si-Si+1|'))
+            print("{: >11} {: >20}".format('Iter', '|Zi-Zi+1|'))
+            logiterfile = "iterations.log"
+            if os.path.isfile(logiterfile):
+                os.remove(logiterfile)
+
+            self._warm_solvers = dict()
+
+            # backup
+            if lsq_method not in ['scipy', 'ipopt', 'nnls_blocked']:
+                raise RuntimeError('Unknown lsq_method {}. Use scipy, ipopt or nnls_blocked'.format(lsq_method))
+            if lsq_method == 'scipy' and species_list is not None:
+                lsq_method = 'ipopt'
+
+            if lsq_method == 'ipopt':
                 self._build_s_model()
                 self._build_c_model()
+            elif lsq_method == 'nnls_blocked':
+                self._build_scipy_lsq_arrays(with_jacobians=False)
+            else:
+                self._build_scipy_lsq_arrays()
             
-        for it in range(max_iter):
+            for it in range(max_iter):
             
-            rb = ResultsObject()
-            rb.load_from_pyomo_model(self.model, to_load=['Z', 'C', 'S', 'Y'])
+                rb = ResultsObject()
+                rb.load_from_pyomo_model(self.model, to_load=['Z', 'C', 'S', 'Y'], compact=True)
             
-            self._solve_Z(solver)
-
-            if lsq_ipopt:
-                self._solve_S(solver)
-                self._solve_C(solver)
-            else:
-                solved_s = self._solve_s_scipy()
-                solved_c = self._solve_c_scipy()
+                self._solve_Z(solver, warm_start=warm_start)
+
+                if lsq_method == 'ipopt':
+                    self._solve_S(solver, warm_start=warm_start)
+                    self._solve_C(solver, warm_start=warm_start)
+                elif lsq_method == 'nnls_blocked':
+                    self._solve_s_nnls()
+                    self._solve_c_nnls()
+                else:
+                    solved_s = self._solve_s_scipy()
+                    solved_c = self._solve_c_scipy()
                 
-            #pdb.set_trace()
+                #pdb.set_trace()
             
-            ra=ResultsObject()    
-            ra.load_from_pyomo_model(self.model, to_load=['Z','C','S'])
+                ra=ResultsObject()    
+                ra.load_from_pyomo_model(self.model, to_load=['Z','C','S'], compact=True)
             
-            r_diff = compute_diff_results(rb,ra)
+                r_diff = compute_diff_results(rb,ra)
 
             
-            Z_norm = r_diff.compute_var_norm('Z',norm_order)
-            #C_norm = r_diff.compute_var_norm('C',norm_order)
-            #S_norm = r_diff.compute_var_norm('S',norm_order)
-            if it>0:
-                #print("{: >11} {: >20} {: >16} {: >16}".format(it,Z_norm,C_norm,S_norm))
-                print("{: >11} {: >20}".format(it, Z_norm))
-            self._log_iterations(logiterfile, it)
-            if Z_norm<tol and it >= 1:
-                break
-                
+                Z_norm = r_diff.compute_var_norm('Z',norm_order)
+                #C_norm = r_diff.compute_var_norm('C',norm_order)
+                #S_norm = r_diff.compute_var_norm('S',norm_order)
+                if it>0:
+                    #print("{: >11} {: >20} {: >16} {: >16}".format(it,Z_norm,C_norm,S_norm))
+                    print("{: >11} {: >20}".format(it, Z_norm))
+                self._log_iterations(logiterfile, it)
+                if Z_norm<tol and it >= 1:
+                    break
+
+            if hasattr(self.model, 'z_objective'):
+                self.model.del_component('z_objective')
+        finally:
+            # the estimator always leaves with the full set of wavelengths
+            self._meas_lambdas = all_lambdas
+            self._n_meas_lambdas = len(all_lambdas)
+
+        if wavelength_subset is not None:
+            excluded = [l for l in all_lambdas if l not in set(subset_lambdas)]
+            self._fill_S_by_nnls(self._sublist_components, lambdas=excluded)
+
         results = ResultsObject()
         
         # retriving solutions to results object  
@@ -316,6 +368,9 @@ class VarianceEstimator(Optimizer):
             subset_lambdas (array_like,optional): Set of wavelengths to used in initialization problem 
             (Weifeng paper). Default all wavelengths.
 
+            projection_rank (int,optional): rank of the projection of the spectra in the subset.
+            Default None (no projection)
+
         Returns:
 
             None
@@ -326,6 +381,7 @@ class VarianceEstimator(Optimizer):
         set_A = kwds.pop('subset_lambdas', list())
         profile_time = kwds.pop('profile_time', False)
         sigmas_sq = kwds.pop('variances', dict())
+        projection_rank = kwds.pop('projection_rank', None)
 
         if not set_A:
             set_A = self._meas_lambdas
@@ -341,10 +397,17 @@ class VarianceEstimator(Optimizer):
         
         # build objective
         obj = 0.0
-        for t in self._meas_times:
-            for l in set_A:
-                D_bar = sum(self.model.Z[t, k]*self.model.S[l, k] for k in self._sublist_components)
-                obj+= (self.model.D[t, l] - D_bar)**2
+        if projection_rank is not None:
+            self._add_projected_spectra(projection_rank, self._sublist_components, lambdas=list(set_A))
+            for t in self._meas_times:
+                for q in self.model.projection_basis:
+                    D_bar = sum(self.model.Z[t, k]*self.model.S_projected[q, k] for k in self._sublist_components)
+                    obj += (self.model.D_projected[t, q] - D_bar)**2
+        else:
+            for t in self._meas_times:
+                for l in set_A:
+                    D_bar = sum(self.model.Z[t, k]*self.model.S[l, k] for k in self._sublist_components)
+                    obj+= (self.model.D[t, l] - D_bar)**2
         self.model.init_objective = Objective(expr=obj)
 
         opt = SolverFactory(solver)
@@ -361,7 +424,9 @@ class VarianceEstimator(Optimizer):
                     self.model.C[t, k].value = np.random.normal(self.model.Z[t, k].value, sigmas_sq[k])
                 else:
                     self.model.C[t, k].value = self.model.Z[t, k].value
-                
+
+        if projection_rank is not None:
+            self._recover_S_from_projection(self._sublist_components, c_name='Z')
         self.model.del_component('init_objective')
         
     def _solve_Z(self, solver, **kwds):
@@ -390,6 +455,7 @@ class VarianceEstimator(Optimizer):
         solver_opts = kwds.pop('solver_opts', dict())
         tee = kwds.pop('tee', False)
         profile_time = kwds.pop('profile_time', False)
+        warm_start = kwds.pop('warm_start', False)
         
         # assume this values were computed in beforehand
         for t in self._meas_times:
@@ -400,16 +466,29 @@ class VarianceEstimator(Optimizer):
                     else:
                         self.model.C[t, k].fixed = True
 
-        obj = 0.0
-        for k in self._sublist_components:
-            x = sum((self.model.C[t, k]-self.model.Z[t, k])**2 for t in self._meas_times)
-            obj += x
+        if warm_start and hasattr(self.model, 'z_objective'):
+            # C is fixed so the objective does not change between iterations
+            self.model.z_objective.activate()
+        else:
+            obj = 0.0
+            for k in self._sublist_components:
+                x = sum((self.model.C[t, k]-self.model.Z[t, k])**2 for t in self._meas_times)
+                obj += x
 
-        self.model.z_objective = Objective(expr=obj)
+            self.model.z_objective = Objective(expr=obj)
         #self.model.z_objective.pprint()
         if profile_time:
             print('-----------------Solve_Z--------------------')
-            
+
+        if warm_start:
+            self._warm_started_solve(solver, self.model, 'Z',
+                                     solver_opts=solver_opts,
+                                     logfile=self._tmp2,
+                                     tee=tee,
+                                     profile_time=profile_time)
+            self.model.z_objective.deactivate()
+            return
+
         opt = SolverFactory(solver)
 
         for key, val in solver_opts.items():
@@ -479,37 +558,14 @@ class VarianceEstimator(Optimizer):
             t0 = time.time()
 
         # assumes S has been computed in the model
-        n = self._n_components
-        for j, l in enumerate(self._meas_lambdas):
-            for k, c in enumerate(self._mixture_components):
-                if self.model.S[l, c].value < 0.0:  #: only less thant zero for non-absorbing
-                    self._s_array[j*n+k] = 1e-2
-                else:
-                    self._s_array[j*n+k] = self.model.S[l, c].value
-
-        for j,t in enumerate(self._meas_times):
-            for k,c in enumerate(self._mixture_components):
-                self._z_array[j*n+k] = self.model.Z[t, c].value
-
-        def F(x, z_array, d_array, nl, nt, nc):
-            diff = np.zeros(nt*nl)
-            for i in range(nt):
-                for j in range(nl):
-                    diff[i*nl+j] = d_array[i, j]-sum(z_array[i*nc+k]*x[j*nc+k] for k in range(nc))
-            return diff
-
-        def JF(x, z_array, d_array, nl, nt, nc):
-            row = []
-            col = []
-            data = []
-            for i in range(nt):
-                for j in range(nl):
-                    for k in range(nc):
-                        row.append(i*nl+j)
-                        col.append(j*nc+k)
-                        data.append(-z_array[i*nc+k])
-            return coo_matrix((data, (row, col)),
-                              shape=(nt*nl, nc*nl))
+        s_binding = self._var_binding('S', self._meas_lambdas, self._mixture_components)
+        s_values = s_binding.get_array()
+        s_values[s_values < 0.0] = 1e-2  #: only less thant zero for non-absorbing
+        self._s_array[:] = s_values.ravel()
+        self._z_array[:] = self._var_binding('Z', self._meas_times, self._mixture_components).get_array().ravel()
+
+        F = lsq_residual_S
+        JF = lsq_jacobian_S
 
         # solve
         if tee:
@@ -523,7 +579,8 @@ class VarianceEstimator(Optimizer):
                                       self._d_array,
                                       self._n_meas_lambdas,
                                       self._n_meas_times,
-                                      self._n_components))
+                                      self._n_components,
+                                      self._s_jac))
         else:
             f = StringIO()
             with stdout_redirector(f):
@@ -537,7 +594,8 @@ class VarianceEstimator(Optimizer):
                                           self._d_array,
                                           self._n_meas_lambdas,
                                           self._n_meas_times,
-                                          self._n_components))
+                                          self._n_components,
+                                          self._s_jac))
 
             with open(self._tmp3,'w') as tf:
                 tf.write(f.getvalue())
@@ -547,15 +605,9 @@ class VarianceEstimator(Optimizer):
             print("Scipy.optimize.least_squares time={:.3f} seconds".format(t1-t0))
 
         # retrive solution to pyomo model
-        for j,l in enumerate(self._meas_lambdas):
-            for k,c in enumerate(self._mixture_components):
-                self.model.S[l,c].value = res.x[j*n+k]  #: Some of these are not gonna be zero
-                if hasattr(self.model, 'non_absorbing'):
-                    if c in self.model.non_absorbing:
-                        self.model.S[l, c].set_value(0.0)
-                if hasattr(self.model, 'known_absorbance'):
-                    if c in self.model.known_absorbance:
-                        self.model.S[l, c].set_value(self.model.known_absorbance_data[c][l])
+        s_values = res.x.reshape(self._n_meas_lambdas, self._n_components)  #: Some of these are not gonna be zero
+        self._override_absorbances(s_values, self._mixture_components)
+        s_binding.set_array(s_values)
 
         return res.success
 
@@ -613,38 +665,14 @@ class VarianceEstimator(Optimizer):
             print('-----------------Solve_C--------------------')
             t0 = time.time()
         # assumes S have been computed in the model
-        n = self._n_components
-        for i,t in enumerate(self._meas_times):
-            for k,c in enumerate(self._mixture_components):
-                if self.model.C[t,c].value <=0.0:
-                    self._c_array[i*n+k] = 1e-15
-                else:
-                    self._c_array[i*n+k] = self.model.C[t,c].value 
-
-        for j,l in enumerate(self._meas_lambdas):
-            for k,c in enumerate(self._mixture_components):
-                self._s_array[j*n+k] = self.model.S[l,c].value
-
-        def F(x,s_array,d_array,nl,nt,nc):
-            diff = np.zeros(nt*nl)
-            for i in range(nt):
-                for j in range(nl):
-                    diff[i*nl+j]=d_array[i,j]-sum(s_array[j*nc+k]*x[i*nc+k] for k in range(nc))
-            return diff
-
-        def JF(x,s_array,d_array,nl,nt,nc):
-            row = []
-            col = []
-            data = []
-            for i in range(nt):
-                for j in range(nl):
-                    for k in range(nc):
-                        row.append(i*nl+j)
-                        col.append(i*nc+k)
-                        data.append(-s_array[j*nc+k])
-
-            return coo_matrix((data, (row, col)),
-                              shape=(nt*nl,nc*nt))
+        c_binding = self._var_binding('C', self._meas_times, self._mixture_components)
+        c_values = c_binding.get_array()
+        c_values[c_values <= 0.0] = 1e-15
+        self._c_array[:] = c_values.ravel()
+        self._s_array[:] = self._var_binding('S', self._meas_lambdas, self._mixture_components).get_array().ravel()
+
+        F = lsq_residual_C
+        JF = lsq_jacobian_C
 
         # solve
         if tee:
@@ -658,7 +686,8 @@ class VarianceEstimator(Optimizer):
                                       self._d_array,
                                       self._n_meas_lambdas,
                                       self._n_meas_times,
-                                      self._n_components))
+                                      self._n_components,
+                                      self._c_jac))
         else:
             f = StringIO()
             with stdout_redirector(f):
@@ -672,7 +701,8 @@ class VarianceEstimator(Optimizer):
                                           self._d_array,
                                           self._n_meas_lambdas,
                                           self._n_meas_times,
-                                          self._n_components))
+                                          self._n_components,
+                                          self._c_jac))
 
             with open(self._tmp4,'w') as tf:
                 tf.write(f.getvalue())
@@ -682,12 +712,109 @@ class VarianceEstimator(Optimizer):
             print("Scipy.optimize.least_squares time={:.3f} seconds".format(t1-t0))
 
         # retrive solution
-        for j,t in enumerate(self._meas_times):
-            for k,c in enumerate(self._mixture_components):
-                self.model.C[t,c].value = res.x[j*n+k]
+        c_binding.set_array(res.x.reshape(self._n_meas_times, self._n_components))
 
         return res.success
 
+    def _solve_s_nnls(self, **kwds):
+        """Solves formulation 22 in weifengs paper as one nonnegative least squares
+           problem per wavelength (see nnls_blocked)
+
+           This method is not intended to be used by users directly
+
+        Args:
+            profile_time (bool,optional): flag to print the time spent in the solver.
+            Default False
+
+        Returns:
+            None
+
+        """
+        profile_time = kwds.pop('profile_time', False)
+
+        if profile_time:
+            print('-----------------Solve_S--------------------')
+            t0 = time.time()
+
+        components = self._sublist_components
+        z_array = self._var_binding('Z', self._meas_times, components).get_array()
+
+        # columns are the wavelengths. Result is the transpose of S
+        s_array = nnls_blocked(z_array, self._d_array)
+
+        if profile_time:
+            t1 = time.time()
+            print("nnls_blocked time={:.3f} seconds".format(t1-t0))
+
+        with open(self._tmp3, 'w') as tf:
+            tf.write("nnls_blocked: {} blocks of {} unknowns\n".format(self._n_meas_lambdas, len(components)))
+
+        s_binding = self._var_binding('S', self._meas_lambdas, self._mixture_components)
+        s_values = s_binding.get_array()
+        for w, c in enumerate(components):
+            s_values[:, self._mixture_components.index(c)] = s_array[w]
+        self._override_absorbances(s_values, self._mixture_components)
+        s_binding.set_array(s_values)
+
+    def _override_absorbances(self, s_values, components):
+        """Sets the absorbances of non absorbing species and species with known absorbance
+
+           This method is not intended to be used by users directly
+
+        Args:
+            s_values (ndarray): absorbances with wavelengths as rows. Modified in place
+
+            components (list): components in the order of the columns of s_values
+
+        Returns:
+            None
+
+        """
+        if hasattr(self.model, 'non_absorbing'):
+            for c in self.model.non_absorbing:
+                if c in components:
+                    s_values[:, components.index(c)] = 0.0
+        if hasattr(self.model, 'known_absorbance'):
+            for c in self.model.known_absorbance:
+                if c in components:
+                    data = self.model.known_absorbance_data[c]
+                    s_values[:, components.index(c)] = [data[l] for l in self._meas_lambdas]
+
+    def _solve_c_nnls(self, **kwds):
+        """Solves formulation 25 in weifengs paper as one nonnegative least squares
+           problem per measurement time (see nnls_blocked)
+
+           This method is not intended to be used by users directly
+
+        Args:
+            profile_time (bool,optional): flag to print the time spent in the solver.
+            Default False
+
+        Returns:
+            None
+
+        """
+        profile_time = kwds.pop('profile_time', False)
+
+        if profile_time:
+            print('-----------------Solve_C--------------------')
+            t0 = time.time()
+
+        components = self._sublist_components
+        s_array = self._var_binding('S', self._meas_lambdas, components).get_array()
+
+        # columns are the measurement times. Result is the transpose of C
+        c_array = nnls_blocked(s_array, self._d_array.T)
+
+        if profile_time:
+            t1 = time.time()
+            print("nnls_blocked time={:.3f} seconds".format(t1-t0))
+
+        with open(self._tmp4, 'w') as tf:
+            tf.write("nnls_blocked: {} blocks of {} unknowns\n".format(self._n_meas_times, len(components)))
+
+        self._var_binding('C', self._meas_times, components).set_array(c_array.T)
+
     def _solve_variances(self, results):
         """Solves formulation 23 in weifengs paper (using scipy least_squares)
 
@@ -758,12 +885,14 @@ class VarianceEstimator(Optimizer):
             
             return 1
 
-    def _build_scipy_lsq_arrays(self):
+    def _build_scipy_lsq_arrays(self, with_jacobians=True):
         """Creates arrays for scipy solvers
 
            This method is not intended to be used by users directly
 
         Args:
+            with_jacobians (bool,optional): flag to also build the sparse jacobians
+            used by scipy.least_squares. Default True
 
         Returns:
             None
@@ -778,6 +907,20 @@ class VarianceEstimator(Optimizer):
         self._z_array = np.ones(self._n_meas_times*self._n_components)
         self._c_array = np.ones(self._n_meas_times*self._n_components)
 
+        if not with_jacobians:
+            return
+
+        # the sparsity pattern of both jacobians only depends on the problem
+        # dimensions. Values are refreshed in place at every evaluation
+        self._s_jac = lsq_jacobian_pattern(self._n_meas_times,
+                                           self._n_meas_lambdas,
+                                           self._n_components,
+                                           wrt='S')
+        self._c_jac = lsq_jacobian_pattern(self._n_meas_times,
+                                           self._n_meas_lambdas,
+                                           self._n_components,
+                                           wrt='C')
+
     def _create_tmp_outputs(self):
         """Creates temporary files for loging solutions of each optimization problem
 
@@ -873,6 +1016,7 @@ class VarianceEstimator(Optimizer):
         tee = kwds.pop('tee', False)
         update_nl = kwds.pop('update_nl', False)
         profile_time = kwds.pop('profile_time', False)
+        warm_start = kwds.pop('warm_start', False)
 
         # initialize
         for l in self._meas_lambdas:
@@ -890,31 +1034,45 @@ class VarianceEstimator(Optimizer):
                         if self.model.S[l, c].value != self.model.known_absorbance_data[c][l]:
                             self.model.S[l, c].set_value(self.model.known_absorbance_data[c][l])
                             self.S_model.S[l, c].fix()
-        obj = 0.0
-        # asumes base model has been solved already for Z
-        for t in self._meas_times:
-            for l in self._meas_lambdas:
-                D_bar = sum(self.S_model.S[l, k] * self.model.Z[t, k].value for k in self._sublist_components)
-                obj += (D_bar - self.model.D[t, l]) ** 2
-                    
-        self.S_model.objective = Objective(expr=obj)
+        if warm_start:
+            if not hasattr(self.S_model, 'objective'):
+                self._build_s_objective()
+            # asumes base model has been solved already for Z
+            z_values = self._var_binding('Z', self._meas_times, self._sublist_components).get_array()
+            self.S_model.Z_fixed.store_values(dict(zip(self._z_fixed_keys, z_values.ravel().tolist())))
+        else:
+            obj = 0.0
+            # asumes base model has been solved already for Z
+            for t in self._meas_times:
+                for l in self._meas_lambdas:
+                    D_bar = sum(self.S_model.S[l, k] * self.model.Z[t, k].value for k in self._sublist_components)
+                    obj += (D_bar - self.model.D[t, l]) ** 2
+
+            self.S_model.objective = Objective(expr=obj)
 
         
         if profile_time:
             print('-----------------Solve_S--------------------')
 
-        opt = SolverFactory(solver)
-
-        for key, val in solver_opts.items():
-            opt.options[key]=val
-        solver_results = opt.solve(self.S_model,
-                                   logfile=self._tmp3,
-                                   tee=tee,
-                                   #keepfiles=True,
-                                   #show_section_timing=True,
-                                   report_timing=profile_time)
-
-        self.S_model.del_component('objective')
+        if warm_start:
+            self._warm_started_solve(solver, self.S_model, 'S',
+                                     solver_opts=solver_opts,
+                                     logfile=self._tmp3,
+                                     tee=tee,
+                                     profile_time=profile_time)
+        else:
+            opt = SolverFactory(solver)
+
+            for key, val in solver_opts.items():
+                opt.options[key]=val
+            solver_results = opt.solve(self.S_model,
+                                       logfile=self._tmp3,
+                                       tee=tee,
+                                       #keepfiles=True,
+                                       #show_section_timing=True,
+                                       report_timing=profile_time)
+
+            self.S_model.del_component('objective')
         
         #update values in main model
         for l in self._meas_lambdas:
@@ -958,6 +1116,112 @@ class VarianceEstimator(Optimizer):
                 if hasattr(self.model, 'non_absorbing'):
                     self.C_model.C[l, k].fix()  #: this variable does not need to be part of the optimization
 
+    def _build_s_objective(self):
+        """Adds to s_model the objective of formulation 22 with Z as mutable parameters
+
+           This method is not intended to be used by users directly
+
+        Args:
+
+        Returns:
+            None
+
+        """
+        self._z_fixed_keys = [(t, k) for t in self._meas_times for k in self._sublist_components]
+        self.S_model.Z_fixed = Param(self._meas_times,
+                                     self._sublist_components,
+                                     initialize=1.0,
+                                     mutable=True)
+        add_warm_start_suffixes(self.S_model)
+
+        obj = 0.0
+        for t in self._meas_times:
+            for l in self._meas_lambdas:
+                D_bar = sum(self.S_model.S[l, k] * self.S_model.Z_fixed[t, k] for k in self._sublist_components)
+                obj += (D_bar - self.model.D[t, l]) ** 2
+        self.S_model.objective = Objective(expr=obj)
+
+    def _build_c_objective(self):
+        """Adds to c_model the objective of formulation 25 with S as mutable parameters
+
+           This method is not intended to be used by users directly
+
+        Args:
+
+        Returns:
+            None
+
+        """
+        self._s_fixed_keys = [(l, k) for l in self._meas_lambdas for k in self._sublist_components]
+        self.C_model.S_fixed = Param(self._meas_lambdas,
+                                     self._sublist_components,
+                                     initialize=1.0,
+                                     mutable=True)
+        add_warm_start_suffixes(self.C_model)
+
+        obj = 0.0
+        for t in self._meas_times:
+            for l in self._meas_lambdas:
+                D_bar = sum(self.C_model.S_fixed[l, k]*self.C_model.C[t, k] for k in self._sublist_components)
+                obj += (self.model.D[t, l]-D_bar)**2
+        self.C_model.objective = Objective(expr=obj)
+
+    def _warm_started_solve(self, solver, model, name, **kwds):
+        """Solves a subproblem of Weifengs procedure starting from its previous solution
+
+           The solver object is reused, but the NL file is written and ipopt is launched
+           at every call; only the primal and dual starting point is carried over.
+           This method is not intended to be used by users directly
+
+        Args:
+            solver (str): name of the nonlinear solver
+
+            model (ConcreteModel): subproblem with warm start suffixes and one active objective
+
+            name (str): name of the subproblem (Z, S or C)
+
+            solver_opts (dict, optional): options passed to the nonlinear solver
+
+            logfile (str, optional): file for the solver output
+
+            tee (bool,optional): flag to tell the optimizer whether to stream output
+            to the terminal or not
+
+            profile_time (bool,optional): flag to tell pyomo to time the construction and solution of the model.
+            Default False
+
+        Returns:
+            solver results
+
+        """
+        solver_opts = kwds.pop('solver_opts', dict())
+        logfile = kwds.pop('logfile', None)
+        tee = kwds.pop('tee', False)
+        profile_time = kwds.pop('profile_time', False)
+
+        opt = self._warm_solvers.get(name)
+        if opt is None:
+            opt = SolverFactory(solver)
+            for key, val in solver_opts.items():
+                opt.options[key] = val
+            self._warm_solvers[name] = opt
+        else:
+            # primal values are already in the model. Duals go with the dual suffix
+            model.ipopt_zL_in.update(model.ipopt_zL_out)
+            model.ipopt_zU_in.update(model.ipopt_zU_out)
+            warm_opts = {'warm_start_init_point': 'yes',
+                         'warm_start_bound_push': 1e-6,
+                         'warm_start_mult_bound_push': 1e-6,
+                         'mu_init': 1e-6}
+            for key, val in warm_opts.items():
+                if key not in solver_opts:
+                    opt.options[key] = val
+
+        return opt.solve(model,
+                         logfile=logfile,
+                         tee=tee,
+                         report_timing=profile_time)
+
     def _solve_C(self,solver,**kwds):
         """Solves formulation 23 from Weifengs procedure with ipopt
 
@@ -973,30 +1237,45 @@ class VarianceEstimator(Optimizer):
         tee = kwds.pop('tee', False)
         update_nl = kwds.pop('update_nl', False)
         profile_time = kwds.pop('profile_time', False)
-        
-        obj = 0.0
-        # asumes that s model has been solved first
-        for t in self._meas_times:
-            for l in self._meas_lambdas:
-                D_bar = sum(self.model.S[l, k].value*self.C_model.C[t, k] for k in self._sublist_components)
-                obj += (self.model.D[t, l]-D_bar)**2
+        warm_start = kwds.pop('warm_start', False)
+
+        if warm_start:
+            if not hasattr(self.C_model, 'objective'):
+                self._build_c_objective()
+            # asumes that s model has been solved first
+            s_values = self._var_binding('S', self._meas_lambdas, self._sublist_components).get_array()
+            self.C_model.S_fixed.store_values(dict(zip(self._s_fixed_keys, s_values.ravel().tolist())))
+        else:
+            obj = 0.0
+            # asumes that s model has been solved first
+            for t in self._meas_times:
+                for l in self._meas_lambdas:
+                    D_bar = sum(self.model.S[l, k].value*self.C_model.C[t, k] for k in self._sublist_components)
+                    obj += (self.model.D[t, l]-D_bar)**2
 
-        self.C_model.objective = Objective(expr=obj)
+            self.C_model.objective = Objective(expr=obj)
                 
         if profile_time:
             print('-----------------Solve_C--------------------')
 
-        opt = SolverFactory(solver)
+        if warm_start:
+            self._warm_started_solve(solver, self.C_model, 'C',
+                                     solver_opts=solver_opts,
+                                     logfile=self._tmp4,
+                                     tee=tee,
+                                     profile_time=profile_time)
+        else:
+            opt = SolverFactory(solver)
 
-        for key, val in solver_opts.items():
-            opt.options[key]=val
-        solver_results = opt.solve(self.C_model,
-                                   logfile=self._tmp4,
-                                   tee=tee,
-                                   #keepfiles=True,
-                                   report_timing=profile_time)
+            for key, val in solver_opts.items():
+                opt.options[key]=val
+            solver_results = opt.solve(self.C_model,
+                                       logfile=self._tmp4,
+                                       tee=tee,
+                                       #keepfiles=True,
+                                       report_timing=profile_time)
 
-        self.C_model.del_component('objective')
+            self.C_model.del_component('objective')
         
 
         #updates values in main model
@@ -1105,11 +1384,72 @@ def add_warm_start_suffixes(model):
     model.dual = Suffix(direction=Suffix.IMPORT_EXPORT)
 
 
+def lsq_jacobian_pattern(nt, nl, nc, wrt='S'):
+    """Builds the sparse jacobian of the residuals D_ij - sum_k C_ik*S_jk.
+
+    Residuals are ordered as i*nl+j. Unknowns are ordered as j*nc+k when
+    solving for S and as i*nc+k when solving for C. Every row has exactly nc
+    nonzeros so the CSR structure is built once and only the values change.
+
+    Args:
+        nt (int): number of measurement times
+
+        nl (int): number of measured wavelengths
+
+        nc (int): number of components
+
+        wrt (str): 'S' or 'C'. Block of unknowns of the least squares problem
+
+    Returns:
+        scipy.sparse.csr_matrix with the sparsity pattern and zero values
+
+    """
+    nnz = nt*nl*nc
+    indptr = np.arange(0, nnz+1, nc)
+    if wrt == 'S':
+        indices = np.tile(np.arange(nl*nc), nt)
+        shape = (nt*nl, nl*nc)
+    elif wrt == 'C':
+        indices = np.repeat(np.arange(nt*nc).reshape(nt, 1, nc), nl, axis=1).ravel()
+        shape = (nt*nl, nt*nc)
+    else:
+        raise RuntimeError('Unknown block {}. Use S or C'.format(wrt))
+    return csr_matrix((np.zeros(nnz), indices, indptr), shape=shape)
+
+
+def lsq_residual_S(x, z_array, d_array, nl, nt, nc, jac=None):
+    """Residuals of formulation 22 in weifengs paper for S=x"""
+    return (d_array-z_array.reshape(nt, nc).dot(x.reshape(nl, nc).T)).ravel()
+
+
+def lsq_jacobian_S(x, z_array, d_array, nl, nt, nc, jac):
+    """Refreshes the values of the jacobian built by lsq_jacobian_pattern(wrt='S')"""
+    # values are rewritten at every call because least_squares may scale
+    # the returned matrix in place (robust loss functions)
+    jac.data.reshape(nt, nl, nc)[...] = -z_array.reshape(nt, 1, nc)
+    return jac
+
+
+def lsq_residual_C(x, s_array, d_array, nl, nt, nc, jac=None):
+    """Residuals of formulation 25 in weifengs paper for C=x"""
+    return (d_array-x.reshape(nt, nc).dot(s_array.reshape(nl, nc).T)).ravel()
+
+
+def lsq_jacobian_C(x, s_array, d_array, nl, nt, nc, jac):
+    """Refreshes the values of the jacobian built by lsq_jacobian_pattern(wrt='C')"""
+    jac.data.reshape(nt, nl, nc)[...] = -s_array.reshape(1, nl, nc)
+    return jac
+
+
 def compute_diff_results(results1,results2):
     diff_results = ResultsObject()
-    diff_results.Z = results1.Z - results2.Z
-    diff_results.S = results1.S - results2.S
-    diff_results.C = results1.C - results2.C
+    for name in ['Z', 'S', 'C']:
+        if results1.is_compact(name) and results2.is_compact(name):
+            # same layout, subtract the arrays directly
+            values, index, columns = results1._arrays[name]
+            diff_results.set_array(name, values-results2.get_array(name), index, columns)
+        else:
+            setattr(diff_results, name, getattr(results1, name) - getattr(results2, name))
     return diff_results
 
 #######################additional for inputs###CS
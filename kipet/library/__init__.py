@@ -15,10 +15,12 @@ except ImportError:
  
  
 if found_casadi: 
-    __all__ = ['CasadiModel','TemplateBuilder','BaseAbstractModel','CasadiSimulator',
+    __all__ = ['CasadiModel','TemplateBuilder','BaseAbstractModel','CasadiSimulator','CasadiParameterEstimator',
                'data_tools','fe_factory','Optimizer','ParameterEstimator','PyomoSimulator',
-               'ResultsObject','Simulator','VarianceEstimator','FESimulator'] 
+               'ResultsObject','Simulator','VarianceEstimator','FESimulator','VarArrayBinding',
+               'parallel_tools','sensitivity_io','ModelCache'] 
 else: 
     __all__ = ['TemplateBuilder','BaseAbstractModel',
                'data_tools','fe_factory','Optimizer','ParameterEstimator',
-               'PyomoSimulator','ResultsObject','Simulator','VarianceEstimator','FESimulator']  
+               'PyomoSimulator','ResultsObject','Simulator','VarianceEstimator','FESimulator',
+               'VarArrayBinding','parallel_tools','sensitivity_io','ModelCache']  
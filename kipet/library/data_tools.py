@@ -3,8 +3,11 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import axes3d
 import numpy as np
+import scipy.signal
 import matplotlib as cm
 import six
+import warnings
+import os
 
 
 def write_spectral_data_to_csv(filename,dataframe):
@@ -21,23 +24,22 @@ def write_spectral_data_to_csv(filename,dataframe):
     """
     dataframe.to_csv(filename)
 
-def write_spectral_data_to_txt(filename,dataframe):
+def write_spectral_data_to_txt(filename,dataframe,compression='infer'):
     """ Write spectral data Dij to txt file.
     
         Args:
             filename (str): name of output file
           
             dataframe (DataFrame): pandas DataFrame
+
+            compression (str,optional): compression of the file ('gzip', 'bz2', 'zip', 'xz' or None).
+            Default 'infer' compresses according to the extension of filename (e.g. .gz)
         
         Returns:
             None
     
     """
-    f = open(filename,'w')
-    for i in dataframe.index:
-        for j in dataframe.columns:
-            f.write("{0} {1} {2}\n".format(i,j,dataframe[j][i]))
-    f.close()
+    _write_triplets(filename, dataframe, compression=compression)
 
 def write_absorption_data_to_csv(filename,dataframe):
     """ Write absorption data Sij to csv file.
@@ -53,23 +55,22 @@ def write_absorption_data_to_csv(filename,dataframe):
     """
     dataframe.to_csv(filename)
 
-def write_absorption_data_to_txt(filename,dataframe):
+def write_absorption_data_to_txt(filename,dataframe,compression='infer'):
     """ Write absorption data Sij to txt file.
     
         Args:
             filename (str): name of output file
           
             dataframe (DataFrame): pandas DataFrame
+
+            compression (str,optional): compression of the file ('gzip', 'bz2', 'zip', 'xz' or None).
+            Default 'infer' compresses according to the extension of filename (e.g. .gz)
         
         Returns:
             None
 
     """
-    f = open(filename,'w')
-    for i in dataframe.index:
-        for j in dataframe.columns:
-            f.write("{0} {1} {2}\n".format(i,j,dataframe[j][i]))
-    f.close()
+    _write_triplets(filename, dataframe, compression=compression)
 
 def write_concentration_data_to_csv(filename,dataframe):
     """ Write concentration data Cij to csv file.
@@ -85,27 +86,49 @@ def write_concentration_data_to_csv(filename,dataframe):
     """
     dataframe.to_csv(filename)
 
-def write_concentration_data_to_txt(filename,dataframe):
+def write_concentration_data_to_txt(filename,dataframe,compression='infer'):
     """ Write concentration data Cij to txt file.
     
         Args:
             filename (str): name of output file
           
             dataframe (DataFrame): pandas DataFrame
+
+            compression (str,optional): compression of the file ('gzip', 'bz2', 'zip', 'xz' or None).
+            Default 'infer' compresses according to the extension of filename (e.g. .gz)
         
         Returns:
             None
 
     """
-    f = open(filename,'w')
-    for i in dataframe.index:
-        for j in dataframe.columns:
-            f.write("{0} {1} {2}\n".format(i,j,dataframe[j][i]))
-    f.close()
+    _write_triplets(filename, dataframe, compression=compression)
 
 
-def read_concentration_data_from_txt(filename):
-    """ Reads txt with concnetration data
+def write_data_to_npz(filename,dataframe,compressed=True):
+    """ Write a data DataFrame (Dij, Sij or Cij) to a binary numpy npz file.
+
+        Much faster to write and read than the text formats for large data sets.
+    
+        Args:
+            filename (str): name of output file
+          
+            dataframe (DataFrame): pandas DataFrame
+
+            compressed (bool,optional): flag to compress the file. Default True
+        
+        Returns:
+            None
+
+    """
+    columns = np.asarray(dataframe.columns)
+    if columns.dtype == object:
+        columns = columns.astype(str)
+    save = np.savez_compressed if compressed else np.savez
+    with open(filename, 'wb') as f:
+        save(f, data=dataframe.values, index=np.asarray(dataframe.index), columns=columns)
+
+def read_data_from_npz(filename):
+    """ Reads npz file written by write_data_to_npz
     
         Args:
             filename (str): name of input file
@@ -114,32 +137,92 @@ def read_concentration_data_from_txt(filename):
             DataFrame
 
     """
+    with np.load(filename, allow_pickle=False) as f:
+        return pd.DataFrame(data=f['data'], columns=f['columns'].tolist(), index=f['index'].tolist())
+
+def _write_triplets(filename, dataframe, compression='infer'):
+    """ Writes a DataFrame as "index column value" lines in row major order.
+
+        The index and column labels are expanded with repeat/tile and the table is
+        formatted by a single pandas call, which formats values as str() does. Frames
+        with columns of different dtypes keep the dtype of each column (e.g. 1 for an
+        integer column instead of 1.0).
+
+        This method is not intended to be used by users directly
+
+    """
+    n_rows, n_cols = dataframe.shape
+    if len(set(dataframe.dtypes)) > 1:
+        values = np.empty((n_rows, n_cols), dtype=object)
+        for k in range(n_cols):
+            values[:, k] = dataframe.iloc[:, k].tolist()
+    else:
+        values = dataframe.values
+    triplets = pd.DataFrame({'index': np.repeat(np.asarray(dataframe.index), n_cols),
+                             'column': np.tile(np.asarray(dataframe.columns), n_rows),
+                             'value': values.ravel()},
+                            columns=['index', 'column', 'value'])
+    text = triplets.to_csv(None, sep=' ', header=False, index=False, na_rep='nan')
+    _write_text(filename, text, compression)
+
+# compression inferred from the extension of the file name
+_compression_extensions = {'.gz': 'gzip', '.bz2': 'bz2', '.zip': 'zip', '.xz': 'xz'}
+
+def _write_text(filename, text, compression='infer'):
+    """ Writes text to a file, compressed with gzip, bz2, zip or xz.
+
+        The compression is handled here rather than by DataFrame.to_csv, which
+        only accepts compression='infer' since pandas 0.24.
+
+        This method is not intended to be used by users directly
+
+    """
+    if compression == 'infer':
+        compression = _compression_extensions.get(os.path.splitext(filename)[1].lower())
+    if compression is None:
+        with open(filename, 'w') as f:
+            f.write(text)
+        return
+
+    data = text.encode('utf-8')
+    if compression == 'gzip':
+        import gzip
+        with gzip.open(filename, 'wb') as f:
+            f.write(data)
+    elif compression == 'bz2':
+        import bz2
+        with bz2.BZ2File(filename, 'wb') as f:
+            f.write(data)
+    elif compression == 'xz':
+        import lzma
+        with lzma.open(filename, 'wb') as f:
+            f.write(data)
+    elif compression == 'zip':
+        import zipfile
+        name = os.path.basename(filename)
+        if name.lower().endswith('.zip'):
+            name = name[:-4]
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as f:
+            f.writestr(name, data)
+    else:
+        raise ValueError('Unrecognized compression type: {}'.format(compression))
 
-    f = open(filename,'r')
-    data_dict = dict()
-    set_index = set()
-    set_columns = set()
 
-    for line in f:
-        if line not in ['','\n','\t','\t\n']:
-            l=line.split()
-            i = float(l[0])
-            j = l[1]
-            k = float(l[2])
-            set_index.add(i)
-            set_columns.add(j)
-            data_dict[i,j] = k
-    f.close()
+def read_concentration_data_from_txt(filename, cache=False):
+    """ Reads txt with concnetration data
     
-    data_array = np.zeros((len(set_index),len(set_columns)))
-    sorted_index = sorted(set_index)
-    sorted_columns = set_columns
+        Args:
+            filename (str): name of input file
 
-    for i,idx in enumerate(sorted_index):
-        for j,jdx in enumerate(sorted_columns):
-            data_array[i,j] = data_dict[idx,jdx]
+            cache (bool,optional): flag to keep a binary copy of the data next to the
+            input file (filename.cache.npz) that is read instead of the text file
+            while the text file is unchanged. Default False
+          
+        Returns:
+            DataFrame
 
-    return pd.DataFrame(data=data_array,columns=sorted_columns,index=sorted_index)
+    """
+    return _read_triplets(filename, numeric_columns=False, cache=cache)
  
 def read_concentration_data_from_csv(filename):
     """ Reads csv with concentration data
@@ -182,79 +265,140 @@ def read_absorption_data_from_csv(filename):
     data = pd.read_csv(filename,index_col=0)
     return data
 
-def read_spectral_data_from_txt(filename):
+def read_spectral_data_from_txt(filename, cache=False):
     """ Reads txt with spectral data
     
         Args:
             filename (str): name of input file
+
+            cache (bool,optional): flag to keep a binary copy of the data next to the
+            input file (filename.cache.npz) that is read instead of the text file
+            while the text file is unchanged. Default False
           
         Returns:
             DataFrame
 
     """
+    return _read_triplets(filename, numeric_columns=True, cache=cache)
 
-    f = open(filename,'r')
-    data_dict = dict()
-    set_index = set()
-    set_columns = set()
-
-    for line in f:
-        if line not in ['','\n','\t','\t\n']:
-            l=line.split()
-            i = float(l[0])
-            j = float(l[1])
-            k = float(l[2])
-            set_index.add(i)
-            set_columns.add(j)
-            data_dict[i,j] = k
-    f.close()
+def read_absorption_data_from_txt(filename, cache=False):
+    """ Reads txt with absorption data
     
-    data_array = np.zeros((len(set_index),len(set_columns)))
-    sorted_index = sorted(set_index)
-    sorted_columns = sorted(set_columns)
+        Args:
+            filename (str): name of input file
+
+            cache (bool,optional): flag to keep a binary copy of the data next to the
+            input file (filename.cache.npz) that is read instead of the text file
+            while the text file is unchanged. Default False
+          
+        Returns:
+            DataFrame
 
-    for i,idx in enumerate(sorted_index):
-        for j,jdx in enumerate(sorted_columns):
-            data_array[i,j] = data_dict[idx,jdx]
+    """
+    return _read_triplets(filename, numeric_columns=False, cache=cache)
 
-    return pd.DataFrame(data=data_array,columns=sorted_columns,index=sorted_index)
+def _read_triplets(filename, numeric_columns=True, cache=False):
+    """ Reads a txt file with one "index column value" triplet per line into a DataFrame.
+
+        The file is parsed by the pandas C reader and the triplets are scattered into
+        the dense array with the inverse indices of the unique index and column labels.
+        Rows are sorted. Columns are sorted if numeric, otherwise they keep the order
+        of first appearance.
+
+        This method is not intended to be used by users directly
 
-def read_absorption_data_from_txt(filename):
-    """ Reads txt with absorption data
-    
         Args:
             filename (str): name of input file
-          
+
+            numeric_columns (bool): flag to read the column labels as floats
+
+            cache (bool): flag to read/write the binary cache of the file
+
         Returns:
             DataFrame
 
     """
+    if cache:
+        cached = _load_triplet_cache(filename, numeric_columns)
+        if cached is not None:
+            return cached
+
+    triplets = pd.read_csv(filename, sep=r'\s+', header=None, names=['index', 'column', 'value'],
+                           usecols=[0, 1, 2], dtype={'index': float, 'column': float if numeric_columns else str,
+                                                     'value': float},
+                           engine='c', float_precision='round_trip')
+    index, row = np.unique(triplets['index'].values, return_inverse=True)
+    if numeric_columns:
+        columns, col = np.unique(triplets['column'].values, return_inverse=True)
+    else:
+        col, columns = pd.factorize(triplets['column'].values, sort=False)
+        columns = np.asarray(columns, dtype=str)
+    row = row.ravel()
+    col = col.ravel()
 
-    f = open(filename,'r')
-    data_dict = dict()
-    set_index = set()
-    set_columns = set()
+    filled = np.zeros((len(index), len(columns)), dtype=bool)
+    filled[row, col] = True
+    if not filled.all():
+        missing = np.argwhere(~filled)[0]
+        raise RuntimeError('No value for ({}, {}) in {}'.format(index[missing[0]], columns[missing[1]], filename))
+    data_array = np.empty((len(index), len(columns)))
+    data_array[row, col] = triplets['value'].values
 
-    for line in f:
-        if line not in ['','\n','\t','\t\n']:
-            l=line.split()
-            i = float(l[0])
-            j = l[1]
-            k = float(l[2])
-            set_index.add(i)
-            set_columns.add(j)
-            data_dict[i,j] = k
-    f.close()
-    
-    data_array = np.zeros((len(set_index),len(set_columns)))
-    sorted_index = sorted(set_index)
-    sorted_columns = set_columns
+    if cache:
+        _save_triplet_cache(filename, data_array, index, columns)
+    return pd.DataFrame(data=data_array, columns=columns.tolist(), index=index.tolist())
+
+def _triplet_cache_name(filename):
+    return filename + '.cache.npz'
 
-    for i,idx in enumerate(sorted_index):
-        for j,jdx in enumerate(sorted_columns):
-            data_array[i,j] = data_dict[idx,jdx]
+def _load_triplet_cache(filename, numeric_columns):
+    """ Returns the DataFrame stored in the binary cache of filename, or None if there
+        is no cache or the source file changed since it was written.
+
+        This method is not intended to be used by users directly
+
+    """
+    cache_name = _triplet_cache_name(filename)
+    if not os.path.isfile(cache_name):
+        return None
+    stat = os.stat(filename)
+    try:
+        with np.load(cache_name, allow_pickle=False) as f:
+            if (int(f['source_size']) != stat.st_size or
+                    float(f['source_mtime']) != stat.st_mtime or
+                    bool(f['numeric_columns']) != numeric_columns):
+                return None
+            data_array = f['data']
+            index = f['index']
+            columns = f['columns']
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+    return pd.DataFrame(data=data_array, columns=columns.tolist(), index=index.tolist())
+
+def _save_triplet_cache(filename, data_array, index, columns):
+    """ Writes the binary cache of filename. Failures (e.g. read-only directories) only warn.
+
+        This method is not intended to be used by users directly
 
-    return pd.DataFrame(data=data_array,columns=sorted_columns,index=sorted_index)
+    """
+    cache_name = _triplet_cache_name(filename)
+    stat = os.stat(filename)
+    tmp_name = '{}.{}.tmp'.format(cache_name, os.getpid())
+    try:
+        with open(tmp_name, 'wb') as f:
+            np.savez(f, data=data_array, index=index, columns=columns,
+                     numeric_columns=np.issubdtype(columns.dtype, np.number),
+                     source_size=stat.st_size, source_mtime=stat.st_mtime)
+        if hasattr(os, 'replace'):
+            os.replace(tmp_name, cache_name)
+        else:
+            if os.path.exists(cache_name):
+                os.remove(cache_name)
+            os.rename(tmp_name, cache_name)
+    except (IOError, OSError) as e:
+        warnings.warn('Could not write cache {}: {}'.format(cache_name, e))
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
 
 
 def plot_spectral_data(dataFrame,dimension='2D'):
@@ -294,7 +438,7 @@ def plot_spectral_data(dataFrame,dimension='2D'):
         plt.plot(dataFrame)
 
 
-def basic_pca(dataFrame,n=4):
+def basic_pca(dataFrame,n=4,method='full',rank=None,plot=True,seed=None,variance_threshold=None):
     """ Runs basic component analysis based on SVD
     
         Args:
@@ -303,17 +447,73 @@ def basic_pca(dataFrame,n=4):
             n (int, optional): number of largest singular-values
             to plot
 
+            method (str, optional): 'full' computes all singular values (numpy svd).
+            'randomized' (randomized range finder) and 'lanczos' (scipy svds) only compute
+            the leading rank singular values, which is much cheaper for large spectra
+
+            rank (int, optional): number of singular values computed by the truncated
+            methods. The noise level is estimated from the energy beyond them or, if
+            rank covers all singular values, from their median. Default max(n, 10)
+
+            plot (bool, optional): flag to plot the leading components and singular values.
+            Default True
+
+            seed (int, optional): seed of the random projections of the randomized method
+
+            variance_threshold (float, optional): if given, the suggested rank is the smallest
+            number of components explaining this fraction of the variance. Default is the
+            number of singular values clearly above the level expected from the noise
+
         Returns:
-            None
+            dict with 'singular_values', 'explained_variance_ratio' (s_i^2/||D||_F^2),
+            'cumulative_explained_variance', 'suggested_rank' and the left/right singular
+            vectors 'U' and 'V' of the computed singular values
 
     """
     times = np.array(dataFrame.index)
     lambdas = np.array(dataFrame.columns)
-    D = np.array(dataFrame)
-    U, s, V = np.linalg.svd(D, full_matrices=True)
+    D = np.array(dataFrame, dtype=float)
+    if rank is None:
+        rank = max(n, 10)
+    U, s, V = _truncated_svd(D, method, rank, seed)
+
+    total_variance = np.einsum('ij,ij->', D, D)
+    explained = s**2/total_variance if total_variance > 0 else np.zeros_like(s)
+    cumulative = np.cumsum(explained)
+    if variance_threshold is not None:
+        suggested_rank = int(min(np.searchsorted(cumulative, variance_threshold) + 1, len(s)))
+    else:
+        # iid noise of variance sigma^2 gives singular values below sigma*(sqrt(n_times)+sqrt(n_wavelengths))
+        n_rows, n_cols = D.shape
+        n_min = min(n_rows, n_cols)
+        if rank < n_min:
+            # sigma is estimated from the energy beyond the leading rank components, spread over the
+            # (n_rows-rank)*(n_cols-rank) degrees of freedom left to the noise by a fit of that rank
+            leading = s[:rank]
+            tail = max(total_variance - np.sum(leading**2), 0.0)
+            sigma = np.sqrt(tail/((n_rows - rank)*(n_cols - rank)))
+        else:
+            # all singular values were computed, so there is no tail to estimate the noise from.
+            # sigma is estimated from the median singular value, which for pure noise follows the
+            # median of the Marchenko-Pastur distribution
+            leading = s
+            n_max = max(n_rows, n_cols)
+            sigma = np.median(s)/np.sqrt(n_max*_marchenko_pastur_median(n_min/float(n_max)))
+        noise_level = sigma*(np.sqrt(n_rows) + np.sqrt(n_cols))
+        suggested_rank = int(np.sum(leading > 1.5*noise_level))
+
+    results = {'singular_values': s,
+               'explained_variance_ratio': explained,
+               'cumulative_explained_variance': cumulative,
+               'suggested_rank': suggested_rank,
+               'U': U,
+               'V': V}
+    if not plot:
+        return results
+
     plt.subplot(1,2,1)
     u_shape = U.shape
-    n_l_vector = n if u_shape[0]>=n else u_shape[0]
+    n_l_vector = n if u_shape[1]>=n else u_shape[1]
     for i in range(n_l_vector):
         plt.plot(times,U[:,i])
     plt.xlabel("time")
@@ -335,9 +535,159 @@ def basic_pca(dataFrame,n=4):
     plt.xlabel("wavelength")
     plt.ylabel("Components V[i,:]")
     """
+    return results
         
 
     
+def _marchenko_pastur_median(beta):
+    """ Median of the Marchenko-Pastur distribution with aspect ratio beta <= 1.
+
+        It is the median squared singular value of an n_max x (beta*n_max) matrix
+        of iid unit variance noise divided by n_max.
+
+        This method is not intended to be used by users directly
+
+    """
+    lower = (1.0 - np.sqrt(beta))**2
+    upper = (1.0 + np.sqrt(beta))**2
+    # with x = lower + (upper - lower)*t**2 the density times dx/dt is proportional to
+    # sqrt(upper - x)*t**2/x, which stays finite at x = 0 (beta = 1)
+    t = np.linspace(0.0, 1.0, 10001)
+    x = lower + (upper - lower)*t**2
+    ratio = np.full_like(t, 1.0/(upper - lower))
+    positive = x > 0.0
+    ratio[positive] = t[positive]**2/x[positive]
+    weight = np.sqrt(np.maximum(upper - x, 0.0))*ratio
+    cdf = np.concatenate(([0.0], np.cumsum(0.5*(weight[1:] + weight[:-1])*np.diff(t))))
+    return float(np.interp(0.5, cdf/cdf[-1], x))
+
+
+def _truncated_svd(D, method='full', rank=10, seed=None, oversampling=10, power_iterations=4):
+    """ Leading singular values/vectors of D.
+
+        This method is not intended to be used by users directly
+
+        Args:
+            D (ndarray): data matrix
+
+            method (str): 'full', 'randomized' or 'lanczos'
+
+            rank (int): number of singular values for the truncated methods
+
+            seed (int): seed of the random projections
+
+            oversampling (int): extra random directions of the randomized method
+
+            power_iterations (int): subspace iterations of the randomized method
+
+        Returns:
+            tuple U, s, V with s in decreasing order, U with shape (n_rows, k) and V with shape (k, n_cols)
+
+    """
+    if method == 'full':
+        return np.linalg.svd(D, full_matrices=False)
+    min_dim = min(D.shape)
+    rank = max(1, min(int(rank), min_dim))
+    if method == 'randomized':
+        rng = np.random.RandomState(seed)
+        k = min(rank + oversampling, min_dim)
+        Q, _ = np.linalg.qr(D.dot(rng.normal(size=(D.shape[1], k))))
+        for _ in range(power_iterations):
+            # re-orthonormalize every product to keep the small singular directions
+            Q, _ = np.linalg.qr(D.T.dot(Q))
+            Q, _ = np.linalg.qr(D.dot(Q))
+        Ub, s, V = np.linalg.svd(Q.T.dot(D), full_matrices=False)
+        U = Q.dot(Ub)
+        return U[:, :rank], s[:rank], V[:rank]
+    if method == 'lanczos':
+        if rank >= min_dim:
+            # svds requires rank < min(D.shape)
+            U, s, V = np.linalg.svd(D, full_matrices=False)
+            return U[:, :rank], s[:rank], V[:rank]
+        import scipy.sparse.linalg
+        U, s, V = scipy.sparse.linalg.svds(D, k=rank)
+        order = np.argsort(s)[::-1]
+        return U[:, order], s[order], V[order]
+    raise RuntimeError("method must be 'full', 'randomized' or 'lanczos'")
+
+
+def select_wavelengths(dataFrame, n_wavelengths=None, fraction=0.15, method='leverage', rank=None):
+    """ Selects the most informative wavelengths of spectral data.
+
+        The spectra are approximated by the leading rank singular vectors, D ~ U_r*s_r*V_r^T.
+        'leverage' ranks the wavelengths by the squared norm of their rows in V_r (how much
+        they contribute to the absorbing subspace). 'snr' ranks them by the norm of the
+        rank r reconstruction of their column divided by the norm of the remaining residual.
+        The subset always contains the rank wavelengths chosen by a column pivoted QR of V_r^T,
+        so that every absorbing direction is represented.
+
+        The returned report bounds the accuracy lost by fitting only the subset. If the
+        absorbances lie in the span of V_r, the covariance of concentrations (and parameters)
+        estimated from the subset is at most variance_inflation_bound = 1/sigma_min(V_r[subset])^2
+        times the covariance obtained with all wavelengths.
+
+        Args:
+            dataFrame (DataFrame): spectral data
+
+            n_wavelengths (int, optional): number of wavelengths to select. Default
+            fraction of the wavelengths
+
+            fraction (float, optional): fraction of the wavelengths to select when n_wavelengths is
+            not given. Default 0.15
+
+            method (str, optional): 'leverage' or 'snr'. Default 'leverage'
+
+            rank (int, optional): number of absorbing components. Default the rank
+            suggested by basic_pca
+
+        Returns:
+            tuple (wavelengths, report). wavelengths is the sorted list of selected wavelengths. report
+            is a dict with 'rank', 'scores' (Series of all wavelengths), 'captured_energy' (fraction
+            of ||D||_F^2 in the subset), 'variance_inflation_bound' and 'std_error_inflation_bound'
+
+    """
+    D = np.array(dataFrame, dtype=float)
+    n_cols = D.shape[1]
+    if n_wavelengths is None:
+        n_wavelengths = int(np.ceil(fraction*n_cols))
+    if rank is None:
+        rank = max(basic_pca(dataFrame, plot=False)['suggested_rank'], 1)
+    rank = int(min(rank, min(D.shape)))
+    n_wavelengths = int(min(max(n_wavelengths, rank), n_cols))
+
+    U, s, V = _truncated_svd(D, 'full' if 2*rank >= min(D.shape) else 'lanczos', rank)
+    basis = V[:rank].T
+    if method == 'leverage':
+        scores = np.einsum('ij,ij->i', basis, basis)
+    elif method == 'snr':
+        reconstruction = (U[:, :rank]*s[:rank]).dot(V[:rank])
+        signal = np.sqrt(np.einsum('ij,ij->j', reconstruction, reconstruction))
+        residual = D - reconstruction
+        noise = np.sqrt(np.einsum('ij,ij->j', residual, residual))
+        scores = signal/np.maximum(noise, np.finfo(float).tiny)
+    else:
+        raise RuntimeError("method must be 'leverage' or 'snr'")
+
+    # the wavelengths of a column pivoted QR of V_r^T span the absorbing subspace well,
+    # the rest of the subset is filled by score
+    import scipy.linalg
+    pivots = scipy.linalg.qr(basis.T, pivoting=True, mode='r')[1][:rank]
+    order = np.argsort(scores)[::-1]
+    remaining = order[~np.isin(order, pivots)]
+    selected = np.sort(np.concatenate((pivots, remaining[:n_wavelengths - len(pivots)])))
+    sigma_min = np.linalg.svd(basis[selected], compute_uv=False)[-1]
+    inflation = 1.0/sigma_min**2 if sigma_min > 0 else np.inf
+    total = np.einsum('ij,ij->', D, D)
+    subset = D[:, selected]
+    report = {'rank': rank,
+              'scores': pd.Series(scores, index=dataFrame.columns),
+              'captured_energy': np.einsum('ij,ij->', subset, subset)/total if total > 0 else 0.0,
+              'variance_inflation_bound': inflation,
+              'std_error_inflation_bound': np.sqrt(inflation)}
+    wavelengths = np.asarray(dataFrame.columns)[selected].tolist()
+    return wavelengths, report
+
+
 def gausian_single_peak(wl,alpha,beta,gamma):
     """
     helper function to generate absorption data based on 
@@ -440,48 +790,10 @@ def savitzky_golay(dataFrame, window_size, orderPoly, orderDeriv=0):
         Original paper: A. Savitzky, M. J. E. Golay, Smoothing and Differentiation of Data by 
         Simplified Least Squares Procedures. Analytical Chemistry, 1964, 36 (8), pp 1627-1639.
     """
-    # data checks
-    try:
-        window_size = np.abs(np.int(window_size))
-        orderPoly = np.abs(np.int(orderPoly))
-    except ValueError:
-        raise ValueError("window_size and order have to be of type int")
-    if window_size % 2 != 1 or window_size < 1:
-        raise TypeError("window_size size must be a positive odd number")
-    if window_size < orderPoly + 2:
-        raise TypeError("window_size is too small for the polynomials order")    
-    if orderPoly >= window_size:
-        raise ValueError("polyorder must be less than window_length.")
-
     if not isinstance(dataFrame, pd.DataFrame):
         raise TypeError("data must be inputted as a pandas DataFrame, try using read_spectral_data_from_txt or similar function first")
     print("Applying the Savitzky-Golay filter")
-    
-    order_range = range(orderPoly+1)
-    half_window = (window_size -1) // 2
-    # precompute coefficients
-    b = np.mat([[k**i for i in order_range] for k in range(-half_window, half_window+1)])
-    m = np.linalg.pinv(b).A[orderDeriv]
-    #rate = 1
-    #m = np.linalg.pinv(b).A[orderDeriv] * rate**orderDeriv * factorial(orderDeriv)
-    D = np.array(dataFrame)
-    no_noise = np.array(dataFrame)
-    # pad the signal at the extremes with values taken from the signal itself
-    for t in range(len(dataFrame.index)):
-        row = list()
-        for l in range(len(dataFrame.columns)):
-            row.append(D[t,l])
-        firstvals = row[0] - np.abs( row[1:half_window+1][::-1] - row[0] )
-        lastvals = row[-1] + np.abs(row[-half_window-1:-1][::-1] - row[-1])
-        y = np.concatenate((firstvals, row, lastvals))
-        new_row = np.convolve( m, y, mode='valid')
-        no_noise[t]=new_row
-
-    data_frame = pd.DataFrame(data=no_noise,
-                              columns = dataFrame.columns,
-                              index=dataFrame.index)
-    
-    return data_frame
+    return SavitzkyGolay(window_size, orderPoly, orderDeriv).fit_transform(dataFrame)
 
 def snv(dataFrame, offset=0):
     """
@@ -489,11 +801,12 @@ def snv(dataFrame, offset=0):
     method that is commonly used to remove scatter effects in spectroscopic data, this pre-processing 
     step can be applied before the SG filter or used on its own. SNV can be sensitive to noisy entries 
     in the spectra and can increase nonlinear behaviour between S and C as it is not a linear transformation.
+    Every spectrum is centered and divided by its standard deviation plus the offset.
     
     
     Args:
         dataFrame (DataFrame): the data to be processed (either concentration or spectral data)
-        offset (float): user-defined offset which can be used to avoid over-normalization for samples
+        offset (float): user-defined offset added to the standard deviation to avoid over-normalization for samples
                         with near-zero standard deviation. Guide for choosing this value is for something 
                         near the expected noise level to be specified. Default value is zero.
         
@@ -503,37 +816,10 @@ def snv(dataFrame, offset=0):
     References:
 
     """
-    # data checks
     if not isinstance(dataFrame, pd.DataFrame):
         raise TypeError("data must be inputted as a pandas DataFrame, try using read_spectral_data_from_txt or similar function first")
-    print("Applying the SNV pre-processing")    
-
-    D = np.array(dataFrame)
-    snv_proc = np.array(dataFrame)
-    for t in range(len(dataFrame.index)):
-        row = list()
-        sum_spectra = 0
-        for l in range(len(dataFrame.columns)):
-            row.append(D[t,l])
-            sum_spectra += D[t,l]
-        mean_spectra = sum_spectra/(len(dataFrame.columns))
-        std = 0
-        for l in range(len(dataFrame.columns)):
-            std += (mean_spectra-D[t,l])**2
-        new_row = list()
-        for l in range(len(dataFrame.columns)):
-            if offset ==0:
-                w = (D[t,l]-mean_spectra)*(std/(len(dataFrame.columns)-1))**0.5
-            else:
-                w = (D[t,l]-mean_spectra)*(std/(len(dataFrame.columns)-1))**0.5 + 1/offset
-            new_row.append(w)
-                
-        snv_proc[t]=new_row
-
-    data_frame = pd.DataFrame(data=snv_proc,
-                              columns = dataFrame.columns,
-                              index=dataFrame.index)
-    return data_frame
+    print("Applying the SNV pre-processing")
+    return SNV(offset).fit_transform(dataFrame)
 
 def msc(dataFrame, reference_spectra=None):
     """
@@ -546,7 +832,7 @@ def msc(dataFrame, reference_spectra=None):
     Args:
         dataFrame (DataFrame):          the data to be processed (either concentration or spectral data)
         reference_spectra (DataFrame):  optional user-provided reference spectra argument. Default is to automatically
-                                        determine this using the average spectra values.
+                                        determine this using the average spectrum of the data.
         
     Returns:
         DataFrame pre-processed data
@@ -554,47 +840,223 @@ def msc(dataFrame, reference_spectra=None):
     References:
 
     """
-    # data checks
     if not isinstance(dataFrame, pd.DataFrame):
         raise TypeError("data must be inputted as a pandas DataFrame, try using read_spectral_data_from_txt or similar function first")
-    print("Applying the MSC pre-processing")  
-    
-    #Want to make it possible to include user-defined reference spectra
-    #this is not great as we could provide the data with some conditioning 
-    #in order to construct references based on different user inputs
-    if reference_spectra != None:
-        if not isinstance(reference_spectra, pd.DataFrame):
-            raise TypeError("data must be inputted as a pandas DataFrame, try using read_spectral_data_from_txt or similar function first")
-        
-        if len(dataFrame.columns) != len(reference_spectra.columns) and len(dataFrame.rows) != len(reference_spectra.rows):
+    print("Applying the MSC pre-processing")
+    return MSC(reference_spectra).fit_transform(dataFrame)
+
+
+class PreprocessingStep(object):
+    """Base class of the spectral pre-processing steps.
+
+    Steps work on the whole data array at once. fit learns whatever the step needs
+    from the data (e.g. the reference spectrum of MSC) and transform applies it.
+    Derived classes implement _fit and _transform on numpy arrays.
+
+    """
+
+    def fit(self, dataFrame):
+        """Learns the parameters of the step.
+
+        Args:
+            dataFrame (DataFrame): data (either concentration or spectral data)
+
+        Returns:
+            self
+        """
+        self._fit(_as_float_array(dataFrame))
+        return self
+
+    def transform(self, dataFrame):
+        """Applies the step.
+
+        Args:
+            dataFrame (DataFrame): data (either concentration or spectral data)
+
+        Returns:
+            DataFrame with the processed data
+        """
+        return _apply_steps([self], dataFrame)
+
+    def fit_transform(self, dataFrame):
+        """Fits the step to the data and applies it.
+
+        Args:
+            dataFrame (DataFrame): data (either concentration or spectral data)
+
+        Returns:
+            DataFrame with the processed data
+        """
+        return self.fit(dataFrame).transform(dataFrame)
+
+    def _fit(self, D):
+        pass
+
+    def _transform(self, D):
+        """Returns the processed array. D is a private float copy that may be overwritten"""
+        raise NotImplementedError()
+
+
+class SavitzkyGolay(PreprocessingStep):
+    """Savitzky-Golay smoothing/differentiation along the columns (wavelengths) of every row.
+
+    The rows are padded by point reflection at both ends and filtered by a single
+    2-D convolution with the filter coefficients. See savitzky_golay.
+
+    Args:
+        window_size (int): the length of the window. Must be an odd integer number
+
+        orderPoly (int): order of the polynomial used in the filter. Should be less than window_size-1
+
+        orderDeriv (int,optional): the order of the derivative to compute (default = 0 means only smoothing)
+
+    """
+
+    def __init__(self, window_size, orderPoly, orderDeriv=0):
+        try:
+            window_size = np.abs(int(window_size))
+            orderPoly = np.abs(int(orderPoly))
+        except ValueError:
+            raise ValueError("window_size and order have to be of type int")
+        if window_size % 2 != 1 or window_size < 1:
+            raise TypeError("window_size size must be a positive odd number")
+        if window_size < orderPoly + 2:
+            raise TypeError("window_size is too small for the polynomials order")
+        if orderPoly >= window_size:
+            raise ValueError("polyorder must be less than window_length.")
+        self.window_size = window_size
+        self.orderPoly = orderPoly
+        self.orderDeriv = orderDeriv
+        half_window = (window_size - 1) // 2
+        # precompute coefficients
+        b = np.vander(np.arange(-half_window, half_window + 1), orderPoly + 1, increasing=True)
+        self.coefficients = np.linalg.pinv(b)[orderDeriv]
+
+    def _transform(self, D):
+        h = (self.window_size - 1) // 2
+        if h == 0:
+            return D * self.coefficients[0]
+        # pad the signal at the extremes with values taken from the signal itself
+        first = D[:, :1]
+        last = D[:, -1:]
+        firstvals = first - np.abs(D[:, h:0:-1] - first)
+        lastvals = last + np.abs(D[:, -2:-h - 2:-1] - last)
+        padded = np.concatenate((firstvals, D, lastvals), axis=1)
+        return scipy.signal.convolve2d(padded, self.coefficients[np.newaxis, :], mode='valid')
+
+
+class SNV(PreprocessingStep):
+    """Standard Normal Variate scaling of every row. See snv.
+
+    Every row d is replaced by (d - mean(d))/(std(d) + offset).
+
+    Args:
+        offset (float,optional): added to the standard deviation to avoid over-normalization. Default zero
+
+    """
+
+    def __init__(self, offset=0):
+        self.offset = offset
+
+    def _transform(self, D):
+        n = D.shape[1]
+        mean = D.mean(axis=1)[:, np.newaxis]
+        D -= mean
+        std = np.sqrt(np.einsum('ij,ij->i', D, D) / (n - 1))[:, np.newaxis]
+        D /= std + self.offset
+        return D
+
+
+class MSC(PreprocessingStep):
+    """Multiplicative Scatter Correction of every row. See msc.
+
+    Every row d is regressed on the reference spectrum, d = a + b*ref, and replaced
+    by (d - a)/b. All regressions are solved at once in closed form.
+
+    Args:
+        reference_spectra (DataFrame, Series or array, optional): reference spectrum, or one
+        reference per row. Default is the average spectrum of the data passed to fit
+
+    """
+
+    def __init__(self, reference_spectra=None):
+        self.reference_spectra = reference_spectra
+        self.reference = None
+        if reference_spectra is not None:
+            if not isinstance(reference_spectra, (pd.DataFrame, pd.Series, np.ndarray)):
+                raise TypeError("data must be inputted as a pandas DataFrame, try using read_spectral_data_from_txt or similar function first")
+            self.reference = np.atleast_2d(np.array(reference_spectra, dtype=float))
+
+    def _fit(self, D):
+        if self.reference_spectra is None:
+            self.reference = D.mean(axis=0)[np.newaxis, :]
+        elif self.reference.shape[1] != D.shape[1] or self.reference.shape[0] not in (1, D.shape[0]):
             raise NotImplementedError("the reference spectra must have the same number of entries as the data")
-    
-    D = np.array(dataFrame)
-    ref = np.array(dataFrame)
-    msc_proc = np.array(dataFrame)
-    
-    # the average spectrum is calculated as reference spectra for MSC when none is given by user
-    if reference_spectra == None:
-        sum_spectra = 0
-        
-        for t in range(len(dataFrame.index)):
-            sum_spectra = 0
-            for l in range(len(dataFrame.columns)):
-                sum_spectra += D[t,l]
-            mean_spectra = sum_spectra/(len(dataFrame.columns))
-            for l in range(len(dataFrame.columns)):
-                ref[t,l] = mean_spectra 
-    else:
-        #should add in some checks and additional ways to formulate these depending on what input the user provides
-        #need to find out the type of data usually inputted here in order to do this
-        ref = reference_spectra
-    for t in range(len(dataFrame.index)):
-        row = list()
-        fit = np.polyfit(ref[t,:],D[t,:],1, full=True)
-        row[:] = (D[t,:] - fit[0][1]) / fit[0][0]
-        msc_proc[t,:]=row  
-
-    data_frame = pd.DataFrame(data=msc_proc,
-                              columns = dataFrame.columns,
-                              index=dataFrame.index)
-    return data_frame
\ No newline at end of file
+
+    def _transform(self, D):
+        if self.reference is None:
+            raise RuntimeError('MSC must be fitted before transforming data')
+        ref = self.reference - self.reference.mean(axis=1)[:, np.newaxis]
+        mean = D.mean(axis=1)
+        D -= mean[:, np.newaxis]
+        slope = np.einsum('ij,ij->i', D, np.broadcast_to(ref, D.shape)) / np.einsum('ij,ij->i', ref, ref)
+        # (d - a)/b with a = mean(d) - b*mean(ref)
+        D /= slope[:, np.newaxis]
+        D += self.reference.mean(axis=1)[:, np.newaxis]
+        return D
+
+
+class PreprocessingPipeline(PreprocessingStep):
+    """Chain of pre-processing steps applied in order, e.g.
+
+        pipeline = PreprocessingPipeline([SNV(), SavitzkyGolay(15, 2)])
+        fD_frame = pipeline.fit_transform(D_frame)
+
+    The data is copied to a float array once; all steps then work on that array
+    and a single DataFrame is built at the end.
+
+    Args:
+        steps (list): PreprocessingStep objects
+
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+
+    def fit(self, dataFrame):
+        """Fits every step on the output of the previous steps.
+
+        Args:
+            dataFrame (DataFrame): data (either concentration or spectral data)
+
+        Returns:
+            self
+        """
+        D = _as_float_array(dataFrame)
+        for step in self.steps:
+            step._fit(D)
+            D = step._transform(D)
+        return self
+
+    def transform(self, dataFrame):
+        return _apply_steps(self.steps, dataFrame)
+
+    transform.__doc__ = PreprocessingStep.transform.__doc__
+
+
+def _as_float_array(dataFrame):
+    if not isinstance(dataFrame, pd.DataFrame):
+        raise TypeError("data must be inputted as a pandas DataFrame, try using read_spectral_data_from_txt or similar function first")
+    return np.array(dataFrame.values, dtype=float)
+
+
+def _apply_steps(steps, dataFrame):
+    """ Applies the steps to a single float copy of the data.
+
+        This method is not intended to be used by users directly
+
+    """
+    D = _as_float_array(dataFrame)
+    for step in steps:
+        D = step._transform(D)
+    return pd.DataFrame(data=D, columns=dataFrame.columns, index=dataFrame.index)
@@ -5,10 +5,33 @@ from pyomo.environ import *
 from pyomo.dae import *
 from pyomo.opt import SolverFactory, ProblemFormat, TerminationCondition
 from pyomo.core.kernel.numvalue import value as value
+from scipy.sparse import csc_matrix
+from scipy.sparse.linalg import splu
 from os import getcwd, remove
+import numpy as np
 import sys
 import six
 
+try:
+    import casadi as ca
+    found_casadi = True
+except ImportError:
+    found_casadi = False
+
+#: The Newton element solver translates pyomo expressions with the visitors of the pyomo.core.expr package
+#: (pyomo >= 5.5). With older pyomo every element is solved with ipopt
+try:
+    from pyomo.core.expr.visitor import ExpressionValueVisitor
+    try:
+        from pyomo.core.expr.numeric_expr import UnaryFunctionExpression, Expr_ifExpression
+    except ImportError:
+        from pyomo.core.expr.current import UnaryFunctionExpression, Expr_ifExpression
+    from pyomo.core.expr.numvalue import native_numeric_types
+    found_expr_visitor = True
+except ImportError:
+    ExpressionValueVisitor = object
+    found_expr_visitor = False
+
 
 __author__ = 'David M Thierry'  #: April 2018
 
@@ -295,6 +318,7 @@ class fe_initialize(object):
         if n != m:
             raise Exception("Inconsistent problem; n={}, m={}".format(n, m))
         self.jump = False
+        self._newton = None
 
 
 
@@ -322,7 +346,7 @@ class fe_initialize(object):
                             if not dv[(0,) + k].fixed:
                                 dv[(0,) + k].fix()
 
-    def march_forward(self, fe, resto_strategy="bound_relax"):
+    def march_forward(self, fe, resto_strategy="bound_relax", solver="newton"):
         # type: (int) -> None
         """Moves forward with the simulation.
 
@@ -333,8 +357,13 @@ class fe_initialize(object):
         Patches tgt_model.
         Cycles initial conditions
 
+        The square system of the element is solved in-process by damped Newton. If Newton fails (or
+        `solver="ipopt"`) the element is solved with ipopt, relaxing the restoration options on failure.
+
         Args:
             fe (int): The correspoding finite element.
+            resto_strategy (str): "bound_relax" retries a failed Newton solve with relaxed bounds.
+            solver (str): "newton" (default) or "ipopt".
         """
         print("fe {}".format(fe))
         self.adjust_h(fe)
@@ -351,41 +380,85 @@ class fe_initialize(object):
         #for i in self.mod.Z.itervalues():
             #i.setlb(0)
 
-        self.ip.options["OF_start_with_resto"] = 'no'
-        self.ip.options['bound_push'] = 1e-02
-        sol = self.ip.solve(self.mod, tee=True, symbolic_solver_labels=True)
-
-        if sol.solver.termination_condition != TerminationCondition.optimal:
-            self.ip.options["OF_start_with_resto"] = 'yes'
-            # self.ip.options["linear_solver"] = "ma57"
-            # for i in self.mod.component_objects(Var):
-            #     i.pprint()
+        if solver not in ("newton", "ipopt"):
+            raise RuntimeError("solver must be either 'newton' or 'ipopt'")
+        if solver == "newton" and self._solve_newton(fe, resto_strategy):
+            print("fe {} - status: converged".format(fe))
+        else:
+            self.ip.options["OF_start_with_resto"] = 'no'
+            self.ip.options['bound_push'] = 1e-02
             sol = self.ip.solve(self.mod, tee=True, symbolic_solver_labels=True)
+
             if sol.solver.termination_condition != TerminationCondition.optimal:
-                self.ip.options["OF_start_with_resto"] = 'no'
-                self.ip.options["bound_push"] = 1E-02
-                self.ip.options["OF_bound_relax_factor"] = 1E-05
-                # self.ip.options[""]
-                # for i in self.mod.component_data_objects(Var):
-                #     i.setlb(None)
-                # for i in self.mod.Z.itervalues():
-                #     i.setlb(None)
-                # for i in self.mod.X.itervalues():
-                #     idx = i.index()
-                #     if idx[1] in ['Msa']:
-                #         i.setlb(-0.05)
-                #     else:
-                #         i.setlb(None)
+                self.ip.options["OF_start_with_resto"] = 'yes'
+                # self.ip.options["linear_solver"] = "ma57"
+                # for i in self.mod.component_objects(Var):
+                #     i.pprint()
                 sol = self.ip.solve(self.mod, tee=True, symbolic_solver_labels=True)
-                self.ip.options["OF_bound_relax_factor"] = 1E-08
                 if sol.solver.termination_condition != TerminationCondition.optimal:
-                    raise Exception("The current iteration was unsuccessful. Iteration :{}".format(fe))
+                    self.ip.options["OF_start_with_resto"] = 'no'
+                    self.ip.options["bound_push"] = 1E-02
+                    self.ip.options["OF_bound_relax_factor"] = 1E-05
+                    # self.ip.options[""]
+                    # for i in self.mod.component_data_objects(Var):
+                    #     i.setlb(None)
+                    # for i in self.mod.Z.itervalues():
+                    #     i.setlb(None)
+                    # for i in self.mod.X.itervalues():
+                    #     idx = i.index()
+                    #     if idx[1] in ['Msa']:
+                    #         i.setlb(-0.05)
+                    #     else:
+                    #         i.setlb(None)
+                    sol = self.ip.solve(self.mod, tee=True, symbolic_solver_labels=True)
+                    self.ip.options["OF_bound_relax_factor"] = 1E-08
+                    if sol.solver.termination_condition != TerminationCondition.optimal:
+                        raise Exception("The current iteration was unsuccessful. Iteration :{}".format(fe))
 
-        else:
-            print("fe {} - status: optimal".format(fe))
+            else:
+                print("fe {} - status: optimal".format(fe))
         self.patch(fe)
         self.cycle_ics(fe)
         
+    def _solve_newton(self, fe, resto_strategy):
+        # type: (int, str) -> bool
+        """Solves the current element with the in-process damped Newton solver.
+
+        The single-element model is compiled on the first call and reused for all elements.
+        This method is not intended to be used by users directly
+
+        Args:
+            fe (int): The current finite element.
+            resto_strategy (str): "bound_relax" retries with bounds relaxed by 1e-05.
+
+        Returns:
+            bool: True if Newton converged and the solution was loaded into the model.
+        """
+        if self._newton is None:
+            self._newton = False
+            if not found_casadi:
+                print("fe_factory: casadi is not available, using ipopt for every element")
+            elif not found_expr_visitor:
+                print("fe_factory: this pyomo version has no expression visitors, using ipopt for every element")
+            else:
+                try:
+                    self._newton = newton_element_solver(self.mod)
+                except RuntimeError as e:
+                    print("fe_factory: the element can not be solved by Newton ({}), using ipopt".format(e))
+        if self._newton is False:
+            return False
+
+        relax_factors = [1e-08]
+        if resto_strategy == "bound_relax":
+            relax_factors.append(1e-05)
+        for relax in relax_factors:
+            converged, n_iter, residual = self._newton.solve(bound_relax_factor=relax)
+            if converged:
+                return True
+            print("fe {} - newton failed after {} iterations, "
+                  "residual {:.3e} (bound_relax_factor={})".format(fe, n_iter, residual, relax))
+        return False
+
     #Inclusion of discrete jumps: (CS)
     def load_discrete_jump(self, var_dic, jump_times, feed_times):
         """Method is used to define and load the places where discrete jumps are located, e.g. 
@@ -568,16 +641,20 @@ class fe_initialize(object):
         for t in zeit:
             hi[t].value = self.fe_list[fe]
 
-    def run(self, resto_strategy="bound_relax"):
+    def run(self, resto_strategy="bound_relax", solver="newton"):
         """Runs the sequence of problems fe=0,nfe
 
+        Args:
+            resto_strategy (str): "bound_relax" retries a failed Newton solve with relaxed bounds.
+            solver (str): "newton" (default) solves the elements in-process, "ipopt" calls ipopt for every element.
+
         """
         print("*"*5, end='\t')
         print("Fe Factory: fe_initialize by DT \@2018", end='\t')
         print("*" * 5)
         print("*" * 5 + '\tSolving for {} elements\t'.format(len(self.fe_list)) + "*" * 5 )
         for i in range(0, len(self.fe_list)):
-            self.march_forward(i, resto_strategy=resto_strategy)
+            self.march_forward(i, resto_strategy=resto_strategy, solver=solver)
 
     def load_input(self, fe):
         # type: (int) -> None
@@ -642,6 +719,178 @@ class fe_initialize(object):
 
 
 
+class newton_element_solver(object):
+    def __init__(self, model, tol=1e-08, max_iter=50, bound_push=1e-02):
+        # type: (ConcreteModel, float, int, float) -> None
+        """Damped Newton solver for the square system of a single finite element.
+
+        The active equality constraints of the model are translated once into a casadi function that returns
+        the residuals and their sparse Jacobian. Unfixed variables are the unknowns; fixed variables and
+        mutable params (h_i, initial conditions, inputs) are read from the model at every solve, so the same
+        compiled function serves all the elements.
+
+        Args:
+            model (ConcreteModel): The discretized single-element model.
+            tol (float): Tolerance on the max-norm of the residuals.
+            max_iter (int): Maximum number of Newton iterations.
+            bound_push (float): Minimum distance of the starting point to the variable bounds.
+        """
+        self.tol = tol
+        self.max_iter = max_iter
+        self.bound_push = bound_push
+
+        translator = _casadi_translator()
+        residuals = []
+        for con in model.component_data_objects(Constraint, active=True):
+            if not con.equality:
+                raise RuntimeError("{} is not an equality constraint".format(con.name))
+            residuals.append(translator.translate(con.body) - translator.translate(con.upper))
+        self.variables = translator.variables
+        self.parameters = translator.parameters
+        if len(residuals) != len(self.variables):
+            raise RuntimeError("Inconsistent problem; n={}, m={}".format(len(self.variables), len(residuals)))
+
+        x = ca.vertcat(*translator.variable_symbols)
+        p = ca.vertcat(*translator.parameter_symbols)
+        r = ca.vertcat(*residuals)
+        self._function = ca.Function('element', [x, p], [r, ca.jacobian(r, x)])
+
+        inf = float('inf')
+        self.lb = np.array([-inf if v.lb is None else value(v.lb) for v in self.variables])
+        self.ub = np.array([inf if v.ub is None else value(v.ub) for v in self.variables])
+
+    def solve(self, bound_relax_factor=1e-08):
+        # type: (float) -> tuple
+        """Solves the system for the current values of the fixed variables and mutable params.
+
+        The starting point is taken from the current values of the variables. Steps are damped with a
+        backtracking line search on the residual norm and cut to stay inside the bounds, which are relaxed by
+        `bound_relax_factor` as ipopt does. The solution is only loaded into the model if Newton converges.
+
+        Args:
+            bound_relax_factor (float): Relative relaxation of the variable bounds.
+
+        Returns:
+            tuple: (converged, iterations, max-norm of the residuals)
+        """
+        p = np.array([value(q) for q in self.parameters], dtype=float)
+        lb = self.lb - bound_relax_factor*np.maximum(1.0, np.abs(self.lb))
+        ub = self.ub + bound_relax_factor*np.maximum(1.0, np.abs(self.ub))
+        x = np.array([0.0 if v.value is None else v.value for v in self.variables], dtype=float)
+
+        #: Push the starting point inside the bounds
+        push_lb = lb.copy()
+        push_ub = ub.copy()
+        finite = np.isfinite(lb)
+        push_lb[finite] += self.bound_push*np.maximum(1.0, np.abs(lb[finite]))
+        finite = np.isfinite(ub)
+        push_ub[finite] -= self.bound_push*np.maximum(1.0, np.abs(ub[finite]))
+        narrow = push_lb > push_ub
+        push_lb[narrow] = push_ub[narrow] = 0.5*(lb[narrow] + ub[narrow])
+        x = np.minimum(np.maximum(x, push_lb), push_ub)
+
+        r, jac = self._evaluate(x, p)
+        norm = np.linalg.norm(r)
+        for it in range(self.max_iter + 1):
+            if not np.all(np.isfinite(r)):
+                return False, it, float('inf')
+            if np.max(np.abs(r)) <= self.tol:
+                for v, val in zip(self.variables, x):
+                    v.set_value(val)
+                return True, it, np.max(np.abs(r))
+            if it == self.max_iter:
+                break
+            try:
+                dx = splu(jac).solve(-r)
+            except RuntimeError:
+                return False, it, np.max(np.abs(r))
+
+            #: Fraction to the boundary
+            alpha = 1.0
+            lower = dx < 0.0
+            if np.any(lower):
+                alpha = min(alpha, np.min(0.99*(lb[lower] - x[lower])/dx[lower]))
+            upper = dx > 0.0
+            if np.any(upper):
+                alpha = min(alpha, np.min(0.99*(ub[upper] - x[upper])/dx[upper]))
+
+            #: Backtracking on the residual norm
+            while alpha > 1e-10:
+                x_trial = x + alpha*dx
+                r_trial, jac_trial = self._evaluate(x_trial, p)
+                norm_trial = np.linalg.norm(r_trial)
+                if np.isfinite(norm_trial) and norm_trial <= (1.0 - 1e-04*alpha)*norm:
+                    break
+                alpha *= 0.5
+            else:
+                return False, it, np.max(np.abs(r))
+            x, r, jac, norm = x_trial, r_trial, jac_trial, norm_trial
+        return False, self.max_iter, np.max(np.abs(r))
+
+    def _evaluate(self, x, p):
+        """Returns the residuals and the sparse Jacobian at x.
+
+           This method is not intended to be used by users directly
+
+        """
+        r, jac = self._function(x, p)
+        colind, row = jac.sparsity().get_ccs()
+        jac = csc_matrix((np.array(jac.nonzeros()), row, colind), shape=jac.shape)
+        return np.array(r).ravel(), jac
+
+
+class _casadi_translator(ExpressionValueVisitor):
+    """Translates pyomo expressions into casadi expressions.
+
+    Unfixed variables become casadi symbols of the unknowns, fixed variables and mutable params become
+    symbols of the parameters. Each pyomo object gets a single symbol across all translated expressions.
+
+    This class is not intended to be used by users directly
+    """
+
+    def __init__(self):
+        self.variables = []
+        self.variable_symbols = []
+        self.parameters = []
+        self.parameter_symbols = []
+        self._symbols = dict()
+
+    def translate(self, expr):
+        return self.dfs_postorder_stack(expr)
+
+    def visit(self, node, values):
+        if isinstance(node, UnaryFunctionExpression):
+            name = node.getname()
+            if not hasattr(ca, name):
+                raise RuntimeError("function {} is not supported".format(name))
+            return getattr(ca, name)(values[0])
+        if isinstance(node, Expr_ifExpression):
+            return ca.if_else(values[0], values[1], values[2])
+        return node._apply_operation(values)
+
+    def visiting_potential_leaf(self, node):
+        if node.__class__ in native_numeric_types:
+            return True, node
+        if node.is_expression_type():
+            return False, None
+        if node.is_variable_type():
+            if node.fixed:
+                return True, self._symbol(node, self.parameters, self.parameter_symbols, 'p')
+            return True, self._symbol(node, self.variables, self.variable_symbols, 'x')
+        if node.is_parameter_type() and not node.is_constant():
+            return True, self._symbol(node, self.parameters, self.parameter_symbols, 'p')
+        return True, value(node)
+
+    def _symbol(self, node, objects, symbols, prefix):
+        symbol = self._symbols.get(id(node))
+        if symbol is None:
+            symbol = ca.SX.sym('{}_{}'.format(prefix, len(objects)))
+            self._symbols[id(node)] = symbol
+            objects.append(node)
+            symbols.append(symbol)
+        return symbol
+
+
 def t_ij(time_set, i, j):
     # type: (ContinuousSet, int, int) -> float
     """Return the corresponding time(continuous set) based on the i-th finite element and j-th collocation point
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import multiprocessing
+import traceback
+import sys
+import warnings
+
+# function and shared data of the running map. Forked workers inherit them
+# so pyomo models do not need to be pickled
+_shared_call = None
+
+
+def fork_map(function, tasks, shared=None, n_workers=None):
+    """Evaluates function(shared, task) for every task in a pool of forked processes.
+
+    Workers are forked from the calling process, so the shared object (for
+    instance an estimator holding a discretized pyomo model) is inherited
+    and never pickled. Tasks and returned values must be picklable. Each
+    worker may run several tasks, so the function should work on copies
+    of the shared data.
+
+    Note:
+        Where fork is not available (e.g. Windows) tasks are run serially
+
+    Args:
+        function (callable): function with signature function(shared, task)
+
+        tasks (list): arguments of each evaluation
+
+        shared (optional): object passed to all evaluations
+
+        n_workers (int, optional): number of processes. Default number of cores.
+        With 1 worker tasks are run serially in the calling process
+
+    Returns:
+        list of tuples (value, error) in the order of tasks. error is None
+        or the traceback of the exception raised by the evaluation
+
+    """
+    global _shared_call
+    tasks = list(tasks)
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = max(1, min(n_workers, len(tasks)))
+
+    context = _fork_context()
+    if n_workers == 1 or context is None:
+        if n_workers > 1:
+            warnings.warn("fork is not available. Running tasks serially")
+        return [_safe_call(function, shared, task) for task in tasks]
+
+    _shared_call = (function, shared)
+    try:
+        pool = context.Pool(n_workers)
+        try:
+            return pool.map(_run_task, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _shared_call = None
+
+
+def _fork_context():
+    """Returns a multiprocessing context that forks workers or None.
+
+       This method is not intended to be used by users directly
+
+    """
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+    except AttributeError:
+        # python 2 forks on posix
+        if hasattr(multiprocessing, 'Pool') and not sys.platform.startswith('win'):
+            return multiprocessing
+        return None
+
+
+def _run_task(task):
+    function, shared = _shared_call
+    return _safe_call(function, shared, task)
+
+
+def _safe_call(function, shared, task):
+    try:
+        return function(shared, task), None
+    except Exception:
+        return None, traceback.format_exc()
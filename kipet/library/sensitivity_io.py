@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+from contextlib import contextmanager
+import numpy as np
+import subprocess
+import tempfile
+import shutil
+import shlex
+import six
+import sys
+import re
+import os
+
+# entries of the reduced hessian printed by ipopt_sens e.g. RedHessian unscaled[ 1, 0]=1.5e+01
+_hessian_entry = re.compile(r'\[\s*(\d+)\s*,\s*(\d+)\s*\]\s*=\s*(\S+)')
+
+
+@contextmanager
+def scratch_directory(prefix='kipet_', keep=False):
+    """Creates a new temporary directory for the files of a solver run.
+
+    Solvers like k_aug and ipopt_sens read and write files with fixed names
+    (ipopt.opt, dxdp_.dat, result_red_hess.txt) in their working directory.
+    Running each solve in its own directory (see solve_in_directory) keeps
+    concurrent runs (e.g. forked workers, threads or several scripts in the
+    same folder) from reading each other's files. The working directory of
+    the process is not changed. An ipopt.opt file in the current working
+    directory is copied into the new directory so the solvers still see the
+    user's options. The directory is removed on exit.
+
+    Args:
+        prefix (str, optional): prefix of the temporary directory name
+
+        keep (bool, optional): flag to keep the directory and its files on exit. Default False
+
+    Returns:
+        absolute path of the temporary directory
+    """
+    path = tempfile.mkdtemp(prefix=prefix)
+    options_file = os.path.join(os.getcwd(), 'ipopt.opt')
+    if os.path.isfile(options_file):
+        shutil.copy(options_file, path)
+    try:
+        yield path
+    finally:
+        if not keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def solve_in_directory(solver, directory, model, **kwds):
+    """Solves a model with a pyomo shell solver running in the given directory.
+
+    The solver executable is started here with directory as its working
+    directory, so the files it reads and writes by name end up there. pyomo
+    only honours a working directory for shell solvers since version 6, so
+    the command built by the solver is not handed back to pyomo to run. The
+    model and solution files are passed to the solver with absolute paths.
+    Relative logfile names are taken relative to directory.
+
+    Args:
+        solver: pyomo solver created with SolverFactory (ipopt, ipopt_sens, k_aug)
+
+        directory (str): working directory of the solver
+
+        model (ConcreteModel): model to solve
+
+        **kwds: options passed to solver.solve
+
+    Returns:
+        solver results
+    """
+    logfile = kwds.get('logfile')
+    if logfile is not None and not os.path.isabs(logfile):
+        kwds['logfile'] = os.path.join(directory, logfile)
+
+    def execute_command_in_directory(command):
+        return _run_command(command, directory, kwds.get('tee', False))
+
+    solver._execute_command = execute_command_in_directory
+    try:
+        return solver.solve(model, **kwds)
+    finally:
+        del solver._execute_command
+
+
+def _run_command(command, directory, tee):
+    """Runs a command built by create_command_line of a pyomo shell solver in directory.
+
+       This method is not intended to be used by users directly
+
+    Returns:
+        list [return code, output of the command]
+    """
+    cmd = command.cmd
+    if isinstance(cmd, six.string_types):
+        cmd = shlex.split(cmd)
+    try:
+        process = subprocess.Popen(cmd, cwd=directory, env=command.get('env'), stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, universal_newlines=True)
+    except OSError as e:
+        raise RuntimeError('Could not execute the command: {}\tError message: {}'.format(cmd, e))
+    output = list()
+    for line in iter(process.stdout.readline, ''):
+        if tee:
+            sys.stdout.write(line)
+        output.append(line)
+    process.stdout.close()
+    rc = process.wait()
+    sys.stdout.flush()
+    return [rc, ''.join(output)]
+
+
+def read_matrix(filename):
+    """Reads a dense matrix written as whitespace separated text, e.g. by k_aug.
+
+    The file is parsed in a single pass by numpy.fromfile instead of line
+    by line. The shape follows numpy.loadtxt, i.e. single rows or columns
+    are returned as 1D arrays.
+
+    Args:
+        filename (str): name of the file
+
+    Returns:
+        numpy array
+    """
+    with open(filename, 'r') as f:
+        first_line = f.readline()
+        while first_line and not first_line.strip():
+            first_line = f.readline()
+    n_cols = len(first_line.split())
+    if n_cols == 0:
+        return np.zeros(0)
+
+    values = np.fromfile(filename, dtype=float, sep=' ')
+    if values.size % n_cols != 0:
+        # irregular layout (e.g. comments): fall back to the slow reader
+        return np.loadtxt(filename)
+    values = values.reshape(-1, n_cols)
+    if values.shape[0] == 1 or values.shape[1] == 1:
+        return values.ravel()
+    return values
+
+
+def read_reduced_hessian(hessian_string, n_vars):
+    """Parses the reduced hessian printed by ipopt_sens.
+
+    All entries [i,j]=value after the header line are extracted with one
+    regular expression and set symmetrically in the matrix.
+
+    Args:
+        hessian_string (str): solver output starting at the hessian header
+
+        n_vars (int): size of the reduced hessian
+
+    Returns:
+        numpy array with shape (n_vars, n_vars)
+    """
+    newline = hessian_string.find('\n')
+    body = hessian_string[newline + 1:] if newline >= 0 else ''
+    hessian = np.zeros((n_vars, n_vars))
+    entries = _hessian_entry.findall(body)
+    if entries:
+        rows, cols, values = zip(*entries)
+        rows = np.array(rows, dtype=int)
+        cols = np.array(cols, dtype=int)
+        values = np.array(values, dtype=float)
+        hessian[rows, cols] = values
+        hessian[cols, rows] = values
+    return hessian
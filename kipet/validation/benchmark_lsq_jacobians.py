@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmark of the residual/jacobian evaluations used by the scipy least squares
+# subproblems of the VarianceEstimator (formulations 22 and 25 in weifengs paper).
+# Compares the former loop based closures against the vectorized functions.
+#
+# usage: python benchmark_lsq_jacobians.py [n_times] [n_wavelengths] [n_components]
+
+from __future__ import print_function
+from kipet.library.VarianceEstimator import (lsq_jacobian_pattern,
+                                             lsq_residual_S,
+                                             lsq_jacobian_S,
+                                             lsq_residual_C,
+                                             lsq_jacobian_C)
+from scipy.sparse import coo_matrix
+import numpy as np
+import time
+import sys
+
+
+def loop_F_S(x, z_array, d_array, nl, nt, nc):
+    diff = np.zeros(nt*nl)
+    for i in range(nt):
+        for j in range(nl):
+            diff[i*nl+j] = d_array[i, j]-sum(z_array[i*nc+k]*x[j*nc+k] for k in range(nc))
+    return diff
+
+
+def loop_JF_S(x, z_array, d_array, nl, nt, nc):
+    row = []
+    col = []
+    data = []
+    for i in range(nt):
+        for j in range(nl):
+            for k in range(nc):
+                row.append(i*nl+j)
+                col.append(j*nc+k)
+                data.append(-z_array[i*nc+k])
+    return coo_matrix((data, (row, col)),
+                      shape=(nt*nl, nc*nl))
+
+
+def loop_F_C(x, s_array, d_array, nl, nt, nc):
+    diff = np.zeros(nt*nl)
+    for i in range(nt):
+        for j in range(nl):
+            diff[i*nl+j] = d_array[i, j]-sum(s_array[j*nc+k]*x[i*nc+k] for k in range(nc))
+    return diff
+
+
+def loop_JF_C(x, s_array, d_array, nl, nt, nc):
+    row = []
+    col = []
+    data = []
+    for i in range(nt):
+        for j in range(nl):
+            for k in range(nc):
+                row.append(i*nl+j)
+                col.append(i*nc+k)
+                data.append(-s_array[j*nc+k])
+    return coo_matrix((data, (row, col)),
+                      shape=(nt*nl, nc*nt))
+
+
+def best_time(f, *args, **kwds):
+    repeat = kwds.pop('repeat', 3)
+    times = []
+    for i in range(repeat):
+        t0 = time.time()
+        f(*args)
+        times.append(time.time()-t0)
+    return min(times)
+
+
+if __name__ == "__main__":
+
+    nt = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    nl = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    nc = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    rng = np.random.RandomState(0)
+    z_array = rng.rand(nt*nc)
+    s_array = rng.rand(nl*nc)
+    c_array = rng.rand(nt*nc)
+    d_array = rng.rand(nt, nl)
+
+    s_jac = lsq_jacobian_pattern(nt, nl, nc, wrt='S')
+    c_jac = lsq_jacobian_pattern(nt, nl, nc, wrt='C')
+
+    # check both implementations agree
+    args_s = (z_array, d_array, nl, nt, nc)
+    args_c = (s_array, d_array, nl, nt, nc)
+    assert np.allclose(loop_F_S(s_array, *args_s), lsq_residual_S(s_array, *args_s))
+    assert np.allclose(loop_F_C(c_array, *args_c), lsq_residual_C(c_array, *args_c))
+    assert abs(loop_JF_S(s_array, *args_s)-lsq_jacobian_S(s_array, *(args_s+(s_jac,)))).max() == 0.0
+    assert abs(loop_JF_C(c_array, *args_c)-lsq_jacobian_C(c_array, *(args_c+(c_jac,)))).max() == 0.0
+
+    print("n_times={} n_wavelengths={} n_components={}".format(nt, nl, nc))
+    print("{: >12} {: >14} {: >14} {: >10}".format('evaluation', 'loops [s]', 'vectorized [s]', 'speedup'))
+    timings = [('F (S)', best_time(loop_F_S, s_array, *args_s, repeat=1),
+                best_time(lsq_residual_S, s_array, *args_s)),
+               ('JF (S)', best_time(loop_JF_S, s_array, *args_s, repeat=1),
+                best_time(lsq_jacobian_S, s_array, *(args_s+(s_jac,)))),
+               ('F (C)', best_time(loop_F_C, c_array, *args_c, repeat=1),
+                best_time(lsq_residual_C, c_array, *args_c)),
+               ('JF (C)', best_time(loop_JF_C, c_array, *args_c, repeat=1),
+                best_time(lsq_jacobian_C, c_array, *(args_c+(c_jac,))))]
+    for name, t_loop, t_vec in timings:
+        print("{: >12} {: >14.4f} {: >14.6f} {: >10.1f}".format(name, t_loop, t_vec, t_loop/max(t_vec, 1e-12)))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Benchmark of TemplateBuilder.create_pyomo_model for spectral problems of growing size
+# (n_times x n_wavelengths data points in D). Only the model construction is timed,
+# no discretization or solve.
+#
+# usage: python benchmark_model_construction.py [max_data_points]
+
+from __future__ import print_function
+from kipet.library.TemplateBuilder import *
+import pandas as pd
+import numpy as np
+import time
+import sys
+
+
+def rule_odes(m, t):
+    exprs = dict()
+    exprs['A'] = -m.P['k1']*m.Z[t, 'A']
+    exprs['B'] = m.P['k1']*m.Z[t, 'A']-m.P['k2']*m.Z[t, 'B']
+    exprs['C'] = m.P['k2']*m.Z[t, 'B']
+    return exprs
+
+
+def synthetic_spectra(n_times, n_wavelengths, seed=0):
+    rng = np.random.RandomState(seed)
+    times = np.linspace(0.0, 10.0, n_times)
+    lambdas = np.linspace(1600.0, 2400.0, n_wavelengths)
+    k1, k2 = 2.0, 0.2
+    A = np.exp(-k1*times)
+    B = k1/(k2-k1)*(np.exp(-k1*times)-np.exp(-k2*times))
+    C = np.column_stack((A, B, 1.0-A-B))
+    S = np.column_stack([np.exp(-((lambdas-c)/80.0)**2) for c in (1800.0, 2000.0, 2200.0)])
+    D = C.dot(S.T) + 1e-3*rng.normal(size=(n_times, n_wavelengths))
+    return pd.DataFrame(D, index=times, columns=lambdas)
+
+
+def build(D_frame):
+    builder = TemplateBuilder()
+    builder.add_mixture_component({'A': 1.0, 'B': 0.0, 'C': 0.0})
+    builder.add_parameter('k1', bounds=(0.0, 5.0))
+    builder.add_parameter('k2', bounds=(0.0, 1.0))
+    builder.add_spectral_data(D_frame)
+    builder.set_odes_rule(rule_odes)
+    return builder.create_pyomo_model(0.0, 10.0)
+
+
+if __name__ == "__main__":
+
+    max_points = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10**6
+    sizes = [(100, 100), (200, 500), (500, 1000), (1000, 1000)]
+
+    print("{: >8} {: >12} {: >12} {: >16}".format('times', 'wavelengths', 'points', 'construction [s]'))
+    for n_times, n_wavelengths in sizes:
+        if n_times*n_wavelengths > max_points:
+            break
+        D_frame = synthetic_spectra(n_times, n_wavelengths)
+        t0 = time.time()
+        model = build(D_frame)
+        elapsed = time.time()-t0
+        assert len(model.D) == n_times*n_wavelengths
+        print("{: >8} {: >12} {: >12} {: >16.3f}".format(n_times, n_wavelengths, n_times*n_wavelengths, elapsed))
@@ -0,0 +1,73 @@
+from kipet.library.TemplateBuilder import TemplateBuilder
+from kipet.library.CasadiParameterEstimator import CasadiParameterEstimator
+import numpy as np
+import pandas as pd
+import unittest
+
+
+def rule_odes(m, t):
+    exprs = dict()
+    exprs['A'] = -m.P['k1']*m.Z[t, 'A']
+    exprs['B'] = m.P['k1']*m.Z[t, 'A']-m.P['k2']*m.Z[t, 'B']
+    exprs['C'] = m.P['k2']*m.Z[t, 'B']
+    return exprs
+
+
+def exact_abc(times, k1, k2):
+    A = np.exp(-k1*times)
+    B = k1/(k2-k1)*(np.exp(-k1*times)-np.exp(-k2*times))
+    return np.column_stack((A, B, 1.0-A-B))
+
+
+def abc_estimator(bounds=None, init=None, noise=0.0):
+    times = np.linspace(0.5, 10.0, 20)
+    data = exact_abc(times, 2.0, 0.2)
+    data += noise*np.random.RandomState(0).randn(*data.shape)
+
+    builder = TemplateBuilder()
+    builder.add_mixture_component({'A': 1.0, 'B': 0.0, 'C': 0.0})
+    builder.add_parameter('k1', bounds=bounds, init=init)
+    builder.add_parameter('k2', bounds=(0.0, 1.0))
+    builder.set_odes_rule(rule_odes)
+    builder._concentration_data = pd.DataFrame(data, index=times, columns=['A', 'B', 'C'])
+    return CasadiParameterEstimator(builder.create_casadi_model(0.0, 10.0))
+
+
+class TestCasadiParameterEstimator(unittest.TestCase):
+
+    solver_opts = {'abstol': 1e-10, 'reltol': 1e-10}
+
+    def test_initial_parameters_inside_bounds(self):
+        estimator = abc_estimator(bounds=(3.0, 5.0))
+        np.testing.assert_array_equal(estimator._initial_parameters(), [4.0, 0.5])
+
+        estimator = abc_estimator(bounds=(3.0, 5.0), init=1.0)
+        results = estimator.run_opt('cvodes', max_iter=0, solver_opts=self.solver_opts)
+        self.assertEqual(results.P['k1'], 3.0)
+
+    def test_single_shooting_recovers_parameters(self):
+        estimator = abc_estimator(bounds=(0.0, 10.0))
+        results = estimator.run_opt('cvodes', solver_opts=self.solver_opts, tol=1e-12)
+        self.assertAlmostEqual(results.P['k1'], 2.0, places=6)
+        self.assertAlmostEqual(results.P['k2'], 0.2, places=6)
+        self.assertLess(results.solver_statistics['objective'], 1e-12)
+
+    def test_multiple_shooting_matches_single_shooting(self):
+        variances = {'A': 1e-4, 'B': 1e-4, 'C': 1e-4}
+        solver_opts = {'abstol': 1e-12, 'reltol': 1e-12}
+        reference = abc_estimator(bounds=(0.0, 10.0), noise=0.01).run_opt(
+            'cvodes', variances=variances, covariance=True, solver_opts=solver_opts, tol=1e-14)
+        for n_segments in [1, 2, 5]:
+            estimator = abc_estimator(bounds=(0.0, 10.0), noise=0.01)
+            results = estimator.run_opt('cvodes', method='multiple_shooting', n_segments=n_segments,
+                                        variances=variances, covariance=True, solver_opts=solver_opts,
+                                        tol=1e-14)
+            self.assertEqual(results.solver_statistics['segments'], n_segments)
+            for name in ['k1', 'k2']:
+                self.assertAlmostEqual(results.P[name], reference.P[name], delta=1e-9)
+            np.testing.assert_allclose(results.covariance.values, reference.covariance.values,
+                                       rtol=1e-9, atol=1e-14)
+
+
+if __name__ == '__main__':
+    unittest.main()
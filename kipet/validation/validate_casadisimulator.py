@@ -0,0 +1,98 @@
+from kipet.library.TemplateBuilder import TemplateBuilder
+from kipet.library.CasadiSimulator import CasadiSimulator, compile_function
+import casadi as ca
+import numpy as np
+import pandas as pd
+import shutil
+import tempfile
+import os
+import unittest
+
+
+def rule_odes(m, t):
+    exprs = dict()
+    exprs['A'] = -m.P['k1']*m.Z[t, 'A']
+    exprs['B'] = m.P['k1']*m.Z[t, 'A']-m.P['k2']*m.Z[t, 'B']
+    exprs['C'] = m.P['k2']*m.Z[t, 'B']
+    return exprs
+
+
+def abc_simulator(k1=2.0, k2=0.2, nfe=50):
+    builder = TemplateBuilder()
+    builder.add_mixture_component({'A': 1.0, 'B': 0.0, 'C': 0.0})
+    builder.add_parameter('k1', k1)
+    builder.add_parameter('k2', k2)
+    builder.set_odes_rule(rule_odes)
+    sim = CasadiSimulator(builder.create_casadi_model(0.0, 10.0))
+    sim.apply_discretization('integrator', nfe=nfe)
+    return sim
+
+
+def exact_abc(times, k1, k2):
+    A = np.exp(-k1*times)
+    B = k1/(k2-k1)*(np.exp(-k1*times)-np.exp(-k2*times))
+    return np.column_stack((A, B, 1.0-A-B))
+
+
+class TestCasadiSimulator(unittest.TestCase):
+
+    solver_opts = {'abstol': 1e-10, 'reltol': 1e-10}
+
+    def test_run_sim_exact(self):
+        sim = abc_simulator()
+        results = sim.run_sim('cvodes', solver_opts=self.solver_opts)
+        times = np.array(results.Z.index, dtype=float)
+        Z = results.Z[['A', 'B', 'C']].values
+        self.assertLess(np.abs(Z-exact_abc(times, 2.0, 0.2)).max(), 1e-7)
+
+    def test_run_ensemble_matches_run_sim(self):
+        sim = abc_simulator()
+        reference = sim.run_sim('cvodes', solver_opts=self.solver_opts)
+        parameters = pd.DataFrame({'k1': [2.0, 1.5, 3.0], 'k2': [0.2, 0.3, 0.1]})
+        ensemble = sim.run_ensemble('cvodes', parameters, solver_opts=self.solver_opts,
+                                    quantiles=[0.5])
+
+        self.assertEqual(ensemble['trajectories'].shape, (3, len(reference.Z.index), 3))
+        columns = [ensemble['states'].index(k) for k in ['A', 'B', 'C']]
+        np.testing.assert_array_equal(ensemble['trajectories'][0][:, columns],
+                                      reference.Z[['A', 'B', 'C']].values)
+
+        times = np.array(ensemble['times'], dtype=float)
+        for i in range(1, 3):
+            k1, k2 = parameters.iloc[i]
+            exact = exact_abc(times, k1, k2)
+            self.assertLess(np.abs(ensemble['trajectories'][i][:, columns]-exact).max(), 1e-7)
+        self.assertEqual(ensemble['quantiles'][0.5].shape, ensemble['trajectories'][0].shape)
+
+
+class TestCompileFunction(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_compiled_function_is_cached(self):
+        x = ca.SX.sym('x', 3)
+        function = ca.Function('validate_rhs', [x], [ca.sin(x)*x[0]])
+        cwd = os.getcwd()
+        compiled = compile_function(function, self.directory)
+        self.assertEqual(os.getcwd(), cwd)
+        libraries = os.listdir(self.directory)
+        self.assertEqual(len(libraries), 1)
+        np.testing.assert_allclose(np.array(compiled([1.0, 2.0, 3.0])),
+                                   np.array(function([1.0, 2.0, 3.0])), rtol=1e-14)
+
+        compile_function(function, self.directory)
+        self.assertEqual(os.listdir(self.directory), libraries)
+
+    def test_run_sim_compiled(self):
+        sim = abc_simulator()
+        reference = sim.run_sim('cvodes')
+        results = sim.run_sim('cvodes', compile_rhs=True, codegen_dir=self.directory)
+        np.testing.assert_allclose(results.Z.values, reference.Z.values, rtol=1e-12, atol=1e-14)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+from kipet.library.data_tools import basic_pca
+import numpy as np
+import pandas as pd
+import unittest
+
+
+def spectra(n_times, n_wavelengths, rank, noise, seed=0):
+    rng = np.random.RandomState(seed)
+    D = 10.0*rng.rand(n_times, rank).dot(rng.rand(rank, n_wavelengths))
+    return pd.DataFrame(D + noise*rng.randn(n_times, n_wavelengths))
+
+
+class TestBasicPCA(unittest.TestCase):
+
+    def test_suggested_rank(self):
+        for method in ['full', 'randomized', 'lanczos']:
+            results = basic_pca(spectra(30, 20, 3, 0.01), method=method, plot=False, seed=0)
+            self.assertEqual(results['suggested_rank'], 3)
+
+    def test_suggested_rank_without_tail(self):
+        # the default rank covers all singular values of small data sets
+        self.assertEqual(basic_pca(spectra(6, 8, 2, 0.01), plot=False)['suggested_rank'], 2)
+        ranks = [basic_pca(pd.DataFrame(np.random.RandomState(seed).randn(4, 5)), plot=False)['suggested_rank']
+                 for seed in range(100)]
+        self.assertLessEqual(np.count_nonzero(ranks), 5)
+        self.assertLessEqual(max(ranks), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+from pyomo.environ import ConcreteModel, Var, Param, Constraint, RangeSet
+from kipet.library.fe_factory import newton_element_solver, found_casadi, found_expr_visitor
+import numpy as np
+import unittest
+
+
+def implicit_euler_model(n, h, x0):
+    """Implicit Euler steps of dx/dt = -x**2 as a square system"""
+    m = ConcreteModel()
+    m.i = RangeSet(1, n)
+    m.h = Param(initialize=h, mutable=True)
+    m.x0 = Var(initialize=x0)
+    m.x0.fix()
+    m.x = Var(m.i, initialize=x0, bounds=(0.0, None))
+
+    def _step(m, i):
+        x_prev = m.x0 if i == 1 else m.x[i - 1]
+        return m.x[i] == x_prev - m.h * m.x[i] ** 2
+    m.step = Constraint(m.i, rule=_step)
+    return m
+
+
+def exact_implicit_euler(n, h, x0):
+    x = list()
+    for i in range(n):
+        x0 = (-1.0 + np.sqrt(1.0 + 4.0 * h * x0)) / (2.0 * h)
+        x.append(x0)
+    return np.array(x)
+
+
+@unittest.skipUnless(found_casadi and found_expr_visitor, 'the Newton element solver needs casadi and pyomo >= 5.5')
+class TestNewtonElementSolver(unittest.TestCase):
+
+    def test_implicit_euler(self):
+        m = implicit_euler_model(20, 0.5, 2.0)
+        solver = newton_element_solver(m, tol=1e-12)
+        converged, iterations, residual = solver.solve()
+        self.assertTrue(converged)
+        self.assertLessEqual(residual, 1e-12)
+        np.testing.assert_allclose([m.x[i].value for i in m.i], exact_implicit_euler(20, 0.5, 2.0),
+                                   rtol=1e-10)
+
+    def test_new_parameters_reuse_function(self):
+        m = implicit_euler_model(10, 0.5, 2.0)
+        solver = newton_element_solver(m, tol=1e-12)
+        self.assertTrue(solver.solve()[0])
+
+        m.h = 0.1
+        m.x0.fix(3.0)
+        self.assertTrue(solver.solve()[0])
+        np.testing.assert_allclose([m.x[i].value for i in m.i], exact_implicit_euler(10, 0.1, 3.0),
+                                   rtol=1e-10)
+
+    def test_not_square(self):
+        m = implicit_euler_model(5, 0.5, 2.0)
+        m.step[1].deactivate()
+        self.assertRaises(RuntimeError, newton_element_solver, m)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+from kipet.library.TemplateBuilder import TemplateBuilder
+from kipet.library.ModelCache import ModelCache
+import numpy as np
+import pandas as pd
+import shutil
+import tempfile
+import os
+import unittest
+
+
+def rule_odes(m, t):
+    exprs = dict()
+    exprs['A'] = -m.P['k']*m.Z[t, 'A']
+    exprs['B'] = m.P['k']*m.Z[t, 'A']
+    exprs['V'] = 0.0*m.X[t, 'V']
+    return exprs
+
+
+class TestModelCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.discretization = {'nfe': 4, 'ncp': 3, 'scheme': 'LAGRANGE-RADAU'}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def builder(self, k, spectral=False):
+        builder = TemplateBuilder()
+        builder.add_mixture_component({'A': 1.0, 'B': 0.0})
+        builder.add_complementary_state_variable({'V': 1.0})
+        builder.add_parameter('k', k)
+        builder.set_odes_rule(rule_odes)
+        if spectral:
+            builder._spectral_data = pd.DataFrame(np.ones((3, 2)), index=[0.25, 0.5, 1.0], columns=[400.0, 500.0])
+        return builder
+
+    def test_memory_hit(self):
+        cache = ModelCache()
+        first = cache.get_model(self.builder(0.5), 0.0, 1.0, self.discretization)
+        second = cache.get_model(self.builder(0.7), 0.0, 1.0, self.discretization)
+        self.assertEqual(len(cache), 1)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.P['k'].value, 0.5)
+        self.assertEqual(second.P['k'].value, 0.7)
+        self.assertEqual(sorted(first.time), sorted(second.time))
+
+    def test_disk_round_trip(self):
+        first = ModelCache(self.directory).get_model(self.builder(0.5), 0.0, 1.0, self.discretization)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+        # a fresh cache must load the model from disk instead of building it again
+        builder = self.builder(0.7)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('model was rebuilt')
+
+        builder.create_pyomo_model = fail
+        cache = ModelCache(self.directory)
+        model = cache.get_model(builder, 0.0, 1.0, self.discretization)
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(sorted(model.time), sorted(first.time))
+        self.assertEqual(model.time.get_discretization_info()['nfe'], 4)
+        self.assertEqual(model.P['k'].value, 0.7)
+        self.assertTrue(model.P['k'].fixed)
+        self.assertEqual(len(model.dZdt), len(first.dZdt))
+
+    def test_structure_change_misses(self):
+        cache = ModelCache()
+        cache.get_model(self.builder(0.5), 0.0, 1.0, self.discretization)
+        cache.get_model(self.builder(0.5), 0.0, 2.0, self.discretization)
+        self.assertEqual(len(cache), 2)
+
+    def test_non_absorbing_species(self):
+        cache = ModelCache()
+        plain = cache.get_model(self.builder(0.5, spectral=True), 0.0, 1.0, self.discretization)
+
+        builder = self.builder(0.5, spectral=True)
+        builder.set_non_absorbing_species(builder.create_pyomo_model(0.0, 1.0), ['B'])
+        first = cache.get_model(builder, 0.0, 1.0, self.discretization)
+        second = cache.get_model(builder, 0.0, 1.0, self.discretization)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse(hasattr(plain, 'non_absorbing'))
+        for model in [first, second]:
+            self.assertEqual(list(model.non_absorbing), ['B'])
+            self.assertTrue(model.S[400.0, 'B'].fixed)
+
+    def test_known_absorbance(self):
+        cache = ModelCache()
+        cache.get_model(self.builder(0.5, spectral=True), 0.0, 1.0, self.discretization)
+
+        models = list()
+        for scale in [1.0, 2.0]:
+            builder = self.builder(0.5, spectral=True)
+            absorbance = pd.DataFrame({'A': [scale, 3.0*scale]}, index=[400.0, 500.0])
+            builder.set_known_absorbing_species(builder.create_pyomo_model(0.0, 1.0), ['A'], absorbance)
+            models.append(cache.get_model(builder, 0.0, 1.0, self.discretization))
+        self.assertEqual(len(cache), 2)
+        for scale, model in zip([1.0, 2.0], models):
+            self.assertEqual(list(model.known_absorbance), ['A'])
+            self.assertEqual(model.S[500.0, 'A'].value, 3.0*scale)
+            self.assertTrue(model.S[500.0, 'A'].fixed)
+
+
+if __name__ == '__main__':
+    unittest.main()
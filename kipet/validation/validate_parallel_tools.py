@@ -0,0 +1,38 @@
+from kipet.library.parallel_tools import fork_map
+import os
+import unittest
+
+
+def scaled_square(shared, task):
+    if task < 0:
+        raise ValueError('negative task')
+    return shared['scale']*task**2
+
+
+def process_id(shared, task):
+    return os.getpid()
+
+
+class TestForkMap(unittest.TestCase):
+
+    def test_results_in_task_order(self):
+        tasks = list(range(8))
+        for n_workers in [1, 3]:
+            results = fork_map(scaled_square, tasks, shared={'scale': 2}, n_workers=n_workers)
+            self.assertEqual(results, [(2*t**2, None) for t in tasks])
+
+    def test_errors_are_reported(self):
+        results = fork_map(scaled_square, [1, -1, 2], shared={'scale': 1}, n_workers=2)
+        self.assertEqual(results[0], (1, None))
+        self.assertEqual(results[2], (4, None))
+        value, error = results[1]
+        self.assertIsNone(value)
+        self.assertIn('negative task', error)
+
+    def test_serial_runs_in_calling_process(self):
+        results = fork_map(process_id, [0, 1], n_workers=1)
+        self.assertEqual([pid for pid, error in results], [os.getpid()]*2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+from kipet.library.sensitivity_io import scratch_directory, solve_in_directory, read_matrix, \
+    read_reduced_hessian
+from pyomo.environ import ConcreteModel, Var, Constraint, Objective, SolverFactory
+from pyomo.opt import TerminationCondition
+import numpy as np
+import shutil
+import sys
+import tempfile
+import os
+import unittest
+
+
+# ipopt stand in that writes a file by relative name (like k_aug) and a solution file
+_stub_solver = """#!{}
+import sys
+with open('dxdp_.dat', 'w') as f:
+    f.write('1.0 2.0\\n')
+with open(sys.argv[1][:-3] + '.sol', 'w') as f:
+    f.write('stub solver\\n\\nOptions\\n3\\n1\\n1\\n0\\n1\\n1\\n1\\n1\\n0.0\\n1.0\\nobjno 0 0\\n')
+"""
+
+
+class TestSensitivityIO(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write(self, name, text):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'w') as f:
+            f.write(text)
+        return filename
+
+    def test_read_matrix(self):
+        matrix = read_matrix(self.write('dxdp_.dat', '\n1.0 2.0 3.0\n4.0 5.0 6.0\n'))
+        np.testing.assert_array_equal(matrix, [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+        np.testing.assert_array_equal(read_matrix(self.write('row.dat', '1.0 2.0\n')), [1.0, 2.0])
+        np.testing.assert_array_equal(read_matrix(self.write('column.dat', '1.0\n2.0\n')), [1.0, 2.0])
+        self.assertEqual(read_matrix(self.write('empty.dat', '\n')).size, 0)
+
+    def test_read_reduced_hessian(self):
+        output = ('RedHessian unscaled\n'
+                  'RedHessian unscaled[    0,    0]=2.0e+00\n'
+                  'RedHessian unscaled[    1,    0]=-5.0e-01\n'
+                  'RedHessian unscaled[    1,    1]=3.0e+00\n')
+        hessian = read_reduced_hessian(output, 2)
+        np.testing.assert_array_equal(hessian, [[2.0, -0.5], [-0.5, 3.0]])
+
+    def test_scratch_directory(self):
+        os.chdir(self.directory)
+        self.write('ipopt.opt', 'linear_solver ma57\n')
+        with scratch_directory() as path:
+            self.assertEqual(os.getcwd(), self.directory)
+            self.assertTrue(os.path.isabs(path))
+            with open(os.path.join(path, 'ipopt.opt')) as f:
+                self.assertEqual(f.read(), 'linear_solver ma57\n')
+        self.assertFalse(os.path.exists(path))
+
+    def test_solve_in_directory(self):
+        executable = self.write('stub_solver', _stub_solver.format(sys.executable))
+        os.chmod(executable, 0o755)
+        m = ConcreteModel()
+        m.x = Var(initialize=0.5)
+        m.c = Constraint(expr=m.x == 1.0)
+        m.o = Objective(expr=m.x**2)
+        solver = SolverFactory('ipopt', executable=executable)
+
+        os.chdir(self.directory)
+        with scratch_directory() as path:
+            results = solve_in_directory(solver, path, m, logfile='solver.log')
+            self.assertEqual(os.getcwd(), self.directory)
+            np.testing.assert_array_equal(read_matrix(os.path.join(path, 'dxdp_.dat')), [1.0, 2.0])
+            self.assertTrue(os.path.isfile(os.path.join(path, 'solver.log')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'dxdp_.dat')))
+        self.assertEqual(results.solver.termination_condition, TerminationCondition.optimal)
+        self.assertEqual(m.x.value, 1.0)
+        self.assertNotIn('_execute_command', solver.__dict__)
+
+if __name__ == '__main__':
+    unittest.main()
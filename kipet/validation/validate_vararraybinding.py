@@ -0,0 +1,47 @@
+from pyomo.environ import ConcreteModel, Var, Set
+from kipet.library.VarArrayBinding import VarArrayBinding
+import numpy as np
+import unittest
+
+
+class TestVarArrayBinding(unittest.TestCase):
+
+    def setUp(self):
+        m = ConcreteModel()
+        m.t = Set(initialize=[0.0, 0.5, 1.0], ordered=True)
+        m.k = Set(initialize=['A', 'B'], ordered=True)
+        m.Z = Var(m.t, m.k)
+        self.model = m
+        self.binding = VarArrayBinding(m.Z, [1.0, 0.0, 0.5], ['B', 'A'])
+
+    def test_round_trip(self):
+        values = np.arange(6, dtype=float).reshape((3, 2))
+        self.binding.set_array(values)
+        self.assertEqual(self.model.Z[1.0, 'B'].value, 0.0)
+        self.assertEqual(self.model.Z[0.5, 'A'].value, 5.0)
+        np.testing.assert_array_equal(self.binding.get_array(), values)
+
+    def test_missing_values_are_nan(self):
+        self.model.Z[0.0, 'A'].value = 2.0
+        values = self.binding.get_array()
+        self.assertEqual(values[1, 1], 2.0)
+        self.assertEqual(np.isnan(values).sum(), 5)
+
+    def test_skip_nan_and_fix(self):
+        self.binding.set_array(1.0)
+        values = np.full((3, 2), np.nan)
+        values[2, 0] = 3.0
+        self.binding.set_array(values, skip_nan=True, fix=True)
+        self.assertEqual(self.model.Z[0.5, 'B'].value, 3.0)
+        self.assertTrue(self.model.Z[0.5, 'B'].fixed)
+        self.assertEqual(self.model.Z[0.0, 'A'].value, 1.0)
+        self.assertFalse(self.model.Z[0.0, 'A'].fixed)
+
+        self.binding.fix()
+        self.assertTrue(all(vd.fixed for vd in self.binding.var_data()))
+        self.binding.unfix()
+        self.assertFalse(any(vd.fixed for vd in self.binding.var_data()))
+
+
+if __name__ == '__main__':
+    unittest.main()